@@ -0,0 +1,102 @@
+"""Compare solver backends on the same configs: time to the first feasible
+schedule and time to reach a relative gap on the phase 1 objective (the
+maximum 6-week average hours).
+
+Each backend gets a freshly built model. Time to first feasible is measured
+by a solve stopping at the first incumbent, time to gap by a solve stopping
+once the gap target is met; '-' marks a target not reached within the time
+limit. Backends that are not installed or licensed are reported and skipped.
+
+usage: python benchmarks/backends.py config.yaml [config.yaml ...]
+           [--backends gurobi highs cpsat] [--gap 0.01] [--time-limit 600]
+"""
+import argparse
+import os
+import sys
+import time
+
+import gurobipy as gb
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from src.backends import makeBackend, backend_registry, BackendException
+from src.domain import buildDomain
+from src.heuristic import greedyHeuristic, orderSymmetryClasses
+from src.inputs import Config
+from src.model import schedulingModel
+from src.rules import RuleFactory, addVacation, addConferenceWeek, \
+    compileRules, addRulesToModel
+
+def build(model_config):
+    m = schedulingModel(model_config.gurobi, model_config.model,
+                        model_config.optimization)
+    rules = [ RuleFactory(rule_input)
+              for rule_input in model_config.rules]
+    addVacation(rules, model_config.residents)
+    addConferenceWeek(rules, model_config.residents, 38)
+    compileRules(rules, model_config.residents, model_config.services)
+    domain = buildDomain(rules, model_config.residents, model_config.services, m.n_weeks)
+    m.build_model(model_config.residents, model_config.services, domain)
+    if model_config.model['symmetry_breaking']:
+        m.add_symmetry_breaking(model_config.residents, model_config.services,
+                                model_config.symmetry_classes)
+    addRulesToModel(rules, m, model_config.residents, model_config.services)
+    if model_config.optimization['heuristic_start']:
+        start = greedyHeuristic(model_config.residents, model_config.services,
+                                domain).run(rules)
+        if model_config.model['symmetry_breaking']:
+            start = orderSymmetryClasses(start, model_config.symmetry_classes)
+        m.setStart(start)
+    m.add_maxima(model_config.residents, model_config.services)
+    return m
+
+def run_single(config_file, model_config, backend_name, gap, time_limit):
+    result = {'config': os.path.basename(config_file), 'backend': backend_name}
+    try:
+        m = build(model_config)
+        tic = time.perf_counter()
+        backend = makeBackend(backend_name, m.model, m.Threads,
+                              m.continuousScale(model_config.services))
+        result['load [s]'] = time.perf_counter() - tic
+        objective = m.max_hrs_per_interval.index
+
+        first = backend.solve(objective, {}, {'SolutionLimit': 1, 'TimeLimit': time_limit})
+        result['first [s]'] = first.runtime if first.hasSolution() else '-'
+
+        closed = backend.solve(objective, {}, {'MIPGap': gap, 'TimeLimit': time_limit})
+        result['gap [s]'] = closed.runtime if closed.status == 'optimal' else '-'
+        result['objective'] = closed.objective if closed.hasSolution() else '-'
+        result['bound'] = closed.bound if closed.bound is not None else '-'
+    except (BackendException, gb.GurobiError) as e:
+        print(backend_name+" skipped: "+str(e))
+        result['error'] = str(e)
+    return result
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Compare solver backends')
+    parser.add_argument('CONFIG_FILE', type=str, nargs='+',
+                        help='input yaml config files')
+    parser.add_argument('--backends', type=str, nargs='+',
+                        default=list(backend_registry.keys()),
+                        choices=list(backend_registry.keys()))
+    parser.add_argument('--gap', type=float, default=0.01,
+                        help='relative gap target')
+    parser.add_argument('--time-limit', type=float, default=600.,
+                        help='time limit per solve in seconds')
+    args = parser.parse_args()
+
+    results = []
+    for config_file in args.CONFIG_FILE:
+        model_config = Config(config_file)
+        for backend_name in args.backends:
+            results.append(run_single(config_file, model_config, backend_name,
+                                      args.gap, args.time_limit))
+
+    keys = ['config', 'backend', 'load [s]', 'first [s]', 'gap [s]', 'objective', 'bound']
+    print(' '.join('{:>12}'.format(k) for k in keys))
+    for res in results:
+        if 'error' in res:
+            print('{:>12} {:>12} {:}'.format(res['config'], res['backend'], res['error']))
+            continue
+        print(' '.join('{:>12.3f}'.format(res[k]) if isinstance(res[k], float)
+                       else '{:>12}'.format(str(res[k])) for k in keys))
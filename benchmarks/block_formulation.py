@@ -0,0 +1,82 @@
+"""Compare the aggregated and weak formulations of the in_blocks and
+single_block rules on the same config: matrix size, LP relaxation and
+root node bounds, solve time and optimum of the phase 1 objective (the
+maximum interval hours).
+
+usage: python benchmarks/block_formulation.py config.yaml
+"""
+import argparse
+import os
+import sys
+import time
+from gurobipy import GRB
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from src.domain import buildDomain
+from src.inputs import Config
+from src.model import schedulingModel
+from src.rules import RuleFactory, addVacation, addConferenceWeek, \
+    compileRules, addRulesToModel
+
+formulations = ['weak', 'aggregated']
+
+class rootBound:
+    """MIP callback keeping the last bound reported at the root node"""
+    def __init__(self):
+        self.bound = None
+
+    def __call__(self, model, where):
+        if where == GRB.Callback.MIPNODE \
+           and model.cbGet(GRB.Callback.MIPNODE_NODCNT) == 0:
+            self.bound = model.cbGet(GRB.Callback.MIPNODE_OBJBND)
+
+def run_single(model_config, blocks):
+    model_params = dict(model_config.model, blocks=blocks)
+    m = schedulingModel(model_config.gurobi, model_params)
+    rules = [ RuleFactory(rule_input)
+              for rule_input in model_config.rules]
+    addVacation(rules, model_config.residents)
+    addConferenceWeek(rules, model_config.residents, 38)
+
+    start = time.perf_counter()
+    compileRules(rules, model_config.residents, model_config.services)
+    domain = buildDomain(rules, model_config.residents, model_config.services, m.n_weeks)
+    m.build_model(model_config.residents, model_config.services, domain)
+    addRulesToModel(rules, m, model_config.residents, model_config.services)
+    m.add_maxima(model_config.residents, model_config.services)
+    m.model.setObjective(m.max_hrs_per_interval, GRB.MINIMIZE)
+    m.model.update()
+    build_time = time.perf_counter() - start
+    size = (m.model.NumConstrs, m.model.NumVars, m.model.NumNZs)
+
+    relaxed = m.model.relax()
+    relaxed.optimize()
+    root = rootBound()
+    m.model.optimize(root)
+
+    return {'blocks': blocks,
+            'rows': size[0],
+            'columns': size[1],
+            'nonzeros': size[2],
+            'build [s]': build_time,
+            'lp bound': relaxed.ObjVal,
+            'root bound': m.model.ObjBound if root.bound is None else root.bound,
+            'solve [s]': m.model.Runtime,
+            'nodes': int(m.model.NodeCount),
+            'objective': m.model.ObjVal}
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark block formulations')
+    parser.add_argument('CONFIG_FILE', type=str,
+                        help='input yaml config file')
+    args = parser.parse_args()
+
+    model_config = Config(args.CONFIG_FILE)
+    results = [ run_single(model_config, blocks) for blocks in formulations ]
+
+    keys = list(results[0].keys())
+    print(' '.join('{:>12}'.format(k) for k in keys))
+    for res in results:
+        print(' '.join('{:>12.3f}'.format(res[k]) if isinstance(res[k], float)
+                       else '{:>12}'.format(str(res[k])) for k in keys))
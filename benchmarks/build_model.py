@@ -0,0 +1,98 @@
+"""Compare model construction time and peak memory of the generator and
+matrix build paths, with and without the sparse variable domain, on the
+same config.
+
+Each variant runs in its own interpreter so that peak memory is not
+polluted by the previous build.
+
+usage: python benchmarks/build_model.py config.yaml
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from src.domain import buildDomain
+from src.inputs import Config
+from src.model import schedulingModel
+from src.rules import RuleFactory, addVacation, addConferenceWeek, \
+    compileRules, addRulesToModel
+
+variants = [('generator', 'dense'),
+            ('matrix', 'dense'),
+            ('matrix', 'lean'),
+            ('matrix', 'sparse'),
+            ('matrix', 'lean+sparse')]
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def run_single(config_file, build, options):
+    model_config = Config(config_file)
+    rss_before = peak_rss_mb()
+
+    m = schedulingModel(model_config.gurobi,
+                        {'build': build,
+                         'lean': 'lean' in options,
+                         'sparse_domain': 'sparse' in options})
+    rules = [ RuleFactory(rule_input)
+              for rule_input in model_config.rules]
+    addVacation(rules, model_config.residents)
+    addConferenceWeek(rules, model_config.residents, 38)
+
+    start = time.perf_counter()
+    compileRules(rules, model_config.residents, model_config.services)
+    domain = buildDomain(rules, model_config.residents, model_config.services, m.n_weeks)
+    m.build_model(model_config.residents, model_config.services, domain)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    addRulesToModel(rules, m, model_config.residents, model_config.services)
+    rules_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    m.add_hours(model_config.residents, model_config.services)
+    m.model.update()
+    hours_time = time.perf_counter() - start
+
+    return {'build': build,
+            'options': options,
+            'build_model [s]': build_time,
+            'rules [s]': rules_time,
+            'hours [s]': hours_time,
+            'peak [MB]': peak_rss_mb(),
+            'model [MB]': peak_rss_mb() - rss_before,
+            'columns': m.model.NumVars,
+            'rows': m.model.NumConstrs,
+            'nonzeros': m.model.NumNZs}
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark model construction')
+    parser.add_argument('CONFIG_FILE', type=str,
+                        help='input yaml config file')
+    parser.add_argument('--single', nargs=2, metavar=('BUILD', 'OPTIONS'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        result = run_single(args.CONFIG_FILE, args.single[0], args.single[1])
+        print(json.dumps(result))
+        sys.exit(0)
+
+    results = []
+    for build, options in variants:
+        out = subprocess.run([sys.executable, __file__, args.CONFIG_FILE,
+                              '--single', build, options],
+                             capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    keys = list(results[0].keys())
+    print(' '.join('{:>16}'.format(k) for k in keys))
+    for res in results:
+        print(' '.join('{:>16.3f}'.format(res[k]) if isinstance(res[k], float)
+                       else '{:>16}'.format(str(res[k])) for k in keys))
@@ -0,0 +1,60 @@
+"""Compare the column generation solve with the full model on the same
+config: time, both objectives, and the column generation lower bound on
+the interval hours. --no-full skips the full model on instances too large
+for it.
+
+usage: python benchmarks/column_generation.py config.yaml [--pricing-columns 3] [--no-full]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from rolling_horizon import prepare, run_full
+from src.colgen import columnGeneration
+from src.inputs import Config
+
+def run_colgen(model_config, pricing_columns):
+    rules, domain = prepare(model_config)
+    optimization_params = dict(model_config.optimization, pricing_columns=pricing_columns)
+    start = time.perf_counter()
+    solver = columnGeneration(model_config.gurobi, model_config.model, optimization_params)
+    m = solver.run(model_config.residents, model_config.services, rules, domain,
+                   model_config.symmetry_classes)
+    phase1 = [ it for it in solver.iterations if it['phase'] == 1 ]
+    return solver.iterations, {'solve': 'colgen',
+                               'time [s]': time.perf_counter() - start,
+                               'interval': m.max_avg_hours_per_interval,
+                               'year': m.max_avg_hours_per_year,
+                               'bound': max(it['bound'] for it in phase1) if phase1
+                               else float('nan')}
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the column generation solve')
+    parser.add_argument('CONFIG_FILE', type=str,
+                        help='input yaml config file')
+    parser.add_argument('--pricing-columns', type=int, default=3,
+                        help='patterns each pricing problem may return')
+    parser.add_argument('--no-full', action='store_true',
+                        help='skip the full model')
+    args = parser.parse_args()
+
+    model_config = Config(args.CONFIG_FILE)
+    iterations, colgen = run_colgen(model_config, args.pricing_columns)
+    results = [colgen]
+    if not args.no_full:
+        results.insert(0, dict(run_full(model_config), bound=float('nan')))
+
+    keys = ['phase', 'iteration', 'columns', 'master', 'bound', 'time [s]']
+    print(' '.join('{:>12}'.format(k) for k in keys))
+    for it in iterations:
+        print(' '.join('{:>12.3f}'.format(it[k]) if isinstance(it[k], float)
+                       else '{:>12}'.format(str(it[k])) for k in keys))
+
+    keys = list(colgen.keys())
+    print(' '.join('{:>12}'.format(k) for k in keys))
+    for res in results:
+        print(' '.join('{:>12.3f}'.format(res[k]) if isinstance(res[k], float)
+                       else '{:>12}'.format(str(res[k])) for k in keys))
@@ -0,0 +1,82 @@
+"""Time exporting a pool of random schedules on a config's residents and
+services: the original per-entry write_csv loop against the vectorised
+extraction and each exporter.
+
+usage: python benchmarks/export.py config.yaml [--pool 100]
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from src.export import exporters, hoursSummary
+from src.inputs import Config
+from src.model import schedulingModel, solutionAssignment
+
+def legacy_write_csv(filename, values, residents, services):
+    """write_csv before vectorisation, scanning every service of every
+    resident-week"""
+    with open(filename, 'w') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Name'] +
+                        ['Week '+str(w+2) for w in range(schedulingModel.n_weeks)])
+        for r_idx, r in enumerate(residents):
+            line = [r.name]
+            for t in range(schedulingModel.n_weeks):
+                service_idxs = []
+                for s_idx in range(len(services)):
+                    if values[r_idx, s_idx, t] > 0.5:
+                        service_idxs.append(s_idx)
+                line.append(services[service_idxs[0]].name)
+            writer.writerow(line)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark schedule export')
+    parser.add_argument('CONFIG_FILE', type=str, help='input yaml config file')
+    parser.add_argument('--pool', type=int, default=100, help='schedules to export')
+    args = parser.parse_args()
+
+    model_config = Config(args.CONFIG_FILE)
+    residents, services = model_config.residents, model_config.services
+    shape = (len(residents), len(services), schedulingModel.n_weeks)
+    rng = np.random.default_rng(0)
+    pool = rng.integers(len(services), size=(args.pool, shape[0], shape[2]))
+    values = np.zeros((args.pool,) + shape)
+    k, r, t = np.indices(pool.shape)
+    values[k, r, pool, t] = 1.
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        filename = os.path.join(workdir, 'schedule')
+        start = time.perf_counter()
+        for v in values:
+            legacy_write_csv(filename, v, residents, services)
+        results.append(('legacy csv', time.perf_counter() - start))
+
+        start = time.perf_counter()
+        assignments = [ solutionAssignment(v) for v in values ]
+        results.append(('extraction', time.perf_counter() - start))
+
+        for fmt, exporter in exporters.items():
+            start = time.perf_counter()
+            try:
+                for a in assignments:
+                    exporter(filename, a, residents, services)
+            except Exception as e:
+                print(fmt+" skipped: "+str(e))
+                continue
+            results.append((fmt, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        hoursSummary(pool, services)
+        results.append(('hours (whole pool)', time.perf_counter() - start))
+
+    print("{:d} schedules of {:d} residents".format(args.pool, shape[0]))
+    for name, elapsed in results:
+        print("{:>20} {:10.4f}s {:10.3f}ms/schedule".format(name, elapsed,
+                                                         1000 * elapsed / args.pool))
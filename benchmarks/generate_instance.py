@@ -0,0 +1,165 @@
+"""Write a synthetic instance in the format Config reads: the service CSV,
+the AP1 and AP2 resident CSVs and a config.yaml with a mix of rules.
+
+Requirements leave a few elective weeks per resident and coverage upper
+bounds leave headroom over the demand, and rule targets are chosen so the
+rules agree with the requirements (in_blocks requirements are multiples of
+the block size, sequence pairs share their requirement), so generated
+instances are normally feasible.
+
+usage: python benchmarks/generate_instance.py OUTPUT_DIR [--ap1 10] [--ap2 10]
+           [--services 21] [--rules do_before=2,in_blocks=2,...] [--seed 0]
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from src.model import schedulingModel
+
+default_rules = {'do_before': 2, 'do_after': 1, 'in_blocks': 2, 'single_block': 1,
+                 'sequence': 1, 'upper_bound': 2}
+
+def parse_rule_mix(text):
+    mix = {}
+    for item in text.split(','):
+        if not item:
+            continue
+        rule_type, count = item.split('=')
+        if rule_type not in default_rules:
+            raise ValueError("Unknown rule type "+rule_type)
+        mix[rule_type] = int(count)
+    return mix
+
+def generate(output_dir, n_ap1=10, n_ap2=10, n_services=21,
+             rule_mix=None, seed=0, n_weeks=None, vacation_weeks=3):
+    """Write the instance into output_dir and return the config file name"""
+    if n_services < 4:
+        raise ValueError("Instances need Vacation, Conference, Elective and a clinical service")
+    n_weeks = n_weeks or schedulingModel.n_weeks
+    rule_mix = default_rules if rule_mix is None else rule_mix
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    clinical = [ "S"+str(i) for i in range(n_services - 3) ]
+    names = ["Vacation", "Conference", "Elective"] + clinical
+    hardness = {"Vacation": 0., "Conference": 10., "Elective": 40.}
+    hardness.update({ s: round(rng.uniform(45, 80), 1) for s in clinical })
+
+    #services targeted by rules, each used by at most one structural rule
+    targets = clinical[:]
+    rng.shuffle(targets)
+    #residents take no vacation beyond their vacation weeks, as in config.yaml
+    rules = [{'upper_bound': {'service': "Vacation", 'count': vacation_weeks}}]
+    block_size = {}
+    sequences = []
+    for _ in range(rule_mix.get('in_blocks', 0)):
+        if targets:
+            s = targets.pop()
+            block_size[s] = rng.choice([2, 4])
+            rules.append({'in_blocks': {'service': s, 'block_size': block_size[s]}})
+    for _ in range(rule_mix.get('sequence', 0)):
+        if len(targets) >= 2:
+            first, second = targets.pop(), targets.pop()
+            sequences.append((first, second))
+            rules.append({'sequence': {'first': first, 'second': second}})
+    for _ in range(rule_mix.get('single_block', 0)):
+        if targets:
+            rules.append({'single_block': {'service': targets.pop()}})
+    #weeks left open to each service by do_before/do_after
+    open_weeks = dict.fromkeys(clinical, n_weeks)
+    for rule_type in ['do_before', 'do_after']:
+        for _ in range(rule_mix.get(rule_type, 0)):
+            if targets:
+                s = targets.pop()
+                week = rng.randint(n_weeks//3, 2*n_weeks//3)
+                open_weeks[s] = week if rule_type == 'do_before' else n_weeks - week
+                rules.append({rule_type: {'service': s, 'week': week}})
+    for _ in range(rule_mix.get('upper_bound', 0)):
+        rules.append({'upper_bound': {'service': rng.choice(clinical)}})
+
+    n_residents = n_ap1 + n_ap2
+    demand = dict.fromkeys(names, 0)
+    residents = []
+    for year, count in [('AP1', n_ap1), ('AP2', n_ap2)]:
+        for i in range(count):
+            #vacation stays clear of the conference week fixed by the CLI
+            weeks = sorted(rng.sample([ w for w in range(2, n_weeks + 2) if w != 38 ],
+                                      vacation_weeks))
+            req = dict.fromkeys(names, "")
+            req["Vacation"] = str(vacation_weeks)
+            req["Conference"] = "Yes" if year == 'AP2' else "No"
+            #requirements fill about three quarters of the free weeks
+            budget = int(0.75 * (n_weeks - vacation_weeks - 1))
+            for s in rng.sample(clinical, len(clinical)):
+                if budget <= 0:
+                    break
+                if any(s == second for _, second in sequences):
+                    continue
+                weeks_on = min(rng.randint(1, 4), budget)
+                if s in block_size:
+                    weeks_on = block_size[s] * max(1, weeks_on // block_size[s])
+                second = [ b for a, b in sequences if a == s ]
+                if weeks_on * (1 + len(second)) > budget:
+                    continue
+                for ss in [s] + second:
+                    req[ss] = str(weeks_on)
+                budget -= weeks_on * (1 + len(second))
+            for s in clinical:
+                demand[s] += int(req[s] or 0)
+            residents.append((year, year+"_"+str(i), req,
+                              ", ".join("Week "+str(w) for w in weeks)))
+
+    with open(os.path.join(output_dir, 'services.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Service", "lb", "ub", "hardness", "ok_after_vacation"])
+        for s in names:
+            if s in clinical:
+                per_week = demand[s] / float(open_weeks[s])
+                ub = max(2, int(2 * per_week) + 1)
+                lb = 1 if per_week >= 2 and open_weeks[s] == n_weeks \
+                    and rng.random() < 0.3 else ""
+                writer.writerow([s, lb, min(ub, n_residents), hardness[s], "y"])
+            else:
+                writer.writerow([s, "", "", hardness[s], "y"])
+
+    for year in ['AP1', 'AP2']:
+        with open(os.path.join(output_dir, year.lower()+'.csv'), 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Name"] + names + ["Vacation weeks"])
+            for r_year, name, req, vacation in residents:
+                if r_year == year:
+                    writer.writerow([name] + [ req[s] for s in names ] + [vacation])
+
+    config = {'gurobi': {'Threads': 1},
+              'scheduling': {'service_requirements': os.path.join(output_dir, 'services.csv'),
+                             'ap1_residents': os.path.join(output_dir, 'ap1.csv'),
+                             'ap2_residents': os.path.join(output_dir, 'ap2.csv')},
+              'output': {'file': os.path.join(output_dir, 'schedule.csv')},
+              'rules': rules}
+    config_file = os.path.join(output_dir, 'config.yaml')
+    with open(config_file, 'w') as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+    return config_file
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic instance')
+    parser.add_argument('OUTPUT_DIR', type=str,
+                        help='directory for the CSVs and config.yaml')
+    parser.add_argument('--ap1', type=int, default=10, help='AP1 residents')
+    parser.add_argument('--ap2', type=int, default=10, help='AP2 residents')
+    parser.add_argument('--services', type=int, default=21,
+                        help='services, including Vacation and Conference')
+    parser.add_argument('--rules', type=str,
+                        default=','.join(k+'='+str(v) for k, v in default_rules.items()),
+                        help='rule mix as type=count pairs')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(generate(os.path.abspath(args.OUTPUT_DIR), args.ap1, args.ap2, args.services,
+                   parse_rule_mix(args.rules), args.seed))
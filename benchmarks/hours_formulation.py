@@ -0,0 +1,62 @@
+"""Compare the window and prefix-sum formulations of the hours constraints
+on the same config: matrix size, solve time and optimal objective.
+
+usage: python benchmarks/hours_formulation.py config.yaml
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from src.domain import buildDomain
+from src.inputs import Config
+from src.model import schedulingModel
+from src.rules import RuleFactory, addVacation, addConferenceWeek, \
+    compileRules, addRulesToModel
+
+formulations = ['window', 'prefix_sum']
+
+def run_single(model_config, hours):
+    model_params = dict(model_config.model, hours=hours)
+    m = schedulingModel(model_config.gurobi, model_params)
+    rules = [ RuleFactory(rule_input)
+              for rule_input in model_config.rules]
+    addVacation(rules, model_config.residents)
+    addConferenceWeek(rules, model_config.residents, 38)
+
+    start = time.perf_counter()
+    compileRules(rules, model_config.residents, model_config.services)
+    domain = buildDomain(rules, model_config.residents, model_config.services, m.n_weeks)
+    m.build_model(model_config.residents, model_config.services, domain)
+    addRulesToModel(rules, m, model_config.residents, model_config.services)
+    m.add_hours(model_config.residents, model_config.services)
+    m.model.update()
+    build_time = time.perf_counter() - start
+    size = (m.model.NumConstrs, m.model.NumVars, m.model.NumNZs)
+
+    m.optimize(model_config.residents, model_config.services)
+
+    return {'hours': hours,
+            'rows': size[0],
+            'columns': size[1],
+            'nonzeros': size[2],
+            'build [s]': build_time,
+            'solve [s]': m.model.Runtime,
+            'objective': m.max_avg_hours_per_year}
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark hours formulations')
+    parser.add_argument('CONFIG_FILE', type=str,
+                        help='input yaml config file')
+    args = parser.parse_args()
+
+    model_config = Config(args.CONFIG_FILE)
+    results = [ run_single(model_config, hours) for hours in formulations ]
+
+    keys = list(results[0].keys())
+    print(' '.join('{:>12}'.format(k) for k in keys))
+    for res in results:
+        print(' '.join('{:>12.3f}'.format(res[k]) if isinstance(res[k], float)
+                       else '{:>12}'.format(str(res[k])) for k in keys))
@@ -0,0 +1,65 @@
+"""Compare large neighbourhood search with the full model given the same
+wall-clock budget: the LNS improvement history and both final objectives.
+
+usage: python benchmarks/lns.py config.yaml [--budget 60] [--workers 2] [--sub-time 10]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from rolling_horizon import prepare, run_full
+from src.heuristic import greedyHeuristic, orderSymmetryClasses
+from src.inputs import Config
+from src.lns import largeNeighbourhoodSearch
+
+def run_lns(model_config, budget, workers, sub_time):
+    rules, domain = prepare(model_config)
+    start = greedyHeuristic(model_config.residents, model_config.services, domain).run(rules)
+    if model_config.model['symmetry_breaking']:
+        start = orderSymmetryClasses(start, model_config.symmetry_classes)
+    optimization_params = dict(model_config.optimization, lns_time=budget,
+                               lns_workers=workers, lns_sub_time=sub_time)
+    tic = time.perf_counter()
+    solver = largeNeighbourhoodSearch(model_config.gurobi, model_config.model,
+                                      optimization_params)
+    m = solver.run(model_config.residents, model_config.services, rules, domain,
+                   model_config.symmetry_classes, start)
+    return solver.history, {'solve': 'lns',
+                            'time [s]': time.perf_counter() - tic,
+                            'interval': m.max_avg_hours_per_interval,
+                            'year': m.max_avg_hours_per_year}
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark large neighbourhood search')
+    parser.add_argument('CONFIG_FILE', type=str,
+                        help='input yaml config file')
+    parser.add_argument('--budget', type=float, default=60.,
+                        help='wall-clock seconds for each solve')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='LNS worker processes')
+    parser.add_argument('--sub-time', type=float, default=10.,
+                        help='time limit per neighbourhood and phase')
+    args = parser.parse_args()
+
+    model_config = Config(args.CONFIG_FILE)
+    history, lns = run_lns(model_config, args.budget, args.workers, args.sub_time)
+    # the full model gets the budget split over its two phases
+    for phase in ['phase1', 'phase2']:
+        model_config.optimization[phase] = dict(model_config.optimization[phase],
+                                                TimeLimit=args.budget / 2)
+    full = run_full(model_config)
+
+    keys = ['time', 'neighbourhood', 'interval', 'year']
+    print(' '.join('{:>14}'.format(k) for k in keys))
+    for entry in history:
+        print('{:>14.3f} {:>14} {:>14.3f} {:>14.3f}'.format(
+            entry['time'], entry['neighbourhood'], entry['interval'], entry['year']))
+
+    keys = list(lns.keys())
+    print(' '.join('{:>14}'.format(k) for k in keys))
+    for res in [full, lns]:
+        print(' '.join('{:>14.3f}'.format(res[k]) if isinstance(res[k], float)
+                       else '{:>14}'.format(str(res[k])) for k in keys))
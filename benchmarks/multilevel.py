@@ -0,0 +1,61 @@
+"""Compare the coarse-to-fine multilevel solve with the full model on the
+same config: time and objectives of every level against the full solve.
+Only meaningful on instances small enough for the full model to solve.
+
+usage: python benchmarks/multilevel.py config.yaml [--coarse 2] [--radius 1] [--polish]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from rolling_horizon import prepare, run_full
+from src.inputs import Config
+from src.multilevel import multilevelSolve
+
+def run_multilevel(model_config, coarse_weeks, refine_radius, polish):
+    rules, domain = prepare(model_config)
+    optimization_params = dict(model_config.optimization, coarse_weeks=coarse_weeks,
+                               refine_radius=refine_radius, polish=polish)
+    start = time.perf_counter()
+    solver = multilevelSolve(model_config.gurobi, model_config.model, optimization_params)
+    m = solver.run(model_config.residents, model_config.services, rules, domain,
+                   model_config.symmetry_classes)
+    return solver.levels, {'solve': 'multilevel',
+                           'time [s]': time.perf_counter() - start,
+                           'interval': m.max_avg_hours_per_interval,
+                           'year': m.max_avg_hours_per_year}
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the multilevel solve')
+    parser.add_argument('CONFIG_FILE', type=str,
+                        help='input yaml config file')
+    parser.add_argument('--coarse', type=int, default=2,
+                        help='weeks per block of the coarse level')
+    parser.add_argument('--radius', type=int, default=1,
+                        help='weeks left free around each change of service')
+    parser.add_argument('--polish', action='store_true',
+                        help='finish with the full weekly model')
+    args = parser.parse_args()
+
+    model_config = Config(args.CONFIG_FILE)
+    full = run_full(model_config)
+    levels, multilevel = run_multilevel(model_config, args.coarse, args.radius, args.polish)
+
+    print(' '.join('{:>14}'.format(k) for k in ['level', 'variables', 'solve [s]',
+                                                'interval', 'year']))
+    for level in levels:
+        print('{:>14} {:>14d} {:>14.3f} {:>14.3f} {:>14.3f}'.format(
+            level['level'], level['variables'], level['solve [s]'],
+            level['interval'], level['year']))
+
+    for key in ['interval', 'year']:
+        multilevel[key+' loss'] = multilevel[key] - full[key]
+        full[key+' loss'] = 0.
+    keys = list(multilevel.keys())
+    print(' '.join('{:>14}'.format(k) for k in keys))
+    for res in [full, multilevel]:
+        print(' '.join('{:>14.3f}'.format(res[k]) if isinstance(res[k], float)
+                       else '{:>14}'.format(str(res[k])) for k in keys))
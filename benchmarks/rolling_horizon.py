@@ -0,0 +1,81 @@
+"""Compare the rolling horizon solve with the full model on the same config:
+solve time, both objectives and the optimality loss of the rolling horizon.
+Only meaningful on instances small enough for the full model to solve.
+
+usage: python benchmarks/rolling_horizon.py config.yaml [--window 16] [--step 8]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from src.domain import buildDomain
+from src.horizon import rollingHorizon
+from src.inputs import Config
+from src.model import schedulingModel
+from src.rules import RuleFactory, addVacation, addConferenceWeek, \
+    compileRules, addRulesToModel
+
+def prepare(model_config):
+    rules = [ RuleFactory(rule_input)
+              for rule_input in model_config.rules]
+    addVacation(rules, model_config.residents)
+    addConferenceWeek(rules, model_config.residents, 38)
+    compileRules(rules, model_config.residents, model_config.services)
+    domain = buildDomain(rules, model_config.residents, model_config.services,
+                         schedulingModel.n_weeks)
+    return rules, domain
+
+def run_full(model_config):
+    rules, domain = prepare(model_config)
+    start = time.perf_counter()
+    m = schedulingModel(model_config.gurobi, model_config.model,
+                        model_config.optimization)
+    m.build_model(model_config.residents, model_config.services, domain)
+    if model_config.model['symmetry_breaking']:
+        m.add_symmetry_breaking(model_config.residents, model_config.services,
+                                model_config.symmetry_classes)
+    addRulesToModel(rules, m, model_config.residents, model_config.services)
+    m.optimize(model_config.residents, model_config.services)
+    return {'solve': 'full',
+            'time [s]': time.perf_counter() - start,
+            'interval': m.max_avg_hours_per_interval,
+            'year': m.max_avg_hours_per_year}
+
+def run_rolling(model_config, window, step):
+    rules, domain = prepare(model_config)
+    optimization_params = dict(model_config.optimization,
+                               window_weeks=window, step_weeks=step)
+    start = time.perf_counter()
+    horizon = rollingHorizon(model_config.gurobi, model_config.model, optimization_params)
+    m = horizon.run(model_config.residents, model_config.services, rules, domain,
+                    model_config.symmetry_classes)
+    return {'solve': 'rolling',
+            'time [s]': time.perf_counter() - start,
+            'interval': m.max_avg_hours_per_interval,
+            'year': m.max_avg_hours_per_year}
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the rolling horizon solve')
+    parser.add_argument('CONFIG_FILE', type=str,
+                        help='input yaml config file')
+    parser.add_argument('--window', type=int, default=16,
+                        help='weeks solved integrally per window')
+    parser.add_argument('--step', type=int, default=8,
+                        help='weeks committed per window')
+    args = parser.parse_args()
+
+    model_config = Config(args.CONFIG_FILE)
+    full = run_full(model_config)
+    rolling = run_rolling(model_config, args.window, args.step)
+    for key in ['interval', 'year']:
+        rolling[key+' loss'] = rolling[key] - full[key]
+        full[key+' loss'] = 0.
+
+    keys = list(rolling.keys())
+    print(' '.join('{:>14}'.format(k) for k in keys))
+    for res in [full, rolling]:
+        print(' '.join('{:>14.3f}'.format(res[k]) if isinstance(res[k], float)
+                       else '{:>14}'.format(str(res[k])) for k in keys))
@@ -0,0 +1,169 @@
+"""Build/solve benchmark suite on synthetic instances of increasing size.
+
+For each size an instance is generated with generate_instance.py and run in
+its own interpreter, timing the parse, rule compilation and domain,
+build_model, rule application, hours, optimize and write_csv phases
+separately and recording peak memory and model size. Results are compared with a stored baseline; a phase
+slower than the baseline by more than --tolerance, or a model of a
+different size, is reported as a regression and the suite exits non-zero.
+
+usage: python benchmarks/suite.py [--sizes 5x5,10x10,20x20] [--time-limit 60]
+           [--backend gurobi] [--no-solve] [--baseline FILE] [--save-baseline]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from generate_instance import generate, parse_rule_mix, default_rules
+from src.domain import buildDomain
+from src.inputs import Config
+from src.model import schedulingModel
+from src.rules import RuleFactory, addVacation, addConferenceWeek, \
+    compileRules, addRulesToModel
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+phases = ['parse [s]', 'compile [s]', 'build_model [s]', 'rules [s]', 'hours [s]',
+          'optimize [s]', 'write_csv [s]']
+sizes = ['columns', 'rows', 'nonzeros']
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def run_single(config_file, backend, time_limit, solve):
+    result = {}
+    start = time.perf_counter()
+    model_config = Config(config_file)
+    result['parse [s]'] = time.perf_counter() - start
+
+    optimization = dict(model_config.optimization, backend=backend,
+                        phase1={'TimeLimit': time_limit}, phase2={'TimeLimit': time_limit})
+    m = schedulingModel(model_config.gurobi, model_config.model, optimization)
+    start = time.perf_counter()
+    rules = [ RuleFactory(rule_input)
+              for rule_input in model_config.rules]
+    addVacation(rules, model_config.residents)
+    addConferenceWeek(rules, model_config.residents, 38)
+    compileRules(rules, model_config.residents, model_config.services)
+    domain = buildDomain(rules, model_config.residents, model_config.services, m.n_weeks)
+    result['compile [s]'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    m.build_model(model_config.residents, model_config.services, domain)
+    m.model.update()
+    result['build_model [s]'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    addRulesToModel(rules, m, model_config.residents, model_config.services)
+    m.model.update()
+    result['rules [s]'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    m.add_maxima(model_config.residents, model_config.services)
+    m.model.update()
+    result['hours [s]'] = time.perf_counter() - start
+
+    result['columns'] = m.model.NumVars
+    result['rows'] = m.model.NumConstrs
+    result['nonzeros'] = m.model.NumNZs
+
+    result['status'] = 'not solved'
+    if solve:
+        start = time.perf_counter()
+        m.optimize(model_config.residents, model_config.services)
+        result['optimize [s]'] = time.perf_counter() - start
+        result['status'] = 'no solution'
+        if hasattr(m, 'max_avg_hours_per_year'):
+            result['status'] = 'solved'
+            result['interval'] = m.max_avg_hours_per_interval
+            result['year'] = m.max_avg_hours_per_year
+            start = time.perf_counter()
+            m.write_csv(model_config.output_filename, model_config.residents,
+                        model_config.services)
+            result['write_csv [s]'] = time.perf_counter() - start
+
+    result['peak [MB]'] = peak_rss_mb()
+    return result
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against the baseline, as messages"""
+    regressions = []
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        for key in sizes:
+            if key in base and res.get(key) != base[key]:
+                regressions.append("{:}: {:} {:} (baseline {:})".format(
+                    name, key, res.get(key), base[key]))
+        for key in phases + ['peak [MB]']:
+            if key in base and key in res and res[key] > base[key] * (1 + tolerance) \
+               and res[key] - base[key] > 0.05:
+                regressions.append("{:}: {:} {:.3f} (baseline {:.3f})".format(
+                    name, key, res[key], base[key]))
+    return regressions
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark suite on synthetic instances')
+    parser.add_argument('--sizes', type=str, default='5x5,10x10,20x20',
+                        help='comma separated AP1xAP2 resident counts')
+    parser.add_argument('--rules', type=str,
+                        default=','.join(k+'='+str(v) for k, v in default_rules.items()),
+                        help='rule mix as type=count pairs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', type=str, default='gurobi')
+    parser.add_argument('--time-limit', type=float, default=60.,
+                        help='time limit per objective phase in seconds')
+    parser.add_argument('--no-solve', action='store_true',
+                        help='time the build phases only')
+    parser.add_argument('--baseline', type=str, default=default_baseline)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown against the baseline')
+    parser.add_argument('--single', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single, args.backend, args.time_limit,
+                                    not args.no_solve)))
+        sys.exit(0)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes.split(','):
+            n_ap1, n_ap2 = [ int(n) for n in size.split('x') ]
+            config_file = generate(os.path.join(workdir, size), n_ap1, n_ap2,
+                                   rule_mix=parse_rule_mix(args.rules), seed=args.seed)
+            command = [sys.executable, __file__, '--single', config_file,
+                       '--backend', args.backend, '--time-limit', str(args.time_limit)]
+            if args.no_solve:
+                command.append('--no-solve')
+            out = subprocess.run(command, capture_output=True, text=True, check=True)
+            results[size] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    keys = phases + ['peak [MB]'] + sizes + ['status']
+    print(' '.join('{:>16}'.format(k) for k in ['instance'] + keys))
+    for name, res in results.items():
+        print('{:>16} '.format(name) +
+              ' '.join('{:>16.3f}'.format(res[k]) if isinstance(res.get(k), float)
+                       else '{:>16}'.format(str(res.get(k, '-'))) for k in keys))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Baseline written to "+args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print("Regression: "+message)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against "+args.baseline)
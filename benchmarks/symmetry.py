@@ -0,0 +1,81 @@
+"""Time-to-optimal with and without symmetry breaking on a synthetic cohort
+of interchangeable residents.
+
+usage: python benchmarks/symmetry.py [--residents 4] [--required 6] [--weeks 52]
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from src.domain import buildDomain
+from src.inputs import Resident, ClinicalService, residentTable, serviceTable
+from src.model import schedulingModel
+from src.rules import addVacation, compileRules, addRulesToModel
+
+def synthetic_cohort(n_per_year, n_required, n_weeks, seed=0, n_services=21):
+    """Two years of identical residents sharing requirements and vacation.
+    Each resident needs one week on each of the first n_required clinical
+    services, whose coverage is capped at n_per_year residents per week"""
+    rng = random.Random(seed)
+    services = [ClinicalService("Vacation", "", "", 0, 'y'),
+                ClinicalService("Conference", "", "", 10, 'y'),
+                #an unconstrained elective absorbs the remaining weeks
+                ClinicalService("Elective", "", "", 45, 'y')]
+    for i in range(n_services - len(services)):
+        services.append(ClinicalService("S"+str(i), "", str(n_per_year),
+                                        rng.uniform(40, 80), 'y'))
+
+    headers = [ s.name for s in services ] + ["Vacation weeks"]
+    residents = []
+    for year in ['AP1', 'AP2']:
+        data = ["1", "No", ""] + [ "1" if i < n_required else ""
+                                   for i in range(n_services - 3) ]
+        data += ["Week "+str(n_weeks//2 + 2)]
+        for i in range(n_per_year):
+            residents.append(Resident(year+"_"+str(i), year, headers, data))
+    services = serviceTable(services)
+    return residentTable(residents, services), services
+
+def solve(residents, services, symmetry_breaking, classes, time_limit):
+    gurobi_params = {'BestObjStop': 0, 'MIPFocus': 0, 'Threads': 1, 'Presolve': 2}
+    optimization_params = {'phase1': {'TimeLimit': time_limit},
+                           'phase2': {'TimeLimit': time_limit}}
+    m = schedulingModel(gurobi_params, None, optimization_params)
+    rules = []
+    addVacation(rules, residents)
+    compileRules(rules, residents, services)
+    m.build_model(residents, services,
+                  buildDomain(rules, residents, services, m.n_weeks))
+    addRulesToModel(rules, m, residents, services)
+    if symmetry_breaking:
+        m.add_symmetry_breaking(residents, services, classes)
+    m.optimize(residents, services)
+    return m.model.Runtime, m.max_avg_hours_per_interval, m.max_avg_hours_per_year
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark symmetry breaking')
+    parser.add_argument('--residents', type=int, default=4,
+                        help='residents per year')
+    parser.add_argument('--required', type=int, default=6,
+                        help='number of required clinical services')
+    parser.add_argument('--weeks', type=int, default=schedulingModel.n_weeks)
+    parser.add_argument('--time-limit', type=float, default=600)
+    args = parser.parse_args()
+
+    schedulingModel.n_weeks = args.weeks
+    residents, services = synthetic_cohort(args.residents, args.required, args.weeks)
+    classes = [ list(range(args.residents)),
+                list(range(args.residents, 2*args.residents)) ]
+
+    results = []
+    for symmetry_breaking in [False, True]:
+        results.append((symmetry_breaking,) +
+                       solve(residents, services, symmetry_breaking, classes, args.time_limit))
+
+    print('{:>18} {:>12} {:>16} {:>16}'.format('symmetry_breaking', 'time [s]',
+                                               'max interval hrs', 'max yearly hrs'))
+    for res in results:
+        print('{:>18} {:>12.2f} {:>16.2f} {:>16.2f}'.format(str(res[0]), *res[1:]))
@@ -0,0 +1,52 @@
+"""Time the solver-free verifier on random schedules of a config's
+residents and services: scoring the pool as one stack against scoring
+each schedule on its own, and the full violation messages per schedule.
+
+usage: python benchmarks/verify.py config.yaml [--pool 1000]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from rolling_horizon import prepare
+from src.inputs import Config
+from src.model import schedulingModel
+from src.verify import scheduleVerifier
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the schedule verifier')
+    parser.add_argument('CONFIG_FILE', type=str, help='input yaml config file')
+    parser.add_argument('--pool', type=int, default=1000, help='schedules to score')
+    args = parser.parse_args()
+
+    model_config = Config(args.CONFIG_FILE)
+    residents, services = model_config.residents, model_config.services
+    rules, _ = prepare(model_config)
+    verifier = scheduleVerifier(rules, residents, services)
+    rng = np.random.default_rng(0)
+    pool = rng.integers(len(services), size=(args.pool, len(residents), schedulingModel.n_weeks))
+
+    results = []
+    start = time.perf_counter()
+    verifier.score(pool)
+    results.append(('score (whole pool)', time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for schedule in pool:
+        verifier.score(schedule[None])
+    results.append(('score (one by one)', time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for schedule in pool:
+        verifier.check(schedule)
+    results.append(('check messages', time.perf_counter() - start))
+
+    print("{:d} schedules of {:d} residents, {:d} rules".format(args.pool, len(residents),
+                                                                len(rules)))
+    for name, elapsed in results:
+        print("{:>20} {:10.4f}s {:12.1f} schedules/s".format(name, elapsed,
+                                                           args.pool / elapsed))
@@ -0,0 +1,284 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+import gurobipy as gb
+from gurobipy import GRB
+
+class BackendException(Exception):
+    """Raise when a solver backend is unavailable or cannot solve the model"""
+
+class solveResult:
+    """Outcome of one backend solve. status is one of 'optimal', 'feasible',
+    'infeasible' or 'no_solution'; x holds a value per model column."""
+    def __init__(self, status, objective=None, bound=None, x=None, runtime=0.):
+        self.status = status
+        self.objective = objective
+        self.bound = bound
+        self.x = x
+        self.runtime = runtime
+
+    def hasSolution(self):
+        return self.x is not None
+
+class standardForm:
+    """Matrix form of a built Gurobi model: sparse rows with senses and right
+    hand sides, column bounds, integrality and MIP start (nan when unset).
+
+    The Gurobi model only serves as the algebraic layer here, building and
+    reading it does not need a licence."""
+    def __init__(self, model):
+        model.update()
+        variables = model.getVars()
+        constrs = model.getConstrs()
+        if model.NumQConstrs or model.NumGenConstrs or model.NumSOS:
+            raise BackendException("Only linear models can be passed to other backends")
+        self.A = model.getA().tocsr()
+        self.sense = np.array(model.getAttr('Sense', constrs), dtype='U1')
+        self.rhs = np.array(model.getAttr('RHS', constrs), dtype=float)
+        self.lb = np.array(model.getAttr('LB', variables), dtype=float)
+        self.ub = np.array(model.getAttr('UB', variables), dtype=float)
+        self.integer = np.array(model.getAttr('VType', variables)) != GRB.CONTINUOUS
+        start = np.array(model.getAttr('Start', variables), dtype=float)
+        self.start = np.where(start == GRB.UNDEFINED, np.nan, start)
+        self.lb[self.lb <= -GRB.INFINITY] = -np.inf
+        self.ub[self.ub >= GRB.INFINITY] = np.inf
+
+    def rowBounds(self):
+        lower = np.where(self.sense == GRB.LESS_EQUAL, -np.inf, self.rhs)
+        upper = np.where(self.sense == GRB.GREATER_EQUAL, np.inf, self.rhs)
+        return lower, upper
+
+class solverBackend:
+    """Minimises a single model column subject to the model rows.
+
+    Parameters use the Gurobi names of the phase parameters (TimeLimit,
+    MIPGap, MIPGapAbs) plus SolutionLimit; backends print and skip the ones
+    they cannot honour."""
+    name = "backend"
+    supported_params = set()
+
+    def __init__(self, model, threads, scale=1):
+        self.threads = threads
+        # resolution of continuous columns for backends working on integers
+        self.scale = scale
+
+    def checkParams(self, params):
+        for key in params:
+            if key not in self.supported_params:
+                print(self.name+" backend ignores parameter "+key)
+
+    def solve(self, objective, upper_bounds, params, start=None):
+        pass
+
+class gurobiBackend(solverBackend):
+    name = "gurobi"
+    supported_params = {'TimeLimit', 'MIPGap', 'MIPGapAbs', 'BestObjStop',
+                        'MIPFocus', 'SolutionLimit'}
+
+    def __init__(self, model, threads, scale=1):
+        super().__init__(model, threads, scale)
+        self.model = model
+        self.model.update()
+        self.variables = self.model.getVars()
+
+    def solve(self, objective, upper_bounds, params, start=None):
+        self.checkParams(params)
+        m = self.model
+        saved_ub = { c: self.variables[c].UB for c in upper_bounds }
+        for c, ub in upper_bounds.items():
+            self.variables[c].UB = ub
+        m.setObjective(gb.LinExpr(self.variables[objective]), GRB.MINIMIZE)
+        m.setParam('Threads', self.threads)
+        for key, value in params.items():
+            if key in self.supported_params:
+                m.setParam(key, value)
+        if start is not None:
+            m.setAttr('Start', self.variables,
+                      np.where(np.isnan(start), GRB.UNDEFINED, start).tolist())
+        m.optimize()
+
+        if m.SolCount == 0:
+            status = 'infeasible' if m.Status == GRB.INFEASIBLE else 'no_solution'
+            result = solveResult(status, runtime=m.Runtime)
+        else:
+            result = solveResult('optimal' if m.Status == GRB.OPTIMAL else 'feasible',
+                                 m.ObjVal, m.ObjBound,
+                                 np.array(m.getAttr('X', self.variables)), m.Runtime)
+
+        for c, ub in saved_ub.items():
+            self.variables[c].UB = ub
+        for key in params:
+            if key in self.supported_params:
+                m.setParam(key, m.getParamInfo(key)[5])
+        return result
+
+class highsBackend(solverBackend):
+    """HiGHS branch and cut through scipy.optimize.milp. HiGHS takes no MIP
+    start there, so start values are not passed on."""
+    name = "highs"
+    supported_params = {'TimeLimit', 'MIPGap', 'SolutionLimit'}
+
+    def __init__(self, model, threads, scale=1):
+        super().__init__(model, threads, scale)
+        self.form = standardForm(model)
+
+    def solve(self, objective, upper_bounds, params, start=None):
+        from scipy.optimize import milp, LinearConstraint, Bounds
+        self.checkParams(params)
+        form = self.form
+
+        c = np.zeros(form.A.shape[1])
+        c[objective] = 1.
+        ub = form.ub.copy()
+        for col, bound in upper_bounds.items():
+            ub[col] = bound
+        options = {'disp': True}
+        if 'TimeLimit' in params:
+            options['time_limit'] = params['TimeLimit']
+        if 'MIPGap' in params:
+            options['mip_rel_gap'] = params['MIPGap']
+        if params.get('SolutionLimit', 0) == 1:
+            #the first incumbent closes any gap target
+            options['mip_rel_gap'] = np.inf
+
+        row_lb, row_ub = form.rowBounds()
+        tic = time.perf_counter()
+        res = milp(c,
+                   integrality=form.integer.astype(int),
+                   bounds=Bounds(form.lb, ub),
+                   constraints=LinearConstraint(form.A, row_lb, row_ub),
+                   options=options)
+        runtime = time.perf_counter() - tic
+
+        if res.x is None:
+            return solveResult('infeasible' if res.status == 2 else 'no_solution',
+                               runtime=runtime)
+        return solveResult('optimal' if res.status == 0 else 'feasible',
+                           res.fun, getattr(res, 'mip_dual_bound', None), res.x, runtime)
+
+class cpsatBackend(solverBackend):
+    """OR-Tools CP-SAT with its multi-worker portfolio search, one worker per
+    thread.
+
+    CP-SAT only handles integer data: continuous columns are represented on
+    a 1/scale grid and every row is rescaled to integer coefficients. The
+    grid is exact when scale clears every division in the model, see
+    schedulingModel.continuousScale."""
+    name = "cpsat"
+    supported_params = {'TimeLimit', 'MIPGap', 'MIPGapAbs', 'SolutionLimit'}
+    # bound for columns unbounded in the model, small enough that no row
+    # can overflow 64-bit integers
+    max_bound = 2**40
+    max_decimals = 6
+
+    def __init__(self, model, threads, scale=1):
+        super().__init__(model, threads, scale)
+        try:
+            from ortools.sat.python import cp_model
+        except ImportError:
+            raise BackendException("The cpsat backend needs OR-Tools (pip install ortools)")
+        self.cp_model = cp_model
+        self.form = standardForm(model)
+        self.integerRows()
+
+    def integerRows(self):
+        """Rescale the rows to integer coefficients over the integer columns
+        and the scaled continuous columns"""
+        form = self.form
+        col_scale = np.where(form.integer, 1., 1./self.scale)
+        continuous = sp.csr_matrix(form.A @ sp.diags((~form.integer).astype(float)))
+        row_factor = np.where(continuous.getnnz(axis=1) > 0, float(self.scale), 1.)
+        A = (sp.diags(row_factor) @ form.A @ sp.diags(col_scale)).tocsr()
+        rhs = row_factor * form.rhs
+        row_of = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+
+        #smallest power of ten making each row integral
+        factor = np.ones(A.shape[0])
+        pending = np.ones(A.shape[0], dtype=bool)
+        for decimals in range(self.max_decimals+1):
+            scaled_data = A.data * 10.**decimals
+            scaled_rhs = rhs * 10.**decimals
+            bad = np.zeros(A.shape[0], dtype=bool)
+            np.logical_or.at(bad, row_of, np.abs(scaled_data - np.round(scaled_data)) > 1e-6)
+            bad |= np.abs(scaled_rhs - np.round(scaled_rhs)) > 1e-6
+            factor[pending & ~bad] = 10.**decimals
+            pending &= bad
+            if not pending.any():
+                break
+        if pending.any():
+            raise BackendException("cpsat backend cannot scale "+str(int(pending.sum()))+
+                                   " rows to integer coefficients")
+
+        self.A = (sp.diags(factor) @ A).tocsr()
+        self.A.data = np.round(self.A.data).astype(np.int64)
+        self.rhs = np.round(rhs * factor).astype(np.int64)
+        self.col_scale = col_scale
+
+    def columnBounds(self, upper_bounds):
+        lb = self.form.lb.copy()
+        ub = self.form.ub.copy()
+        for col, bound in upper_bounds.items():
+            ub[col] = bound
+        lb = np.where(self.form.integer, np.ceil(lb - 1e-9), np.ceil(lb / self.col_scale - 1e-9))
+        ub = np.where(self.form.integer, np.floor(ub + 1e-9), np.floor(ub / self.col_scale + 1e-9))
+        lb = np.clip(np.nan_to_num(lb, neginf=-self.max_bound), -self.max_bound, self.max_bound)
+        ub = np.clip(np.nan_to_num(ub, posinf=self.max_bound), -self.max_bound, self.max_bound)
+        return lb.astype(np.int64), ub.astype(np.int64)
+
+    def solve(self, objective, upper_bounds, params, start=None):
+        cp_model = self.cp_model
+        self.checkParams(params)
+
+        model = cp_model.CpModel()
+        lb, ub = self.columnBounds(upper_bounds)
+        cols = [ model.NewIntVar(int(l), int(u), "c"+str(j))
+                 for j, (l, u) in enumerate(zip(lb, ub)) ]
+        A = self.A
+        for i in range(A.shape[0]):
+            begin, end = A.indptr[i], A.indptr[i+1]
+            expr = cp_model.LinearExpr.WeightedSum(
+                [ cols[j] for j in A.indices[begin:end] ],
+                [ int(a) for a in A.data[begin:end] ])
+            sense = self.form.sense[i]
+            if sense == GRB.LESS_EQUAL:
+                model.Add(expr <= int(self.rhs[i]))
+            elif sense == GRB.GREATER_EQUAL:
+                model.Add(expr >= int(self.rhs[i]))
+            else:
+                model.Add(expr == int(self.rhs[i]))
+        model.Minimize(cols[objective])
+
+        if start is None:
+            start = self.form.start
+        for j in np.nonzero(~np.isnan(start) & self.form.integer)[0]:
+            model.AddHint(cols[j], int(round(start[j])))
+
+        solver = cp_model.CpSolver()
+        solver.parameters.num_workers = self.threads
+        solver.parameters.log_search_progress = True
+        if 'TimeLimit' in params:
+            solver.parameters.max_time_in_seconds = params['TimeLimit']
+        if 'MIPGap' in params:
+            solver.parameters.relative_gap_limit = params['MIPGap']
+        if 'MIPGapAbs' in params:
+            solver.parameters.absolute_gap_limit = params['MIPGapAbs'] / self.col_scale[objective]
+        if params.get('SolutionLimit', 0) == 1:
+            solver.parameters.stop_after_first_solution = True
+
+        status = solver.Solve(model)
+        runtime = solver.WallTime()
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return solveResult('infeasible' if status == cp_model.INFEASIBLE else 'no_solution',
+                               runtime=runtime)
+        x = np.array([ solver.Value(v) for v in cols ], dtype=float) * self.col_scale
+        return solveResult('optimal' if status == cp_model.OPTIMAL else 'feasible',
+                           solver.ObjectiveValue() * self.col_scale[objective],
+                           solver.BestObjectiveBound() * self.col_scale[objective],
+                           x, runtime)
+
+backend_registry = { cls.name: cls for cls in [gurobiBackend, highsBackend, cpsatBackend] }
+
+def makeBackend(name, model, threads, scale=1):
+    if name not in backend_registry:
+        raise BackendException("Unknown solver backend "+str(name))
+    return backend_registry[name](model, threads, scale)
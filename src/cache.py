@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import gurobipy as gb
+
+from .model import schedulingModel
+
+def cacheKey(model_config, conference_week):
+    """Hash of everything the built model depends on: the normalised model
+    section and rule list, the service/AP1/AP2 CSV contents and the model
+    dimensions. Gurobi and phase parameters are left out as they only
+    affect the solve."""
+    key = hashlib.sha256()
+    key.update(json.dumps({'model': model_config.model,
+                           'rules': model_config.rules,
+                           'n_weeks': schedulingModel.n_weeks,
+                           'hardness_interval': schedulingModel.hardness_interval,
+                           'conference_week': conference_week},
+                          sort_keys=True).encode())
+    for filename in model_config.input_files:
+        with open(filename, 'rb') as f:
+            key.update(hashlib.sha256(f.read()).digest())
+    return key.hexdigest()
+
+class modelCache:
+    """Content-addressed store of built models.
+
+    Each entry is a directory named by its cacheKey holding the model as
+    MPS, an index map from the MPS columns back to the schedule
+    (resident, service, week) entries and the hours variables, and the
+    last schedule solved from it. Entries are evicted least recently used
+    first once the directory outgrows max_size_mb.
+    """
+    def __init__(self, directory, max_size_mb=1024):
+        self.directory = directory
+        self.max_bytes = max_size_mb * 2**20
+        os.makedirs(self.directory, exist_ok=True)
+
+    def entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def has(self, key):
+        return os.path.exists(os.path.join(self.entry(key), 'index.npz'))
+
+    def store(self, key, scheduler):
+        """Store a model built up to its hours maxima"""
+        path = self.entry(key)
+        os.makedirs(path, exist_ok=True)
+        scheduler.model.update()
+        scheduler.model.write(os.path.join(path, 'model.mps'))
+        np.savez(os.path.join(path, 'index.npz'),
+                 free=scheduler.free,
+                 constants=scheduler.constants,
+                 schedule=np.array([ v.index for v in scheduler.schedule.values() ], dtype=int),
+                 hrs_per_interval=np.array([ v.index for v in scheduler.hrs_per_interval.values() ],
+                                           dtype=int).reshape(len(scheduler.avg_hrs_per_year), -1),
+                 avg_hrs_per_year=np.array([ v.index for v in scheduler.avg_hrs_per_year.values() ],
+                                           dtype=int),
+                 maxima=np.array([ scheduler.max_hrs_per_interval.index,
+                                   scheduler.max_hrs_per_year.index ]))
+        self.evict(keep=key)
+
+    def load(self, key, scheduler):
+        """Restore a stored model into a fresh schedulingModel, which can then
+        be optimised directly"""
+        path = self.entry(key)
+        index = np.load(os.path.join(path, 'index.npz'))
+        scheduler.model = gb.read(os.path.join(path, 'model.mps'))
+        scheduler.model.ModelName = 'Residency Scheduler'
+        variables = scheduler.model.getVars()
+
+        scheduler.free = index['free']
+        scheduler.constants = index['constants']
+        scheduler.shape = scheduler.free.shape
+        scheduler.domain = None
+        scheduler.values = None
+        scheduler.n_free = int(scheduler.free.sum())
+        scheduler.columns = np.full(scheduler.shape, -1, dtype=int)
+        scheduler.columns[scheduler.free] = np.arange(scheduler.n_free)
+
+        schedule = [ variables[i] for i in index['schedule'] ]
+        scheduler.x = gb.MVar.fromlist(schedule)
+        scheduler.schedule = gb.tupledict(zip(scheduler.freeKeys(), schedule))
+        hrs = index['hrs_per_interval']
+        scheduler.hrs_per_interval = gb.tupledict(
+            ((r, t), variables[hrs[r, t]]) for r in range(hrs.shape[0]) for t in range(hrs.shape[1]))
+        scheduler.avg_hrs_per_year = gb.tupledict(
+            (r, variables[i]) for r, i in enumerate(index['avg_hrs_per_year']))
+        scheduler.max_hrs_per_interval = variables[index['maxima'][0]]
+        scheduler.max_hrs_per_year = variables[index['maxima'][1]]
+        scheduler.setParams()
+
+        self.touch(key)
+
+    def storeSolution(self, key, assignment):
+        if os.path.exists(self.entry(key)):
+            np.save(os.path.join(self.entry(key), 'solution.npy'), assignment)
+            self.evict(keep=key)
+
+    def solution(self, key):
+        """Last (residents, weeks) schedule solved from the entry, or None"""
+        filename = os.path.join(self.entry(key), 'solution.npy')
+        return np.load(filename) if os.path.exists(filename) else None
+
+    def touch(self, key):
+        now = time.time()
+        os.utime(self.entry(key), (now, now))
+
+    def size(self, key):
+        path = self.entry(key)
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits max_bytes"""
+        entries = [ key for key in os.listdir(self.directory)
+                    if os.path.isdir(self.entry(key)) ]
+        entries.sort(key=lambda key: os.path.getmtime(self.entry(key)))
+        total = sum(self.size(key) for key in entries)
+        for key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.size(key)
+            shutil.rmtree(self.entry(key))
@@ -0,0 +1,303 @@
+import time
+import numpy as np
+import gurobipy as gb
+from gurobipy import GRB
+
+from .export import hoursSummary
+from .heuristic import orderSymmetryClasses
+from .model import schedulingModel, solutionAssignment
+from .rules import addRulesToModel
+
+class residentPricing:
+    """Pricing problem of one resident: the schedulingModel of that resident
+    alone (domain, requirements and rules) without the coverage bounds.
+    The objective charges the coverage duals for every week and the hours
+    dual for the resident's hours, so it is the reduced cost of the best
+    yearly pattern up to the convexity dual."""
+    def __init__(self, gurobi_params, model_params, r, residents, services, rules, domain,
+                 n_columns):
+        self.residents = residents.subset([r], services)
+        self.services = services.withoutCoverage()
+        local = [ (rule, rule.forResident(r)) for rule in rules ]
+        local = [ (rule, copy) for rule, copy in local if copy is not None ]
+        self.domain = domain.subset([r])
+        self.domain.absorbed = { copy for rule, copy in local if rule in domain.absorbed }
+
+        # the pricing objective is a reduced cost, so it must not stop early,
+        # and it is solved to optimality many times over
+        self.m = schedulingModel(dict(gurobi_params, BestObjStop=-GRB.INFINITY, MIPFocus=2),
+                                 dict(model_params, symmetry_breaking=False))
+        self.m.build_model(self.residents, self.services, self.domain)
+        addRulesToModel([ copy for _, copy in local ], self.m, self.residents, self.services)
+        self.m.add_maxima(self.residents, self.services)
+        self.model = self.m.model
+        self.model.setParam('OutputFlag', 0)
+        self.model.setParam('PoolSolutions', n_columns)
+        # duals can be as large as the artificial penalty, so the gap is absolute
+        self.model.setParam('MIPGap', 0.)
+        self.model.setParam('MIPGapAbs', 1e-6)
+        self.s_free, self.t_free = np.nonzero(self.m.free[0])
+        self.fixed = self.m.constants[0]
+
+    def setCap(self, cap):
+        """Bound the resident's maximum interval hours"""
+        self.m.max_hrs_per_interval.UB = GRB.INFINITY if cap is None else cap
+
+    def accepts(self, pattern):
+        """True if a complete (W,) pattern meets the resident's rules"""
+        if (pattern < 0).any():
+            return False
+        values = np.zeros(self.m.shape[1:])
+        values[pattern, np.arange(len(pattern))] = 1.
+        if (self.fixed > values).any():
+            return False
+        self.m.x.LB = self.m.x.UB = values[self.m.free[0]]
+        self.model.setObjective(gb.LinExpr(), GRB.MINIMIZE)
+        self.model.optimize()
+        self.m.x.LB, self.m.x.UB = 0., 1.
+        return self.model.SolCount > 0
+
+    def price(self, prices, weight, phase):
+        """Patterns of the solution pool minimising weight * hours minus the
+        coverage prices, with their hours"""
+        hours = self.m.max_hrs_per_interval if phase == 0 else self.m.max_hrs_per_year
+        constant = float((prices * self.fixed).sum())
+        self.model.setObjective(-prices[self.s_free, self.t_free] @ self.m.x
+                                + weight * hours - constant, GRB.MINIMIZE)
+        self.model.optimize()
+        patterns = []
+        for k in range(self.model.SolCount):
+            self.model.setParam('SolutionNumber', k)
+            values = self.m.constants.astype(float)
+            values[self.m.free] = self.m.x.Xn
+            patterns.append(solutionAssignment(values)[0])
+        return patterns, self.model.ObjBound if self.model.SolCount else None
+
+class columnGeneration:
+    """Dantzig-Wolfe decomposition by resident.
+
+    Residents interact only through the weekly coverage bounds, so the
+    master problem chooses one yearly pattern per resident subject to
+    coverage and minimises the maximum over residents of the phase's hours
+    (interval hours in phase 1, yearly hours in phase 2 under the phase 1
+    cap plus interval_tolerance). Each resident's pricing problem is that
+    resident's own schedulingModel, which enforces the domain, the
+    requirements, every rule and the interval hour cap, and returns up to
+    pricing_columns patterns of negative reduced cost from its solution
+    pool. Patterns are shared between the residents of a symmetry class.
+    Coverage rows carry penalised artificial slacks so that any column set
+    is feasible.
+
+    Once no pattern prices out, or after max_iterations, the master is
+    solved with binary pattern choices under the phase time limits
+    (price-and-branch). The schedule is returned as a schedulingModel with
+    every week fixed to it, or, with polish, the full weekly model solved
+    from it.
+    """
+    penalty = 1e4
+
+    def __init__(self, gurobi_params, model_params, optimization_params):
+        self.gurobi_params = gurobi_params
+        self.model_params = dict(model_params or {}, sparse_domain=True)
+        self.optimization_params = optimization_params or {}
+        self.max_iterations = self.optimization_params.get('max_iterations', 50)
+        self.pricing_columns = self.optimization_params.get('pricing_columns', 3)
+        self.polish = self.optimization_params.get('polish', False)
+        self.interval_cap = self.optimization_params.get('max_hours_per_interval', None)
+        self.interval_tolerance = self.optimization_params.get('interval_tolerance', 0.)
+        self.phase_params = [self.optimization_params.get('phase1', {}),
+                             self.optimization_params.get('phase2', {})]
+        self.iterations = []
+
+    def addPattern(self, r, pattern):
+        """Record a pattern of resident r, and of its symmetry class, returning
+        the new column indices"""
+        added = []
+        for q in self.classmates[r]:
+            key = pattern.tobytes()
+            if key in self.seen[q]:
+                continue
+            self.seen[q].add(key)
+            self.owner.append(q)
+            self.patterns.append(pattern)
+            added.append(len(self.patterns) - 1)
+        return added
+
+    def hours(self, columns):
+        """Interval and yearly hours of the given columns"""
+        summary = hoursSummary(np.array([ self.patterns[c] for c in columns ]), self.services)
+        return np.stack([summary['max_hours_per_interval'], summary['avg_hours_per_year']])
+
+    def buildMaster(self, phase, cap):
+        master = gb.Model('Column generation master')
+        master.setParam('OutputFlag', 0)
+        master.setParam('Threads', self.gurobi_params['Threads'])
+        n_residents = len(self.residents)
+        n_services, n_weeks = len(self.services), schedulingModel.n_weeks
+
+        self.z = master.addVar(obj=1., name='max_hours')
+        self.convexity = [ master.addLConstr(gb.LinExpr(), GRB.EQUAL, 1., name='convexity')
+                           for r in range(n_residents) ]
+        self.hours_rows = [ master.addLConstr(self.z, GRB.GREATER_EQUAL, 0., name='hours')
+                            for r in range(n_residents) ]
+        self.coverage = {}
+        for bounds, sense, sign in [(self.services.lb, GRB.GREATER_EQUAL, 1.),
+                                    (self.services.ub, GRB.LESS_EQUAL, -1.)]:
+            for s in np.nonzero(~np.isnan(bounds))[0]:
+                for t in range(n_weeks):
+                    slack = master.addVar(obj=self.penalty, name='artificial')
+                    self.coverage.setdefault((s, t), []).append(
+                        master.addLConstr(sign * slack, sense, bounds[s], name='coverage'))
+        self.master = master
+        self.phase = phase
+        self.cap = cap
+        self.lambdas = {}
+        self.addColumns(range(len(self.patterns)))
+
+    def addColumns(self, columns):
+        columns = [ c for c in columns if c not in self.lambdas ]
+        if not columns:
+            return
+        hours = self.hours(columns)
+        for c, interval, year in zip(columns, hours[0], hours[1]):
+            # patterns over the phase 1 cap are kept out of phase 2
+            if self.cap is not None and interval > self.cap + 1e-6:
+                continue
+            r = self.owner[c]
+            constrs = [ self.convexity[r], self.hours_rows[r] ]
+            coeffs = [ 1., -(interval if self.phase == 0 else year) ]
+            for t, s in enumerate(self.patterns[c]):
+                rows = self.coverage.get((s, t), [])
+                constrs += rows
+                coeffs += [1.] * len(rows)
+            self.lambdas[c] = self.master.addVar(ub=1., name='pattern',
+                                                 column=gb.Column(coeffs, constrs))
+
+    def prices(self):
+        """(S,W) coverage duals and the convexity and hours duals by resident"""
+        prices = np.zeros((len(self.services), schedulingModel.n_weeks))
+        for (s, t), rows in self.coverage.items():
+            prices[s, t] = sum(row.Pi for row in rows)
+        return prices, np.array([ c.Pi for c in self.convexity ]), \
+            np.array([ c.Pi for c in self.hours_rows ])
+
+    def generate(self):
+        """Column generation on the LP master of the current phase"""
+        for iteration in range(self.max_iterations):
+            tic = time.perf_counter()
+            self.master.optimize()
+            prices, convexity, weights = self.prices()
+            bound = self.master.ObjVal
+            added = []
+            for r, pricing in enumerate(self.pricing):
+                patterns, pricing_bound = pricing.price(prices, weights[r], self.phase)
+                if pricing_bound is not None:
+                    bound += min(pricing_bound - convexity[r], 0.)
+                if not patterns:
+                    continue
+                summary = hoursSummary(np.array(patterns), self.services)
+                hours = summary['max_hours_per_interval'] if self.phase == 0 \
+                    else summary['avg_hours_per_year']
+                for pattern, h in zip(patterns, hours):
+                    cost = weights[r] * h - prices[pattern, np.arange(len(pattern))].sum() \
+                        - convexity[r]
+                    if cost < -1e-6:
+                        added += self.addPattern(r, pattern)
+            self.addColumns(added)
+            self.iterations.append({'phase': self.phase + 1,
+                                    'iteration': iteration,
+                                    'columns': len(self.lambdas),
+                                    'master': self.master.ObjVal,
+                                    'bound': bound,
+                                    'time [s]': time.perf_counter() - tic})
+            print("Phase {:d} iteration {:d}: {:d} columns, master {:.3f}, bound {:.3f}".format(
+                self.phase + 1, iteration, len(self.lambdas), self.master.ObjVal, bound))
+            if not added:
+                break
+
+    def solveInteger(self):
+        """Binary pattern choice over the generated columns, returning the
+        chosen (R,W) schedule or None if coverage cannot be met"""
+        self.master.setAttr('VType', list(self.lambdas.values()),
+                            [GRB.BINARY] * len(self.lambdas))
+        for key, value in self.phase_params[self.phase].items():
+            self.master.setParam(key, value)
+        self.master.optimize()
+        if self.master.SolCount == 0:
+            return None
+        schedule = np.full((len(self.residents), schedulingModel.n_weeks), -1, dtype=int)
+        for c, var in self.lambdas.items():
+            if var.X > 0.5:
+                schedule[self.owner[c]] = self.patterns[c]
+        artificial = sum(v.X for v in self.master.getVars() if v.VarName == 'artificial')
+        if artificial > 1e-6 or (schedule < 0).any():
+            return None
+        return schedule
+
+    def solvePhase(self, phase, cap):
+        for pricing in self.pricing:
+            pricing.setCap(cap)
+        self.buildMaster(phase, cap)
+        self.generate()
+        return self.solveInteger()
+
+    def run(self, residents, services, rules, domain, symmetry_classes, start=None):
+        """Generate columns and solve the integer master for both phases,
+        returning the schedulingModel of the resulting schedule"""
+        self.residents, self.services = residents, services
+        n_residents = len(residents)
+        self.classmates = { r: [r] for r in range(n_residents) }
+        for members in symmetry_classes:
+            for r in members:
+                self.classmates[r] = list(members)
+        self.seen = [ set() for r in range(n_residents) ]
+        self.owner, self.patterns = [], []
+
+        self.pricing = [ residentPricing(self.gurobi_params, self.model_params, r,
+                                         residents, services, rules, domain,
+                                         self.pricing_columns)
+                         for r in range(n_residents) ]
+        # initial columns: the start schedule where it meets the rules and
+        # each resident's least-hours patterns
+        zero = np.zeros((len(services), schedulingModel.n_weeks))
+        for r, pricing in enumerate(self.pricing):
+            if start is not None and pricing.accepts(start[r]):
+                self.addPattern(r, start[r])
+            patterns, _ = pricing.price(zero, 1., 0)
+            for pattern in patterns:
+                self.addPattern(r, pattern)
+
+        cap = self.interval_cap
+        schedule = None
+        if cap is None:
+            schedule = self.solvePhase(0, None)
+            if schedule is not None:
+                cap = hoursSummary(schedule, services)['max_hours_per_interval'].max() \
+                    + self.interval_tolerance
+        if cap is not None:
+            phase2 = self.solvePhase(1, cap)
+            schedule = schedule if phase2 is None else phase2
+
+        if schedule is None:
+            print("No integral schedule among the generated columns, solving the full model")
+            return self.solveFull(residents, services, rules, domain, symmetry_classes, start)
+        if self.model_params.get('symmetry_breaking', True):
+            schedule = orderSymmetryClasses(schedule, symmetry_classes)
+        if self.polish:
+            return self.solveFull(residents, services, rules, domain, symmetry_classes, schedule)
+
+        fixed = domain.copy()
+        for r, t in np.ndindex(schedule.shape):
+            fixed.fix(r, schedule[r, t], t)
+        return self.solveFull(residents, services, rules, fixed, symmetry_classes, None)
+
+    def solveFull(self, residents, services, rules, domain, symmetry_classes, start):
+        m = schedulingModel(self.gurobi_params, self.model_params, self.optimization_params)
+        m.build_model(residents, services, domain)
+        if self.model_params.get('symmetry_breaking', True):
+            m.add_symmetry_breaking(residents, services, symmetry_classes)
+        addRulesToModel(rules, m, residents, services)
+        if start is not None:
+            m.setStart(start)
+        m.optimize(residents, services)
+        return m
@@ -0,0 +1,354 @@
+import copy
+import http.server
+import json
+import os
+import socketserver
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import gurobipy as gb
+from gurobipy import GRB
+
+from .export import exportSchedule, serviceNames
+from .feasibility import FeasibilityException
+from .inputs import Config, ConfigException
+from .profiling import progressLog
+from .solve import solveConfig, infeasibleConflicts
+from .sweep import logTo
+
+def warmWorker():
+    """Worker initializer: create the process's default Gurobi environment
+    once, so the licence is checked out before the first job and every
+    later model in the worker reuses it"""
+    gb.Model().dispose()
+
+def runJob(args):
+    """Worker: solve one job's config with all the threads it holds as its
+    gurobi Threads, streaming solver progress and output to the job
+    directory"""
+    job_id, model_config, threads, job_dir = args
+    model_config = copy.copy(model_config)
+    model_config.gurobi = dict(model_config.gurobi, Threads=threads)
+    residents, services = model_config.residents, model_config.services
+    result = {'id': job_id}
+
+    tic = time.perf_counter()
+    progress = progressLog(os.path.join(job_dir, 'progress.jsonl'))
+    with logTo(os.path.join(job_dir, 'solver.log')):
+        try:
+            rules, m = solveConfig(model_config, progress)
+            if m.values is None and m.model.SolCount == 0:
+                result['status'] = 'infeasible' if m.model.Status == GRB.INFEASIBLE \
+                    else 'no_solution'
+                conflicts = infeasibleConflicts(model_config, rules, m)
+                if conflicts:
+                    result['conflicts'] = [ label for label, _ in conflicts ]
+            else:
+                assignment = m.assignment()
+                output = os.path.join(job_dir, os.path.basename(model_config.output_filename))
+                result['status'] = 'feasible'
+                result['interval'] = m.max_avg_hours_per_interval
+                result['year'] = m.max_avg_hours_per_year
+                result['files'] = exportSchedule(output, model_config.output_formats,
+                                                 assignment, residents, services)
+                result['schedule'] = dict(zip([ r.name for r in residents ],
+                                              serviceNames(assignment, services).tolist()))
+        except FeasibilityException as e:
+            result['status'] = 'infeasible configuration'
+            result['conflicts'] = e.issues
+        except Exception as e:
+            print("Job "+job_id+" failed: "+str(e))
+            result['status'] = 'error: '+str(e)
+        finally:
+            progress.close()
+    result['time [s]'] = time.perf_counter() - tic
+    return result
+
+class schedulingDaemon:
+    """Job queue solving configs in long-lived worker processes.
+
+    Parsed Configs are kept by path and re-parsed only when the yaml or
+    one of its CSVs changes. Jobs wait in a FIFO queue and are handed to
+    at most `workers` processes while the solver threads of the running
+    jobs stay within `threads`. A job asks for its config's gurobi
+    Threads (or `threads` in the request), times lns_workers for the lns
+    horizon, capped at the budget. Each job writes its solver log,
+    progressLog JSONL and schedule to workdir/<job id>.
+    """
+    def __init__(self, workers=2, threads=None, workdir='daemon_jobs'):
+        self.workers = workers
+        self.threads = threads or os.cpu_count() or 1
+        self.workdir = workdir
+        os.makedirs(workdir, exist_ok=True)
+        self.free_threads = self.threads
+        self.running = 0
+        self.configs = {}
+        self.jobs = {}
+        self.queue = []
+        self.cond = threading.Condition()
+        self.executor = ProcessPoolExecutor(workers, initializer=warmWorker)
+        self.closed = False
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def config(self, config_file):
+        """Parsed Config of config_file, re-parsed when any of its files
+        changed since it was cached"""
+        config_file = os.path.abspath(config_file)
+        if not os.path.exists(config_file):
+            raise ConfigException("No config file "+config_file)
+        with self.cond:
+            cached = self.configs.get(config_file)
+        if cached is not None:
+            signature, model_config = cached
+            if signature == self.signature(config_file, model_config):
+                return model_config
+        model_config = Config(config_file)
+        with self.cond:
+            self.configs[config_file] = (self.signature(config_file, model_config), model_config)
+        return model_config
+
+    def signature(self, config_file, model_config):
+        return tuple(os.stat(f).st_mtime_ns if os.path.exists(f) else None
+                     for f in [config_file] + model_config.input_files)
+
+    def jobThreads(self, model_config, requested=None):
+        """Solver threads of each process of a job and the total it holds.
+        Gurobi's Threads 0 (automatic) takes each process's share of the
+        budget."""
+        processes = model_config.optimization['lns_workers'] \
+            if model_config.optimization['horizon'] == 'lns' else 1
+        if processes > self.threads:
+            raise ConfigException("lns_workers {:d} exceeds the thread budget {:d}".format(
+                processes, self.threads))
+        share = self.threads // processes
+        threads = int(requested or model_config.gurobi['Threads'])
+        threads = share if threads == 0 else min(threads, share)
+        if threads < 1:
+            raise ConfigException("A job needs at least one thread")
+        return threads, threads * processes
+
+    def submit(self, request):
+        """Queue a job for request['config'], returning its id"""
+        if 'config' not in request:
+            raise ConfigException("A job needs a config")
+        model_config = self.config(request['config'])
+        threads, reserved = self.jobThreads(model_config, request.get('threads'))
+        with self.cond:
+            job_id = "j{:04d}".format(len(self.jobs))
+            job_dir = os.path.join(self.workdir, job_id)
+            os.makedirs(job_dir, exist_ok=True)
+            self.jobs[job_id] = {'id': job_id,
+                                 'config': os.path.abspath(request['config']),
+                                 'state': 'queued',
+                                 'threads': threads,
+                                 'reserved': reserved,
+                                 'directory': job_dir,
+                                 'submitted': time.time(),
+                                 'model_config': model_config,
+                                 'result': None}
+            self.queue.append(job_id)
+            self.cond.notify_all()
+        return job_id
+
+    def cancel(self, job_id):
+        """Drop a queued job, returning False when it has already started"""
+        with self.cond:
+            if job_id not in self.queue:
+                return False
+            self.queue.remove(job_id)
+            self.jobs[job_id]['state'] = 'cancelled'
+            self.cond.notify_all()
+            return True
+
+    def dispatch(self):
+        """Start the job at the head of the queue whenever a worker and its
+        threads are free. Jobs start in order, so a large job is not
+        overtaken indefinitely by smaller ones."""
+        with self.cond:
+            while not self.closed:
+                job = self.jobs[self.queue[0]] if self.queue else None
+                if job is None or self.running == self.workers \
+                   or job['reserved'] > self.free_threads:
+                    self.cond.wait()
+                    continue
+                self.queue.pop(0)
+                self.running += 1
+                self.free_threads -= job['reserved']
+                job['state'] = 'running'
+                job['started'] = time.time()
+                # lns shares the job's threads between its workers itself
+                future = self.executor.submit(runJob, (job['id'], job['model_config'],
+                                                       job['reserved'], job['directory']))
+                future.add_done_callback(lambda f, job=job: self.finish(job, f))
+
+    def finish(self, job, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'id': job['id'], 'status': 'error: '+str(e)}
+        with self.cond:
+            job['result'] = result
+            job['state'] = 'done'
+            job['finished'] = time.time()
+            self.running -= 1
+            self.free_threads += job['reserved']
+            self.cond.notify_all()
+
+    def status(self, job_id):
+        """Job summary without the schedule: its state (queued, running,
+        done or cancelled) and, once done, the solve status and objectives"""
+        with self.cond:
+            job = self.jobs[job_id]
+            summary = { k: v for k, v in job.items() if k not in ('model_config', 'result') }
+            if job['result'] is not None:
+                summary.update((k, v) for k, v in job['result'].items() if k != 'schedule')
+            return summary
+
+    def result(self, job_id):
+        with self.cond:
+            return self.jobs[job_id]['result']
+
+    def done(self, job_id):
+        with self.cond:
+            return self.jobs[job_id]['state'] in ('done', 'cancelled')
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.executor.shutdown(cancel_futures=True)
+
+class daemonHandler(http.server.BaseHTTPRequestHandler):
+    """JSON API of a schedulingDaemon:
+
+        POST   /configs            {"config": path}  parse and cache a config
+        GET    /jobs                                 every job's status
+        POST   /jobs               {"config": path, "threads": n}
+        GET    /jobs/<id>                            status and objectives
+        GET    /jobs/<id>/result                     status, objectives and schedule
+        GET    /jobs/<id>/progress                   progress JSON lines until done
+        DELETE /jobs/<id>                            cancel a queued job
+    """
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def request_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def route(self):
+        """(job id or None, action) of the request path"""
+        parts = [ p for p in self.path.split('?')[0].split('/') if p ]
+        if not parts or parts[0] != 'jobs':
+            return None, parts[0] if parts else ''
+        job_id = parts[1] if len(parts) > 1 else None
+        if job_id is not None and job_id not in self.server.daemon.jobs:
+            raise KeyError(job_id)
+        return job_id, parts[2] if len(parts) > 2 else 'jobs'
+
+    def handle_request(self, method):
+        daemon = self.server.daemon
+        try:
+            job_id, action = self.route()
+            if method == 'POST' and action == 'configs':
+                model_config = daemon.config(self.request_json().get('config', ''))
+                self.reply(200, {'residents': len(model_config.residents),
+                                 'services': len(model_config.services),
+                                 'rules': len(model_config.rules)})
+            elif method == 'POST' and action == 'jobs' and job_id is None:
+                self.reply(201, {'id': daemon.submit(self.request_json())})
+            elif method == 'GET' and action == 'jobs' and job_id is None:
+                self.reply(200, [ daemon.status(j) for j in list(daemon.jobs) ])
+            elif method == 'GET' and action == 'jobs':
+                self.reply(200, daemon.status(job_id))
+            elif method == 'GET' and action == 'result':
+                self.reply(200, dict(daemon.status(job_id), **(daemon.result(job_id) or {})))
+            elif method == 'GET' and action == 'progress':
+                self.stream(job_id)
+            elif method == 'DELETE' and action == 'jobs' and job_id is not None:
+                if daemon.cancel(job_id):
+                    self.reply(200, daemon.status(job_id))
+                else:
+                    self.reply(409, {'error': "Job "+job_id+" has already started"})
+            else:
+                self.reply(404, {'error': "No route "+method+" "+self.path})
+        except KeyError as e:
+            self.reply(404, {'error': "Unknown job "+str(e.args[0])})
+        except (ConfigException, ValueError) as e:
+            self.reply(400, {'error': str(e)})
+
+    def stream(self, job_id):
+        """Send the job's progress lines as they are written, then its
+        final status"""
+        daemon = self.server.daemon
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        filename = os.path.join(daemon.jobs[job_id]['directory'], 'progress.jsonl')
+        position = 0
+        while True:
+            finished = daemon.done(job_id)
+            if os.path.exists(filename):
+                with open(filename) as f:
+                    f.seek(position)
+                    lines = f.read()
+                # only whole lines, the rest follows with the next read
+                lines = lines[:lines.rfind('\n') + 1]
+                position += len(lines)
+                if lines:
+                    self.wfile.write(lines.encode())
+                    self.wfile.flush()
+            if finished:
+                break
+            time.sleep(0.2)
+        status = daemon.status(job_id)
+        self.wfile.write((json.dumps({'event': 'finished', 'state': status['state'],
+                                      'status': status.get('status')})
+                          +"\n").encode())
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+class unixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(daemon, host='127.0.0.1', port=8765, socket_path=None):
+    """Serve the daemon's API on a Unix socket, or on host:port, until
+    interrupted"""
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = unixHTTPServer(socket_path, daemonHandler)
+        where = socket_path
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), daemonHandler)
+        where = "http://{:}:{:d}".format(host, port)
+    server.daemon = daemon
+    print("Serving on {:} with {:d} workers and {:d} threads".format(
+        where, daemon.workers, daemon.threads))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,80 @@
+import numpy as np
+
+class DomainException(Exception):
+    """Raise when rules fix a resident-week to a forbidden service"""
+
+class scheduleDomain:
+    """Per (resident, service, week) domain of the schedule variables,
+    evaluated from the rules before the model is built.
+
+    Rules restrict the domain through Rule.addRuleToDomain: `allowed` marks
+    the entries a rule leaves open and `fixed` holds the service a resident
+    must take in a week (-1 when free). Rules whose constraints are fully
+    captured here are recorded in `absorbed` and add nothing to the model.
+    """
+    def __init__(self, n_residents, n_services, n_weeks):
+        self.allowed = np.ones((n_residents, n_services, n_weeks), dtype=bool)
+        self.fixed = np.full((n_residents, n_weeks), -1, dtype=int)
+        self.absorbed = set()
+
+    def copy(self):
+        """Independent copy sharing the absorbed rule objects"""
+        domain = scheduleDomain(*self.allowed.shape)
+        domain.allowed = self.allowed.copy()
+        domain.fixed = self.fixed.copy()
+        domain.absorbed = set(self.absorbed)
+        return domain
+
+    def subset(self, r_indices):
+        """Domain of the residents r_indices alone, sharing the absorbed
+        rule objects"""
+        domain = scheduleDomain(len(r_indices), *self.allowed.shape[1:])
+        domain.allowed = self.allowed[r_indices].copy()
+        domain.fixed = self.fixed[r_indices].copy()
+        domain.absorbed = set(self.absorbed)
+        return domain
+
+    def fix(self, r, s, t):
+        """Fix resident r to service s in week t, returning False if another
+        service is already fixed there"""
+        if self.fixed[r,t] not in (-1, s):
+            return False
+        self.fixed[r,t] = s
+        return True
+
+    def forbid(self, r_indices, s, weeks=slice(None)):
+        self.allowed[r_indices, s, weeks] = False
+
+    def fixedOne(self):
+        """(R,S,W) mask of the variables fixed to one"""
+        n_residents, n_services, n_weeks = self.allowed.shape
+        ones = np.zeros(self.allowed.shape, dtype=bool)
+        r_idx, t_idx = np.nonzero(self.fixed >= 0)
+        ones[r_idx, self.fixed[r_idx, t_idx], t_idx] = True
+        return ones
+
+    def available(self):
+        """(R,S,W) mask of the entries a resident can still take: allowed
+        and not fixed to another service"""
+        n_services = self.allowed.shape[1]
+        return self.allowed & ((self.fixed < 0)[:, None, :]
+                               | (self.fixed[:, None, :] == np.arange(n_services)[None, :, None]))
+
+    def free(self):
+        """(R,S,W) mask of the variables left for the solver"""
+        return self.allowed & (self.fixed < 0)[:, None, :]
+
+    def validate(self, residents, services):
+        r_idx, s_idx, t_idx = np.nonzero(self.fixedOne() & ~self.allowed)
+        if len(r_idx):
+            raise DomainException(
+                "; ".join("{:} fixed to {:} in week {:d} where it is forbidden".format(
+                    residents[r].name, services[s].name, t+2)
+                          for r, s, t in zip(r_idx, s_idx, t_idx)))
+
+def buildDomain(rules, residents, services, n_weeks):
+    domain = scheduleDomain(len(residents), len(services), n_weeks)
+    for rule in rules:
+        rule.addRuleToDomain(domain, residents, services)
+    domain.validate(residents, services)
+    return domain
@@ -0,0 +1,137 @@
+import csv
+import json
+import os
+import numpy as np
+
+from .model import schedulingModel
+from .pool import hammingDistances
+
+class ExportException(Exception):
+    """Raise when a schedule cannot be exported"""
+
+def serviceNames(assignment, services):
+    """Service names of a (residents, weeks) assignment, '' where no
+    service is taken"""
+    names = np.array([ s.name for s in services ] + [''], dtype=object)
+    return names[np.where(assignment >= 0, assignment, len(services))]
+
+def weekLabels(n_weeks):
+    return [ 'Week '+str(w+2) for w in range(n_weeks) ]
+
+def hoursSummary(assignment, services):
+    """Per-resident hours of an assignment, as the model counts them: the
+    maximum average over every hardness_interval window and the average
+    over the year. Leading axes (e.g. a pool of solutions) are kept."""
+    hardness_interval = schedulingModel.hardness_interval
+    weekly = np.where(assignment >= 0, np.append(services.hardness, 0.)[assignment], 0.)
+    n_weeks = weekly.shape[-1]
+    n_intervals = n_weeks - hardness_interval
+
+    cum = np.cumsum(weekly, axis=-1)
+    windows = cum[..., hardness_interval-1:hardness_interval-1+n_intervals] \
+        - np.concatenate([ np.zeros(cum.shape[:-1]+(1,)), cum[..., :n_intervals-1] ], axis=-1)
+    return {'max_hours_per_interval': (windows / hardness_interval).max(axis=-1),
+            'avg_hours_per_year': cum[..., -1] / n_weeks}
+
+def write_schedule_csv(filename, assignment, residents, services):
+    """Resident by week CSV in the format read_schedule_csv reads back"""
+    names = serviceNames(assignment, services)
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Name'] + weekLabels(assignment.shape[1]))
+        writer.writerows([r.name] + row for r, row in zip(residents, names.tolist()))
+
+def write_schedule_json(filename, assignment, residents, services):
+    names = serviceNames(assignment, services)
+    hours = hoursSummary(assignment, services)
+    with open(filename, 'w') as f:
+        json.dump({'weeks': weekLabels(assignment.shape[1]),
+                   'residents': [ {'name': r.name,
+                                   'year': r.year,
+                                   'schedule': row,
+                                   'max_hours_per_interval': interval,
+                                   'avg_hours_per_year': year}
+                                  for r, row, interval, year in zip(
+                                      residents, names.tolist(),
+                                      hours['max_hours_per_interval'].tolist(),
+                                      hours['avg_hours_per_year'].tolist()) ]},
+                  f, indent=1)
+
+def write_schedule_parquet(filename, assignment, residents, services):
+    """Long-format table with one row per resident-week and dictionary
+    encoded resident and service columns"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportException("Parquet export needs pyarrow (pip install pyarrow)")
+    n_residents, n_weeks = assignment.shape
+    resident_names = pa.array([ r.name for r in residents ])
+    service_names = pa.array([ s.name for s in services ])
+    table = pa.table({
+        'resident': pa.DictionaryArray.from_arrays(
+            pa.array(np.repeat(np.arange(n_residents, dtype=np.int32), n_weeks)),
+            resident_names),
+        'week': pa.array(np.tile(np.arange(2, n_weeks + 2, dtype=np.int16), n_residents)),
+        'service': pa.DictionaryArray.from_arrays(
+            pa.array(assignment.reshape(-1).astype(np.int32), mask=assignment.reshape(-1) < 0),
+            service_names)})
+    pq.write_table(table, filename)
+
+def write_hours_csv(filename, assignment, residents, services):
+    hours = hoursSummary(assignment, services)
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Name', 'Year', 'Max hours per interval', 'Avg hours per year'])
+        for r, interval, year in zip(residents, hours['max_hours_per_interval'].tolist(),
+                                     hours['avg_hours_per_year'].tolist()):
+            writer.writerow([r.name, r.year, round(interval, 2), round(year, 2)])
+
+exporters = {'csv': write_schedule_csv,
+             'json': write_schedule_json,
+             'parquet': write_schedule_parquet}
+
+def exportSchedule(filename, formats, assignment, residents, services):
+    """Write the assignment in every format: csv to filename and the others
+    next to it with the format as extension. Returns the files written."""
+    stem, _ = os.path.splitext(filename)
+    written = []
+    for fmt in formats:
+        if fmt not in exporters:
+            raise ExportException("Unknown export format "+fmt)
+        name = filename if fmt == 'csv' else stem+"."+fmt
+        exporters[fmt](name, assignment, residents, services)
+        written.append(name)
+    return written
+
+def exportPool(filename, formats, pool, residents, services, hours_filename=None):
+    """Write every schedule of a pool as exportSchedule does, suffixed _k0,
+    _k1, ..., with its hours file when hours_filename is given, and a
+    <stem>_pool.csv summary of each schedule's maximum hours and its
+    Hamming distance to the closest other schedule"""
+    stem, ext = os.path.splitext(filename)
+    written = []
+    for k, assignment in enumerate(pool):
+        written += exportSchedule("{:}_k{:d}{:}".format(stem, k, ext), formats,
+                                  assignment, residents, services)
+        if hours_filename:
+            hours_stem, hours_ext = os.path.splitext(hours_filename)
+            write_hours_csv("{:}_k{:d}{:}".format(hours_stem, k, hours_ext),
+                            assignment, residents, services)
+
+    hours = hoursSummary(np.stack(pool), services)
+    distances = hammingDistances(pool).astype(float)
+    np.fill_diagonal(distances, np.inf)
+    summary = stem+"_pool.csv"
+    with open(summary, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Schedule', 'Max hours per interval', 'Max avg hours per year',
+                         'Closest schedule distance'])
+        for k in range(len(pool)):
+            closest = distances[k].min()
+            writer.writerow(["{:}_k{:d}{:}".format(os.path.basename(stem), k, ext),
+                             round(float(hours['max_hours_per_interval'][k].max()), 2),
+                             round(float(hours['avg_hours_per_year'][k].max()), 2),
+                             int(closest) if np.isfinite(closest) else ''])
+    written.append(summary)
+    return written
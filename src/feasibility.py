@@ -0,0 +1,128 @@
+import numpy as np
+
+from .model import schedulingModel
+from .rules import addRulesWithHandles
+
+class FeasibilityException(Exception):
+    """Raise when the checks of checkFeasibility fail, with their messages
+    in `issues`"""
+    def __init__(self, issues):
+        super().__init__("; ".join(issues))
+        self.issues = issues
+
+def weekList(weeks):
+    return ", ".join(str(t + 2) for t in weeks)
+
+def restrictingRules(rules, r, s):
+    """Rules constraining service s for resident r"""
+    return [ rule for rule in rules
+             if s in rule.serviceIndices() and r in getattr(rule, 'r_indices', [r]) ]
+
+def checkFeasibility(rules, residents, services, domain):
+    """Necessary conditions for a schedule to exist, checked on the
+    compiled rules and the scheduleDomain without building the model.
+    Returns a message for every condition that fails."""
+    issues = []
+    n_residents, n_services, n_weeks = domain.allowed.shape
+    available = domain.available()
+    requirements = residents.requirements
+
+    #each requirement fits in the weeks its service is open to the resident
+    open_weeks = available.sum(axis=2)
+    for r, s in zip(*np.nonzero(requirements > open_weeks)):
+        limits = [ rule.describe() for rule in restrictingRules(rules, r, s) ]
+        issues.append("{:} needs {:d} weeks of {:} but only {:d} are open{:}".format(
+            residents[r].name, int(requirements[r, s]), services[s].name, int(open_weeks[r, s]),
+            " (limited by "+"; ".join(limits)+")" if limits else ""))
+
+    #the requirements and fixed weeks fit in the year
+    needed = np.maximum(requirements, domain.fixedOne().sum(axis=2)).sum(axis=1)
+    for r in np.nonzero(needed > n_weeks)[0]:
+        issues.append("{:} needs {:d} weeks of requirements and fixed weeks in a {:d} week year".format(
+            residents[r].name, int(needed[r]), n_weeks))
+
+    #weekly coverage bounds against the residents able to cover
+    coverage = available.sum(axis=0)
+    fixed_coverage = domain.fixedOne().sum(axis=0)
+    for s in range(n_services):
+        lb, ub = services.lb[s], services.ub[s]
+        short = np.nonzero(coverage[s] < lb)[0] if not np.isnan(lb) else []
+        if len(short):
+            issues.append("{:} needs {:d} residents a week but fewer are available in weeks {:}".format(
+                services[s].name, int(lb), weekList(short)))
+        over = np.nonzero(fixed_coverage[s] > ub)[0] if not np.isnan(ub) else []
+        if len(over):
+            issues.append("{:} allows {:d} residents a week but more are fixed to it in weeks {:}".format(
+                services[s].name, int(ub), weekList(over)))
+    total_lb = np.nansum(services.lb)
+    if total_lb > n_residents:
+        issues.append("Coverage lower bounds need {:d} residents a week but there are {:d}".format(
+            int(total_lb), n_residents))
+
+    for rule in rules:
+        issues += rule.checkFeasibility(domain, residents, services)
+    return issues
+
+def diagnoseInfeasibility(gurobi_params, model_params, rules, residents, services,
+                          time_limit=60., interval_cap=None):
+    """Rule-grouped elastic relaxation of an infeasible model.
+
+    The model is rebuilt with every rule as explicit rows, each rule's
+    rows and each resident requirement forming one group. With
+    interval_cap (optimization.max_hours_per_interval) the cap on the
+    interval hours is a group of its own, its violation in hours. The one
+    service per week and coverage rows stay hard. Gurobi's feasRelax then
+    minimises the total violation of the grouped rows. Returns (group,
+    violation) for every group that must be violated, largest first, an
+    empty list when the model is feasible, or None when the relaxation
+    finds no solution within time_limit.
+    """
+    model_params = dict(model_params or {}, sparse_domain=False,
+                        symmetry_breaking=False, lean=False)
+    m = schedulingModel(gurobi_params, model_params)
+    m.build_model(residents, services)
+    handles = addRulesWithHandles(rules, m, residents, services)
+
+    groups = [ (rule.describe(), constrs) for rule, constrs, _ in handles.values() ]
+    groups += [ ("requirement of {:} weeks of {:} for {:}".format(
+        int(residents.requirements[r, s]), services[s].name, residents[r].name), [constr])
+                for (r, s), constr in m.requirement_constrs.items() ]
+    if interval_cap is not None:
+        m.add_maxima(residents, services)
+        groups.append(("max_hours_per_interval cap of {:g} hours".format(interval_cap),
+                       [m.model.addConstr(m.max_hrs_per_interval <= interval_cap)]))
+
+    # unique row names tie the artificial variables back to their group
+    model = m.model
+    constrs = [ c for _, group in groups for c in group ]
+    model.setAttr('ConstrName', constrs, [ "g"+str(i) for i in range(len(constrs)) ])
+    model.update()
+    model.feasRelax(0, False, None, None, None, constrs, [1.]*len(constrs))
+    model.setParam('TimeLimit', time_limit)
+    model.optimize()
+    if model.SolCount == 0:
+        return None
+
+    violation = {}
+    for v in model.getVars():
+        if v.VarName.startswith(('ArtP_g', 'ArtN_g')) and v.X > 1e-6:
+            i = int(v.VarName[6:])
+            violation[i] = violation.get(i, 0.) + v.X
+    conflicts = []
+    first = 0
+    for label, group in groups:
+        total = sum(violation.get(i, 0.) for i in range(first, first + len(group)))
+        first += len(group)
+        if total > 1e-6:
+            conflicts.append((label, total))
+    return sorted(conflicts, key=lambda c: -c[1])
+
+def printDiagnosis(conflicts):
+    if conflicts is None:
+        print("The relaxation found no solution, no conflicting rules identified")
+    elif not conflicts:
+        print("The relaxation is feasible, no conflicting rules")
+    else:
+        print("Conflicting rules and requirements (total violation):")
+        for label, total in conflicts:
+            print("  {:}: {:.1f}".format(label, total))
@@ -0,0 +1,225 @@
+import numpy as np
+
+from .model import schedulingModel
+
+class greedyHeuristic:
+    """Constructive heuristic producing a (possibly partial) schedule to seed
+    the MIP. The schedule is a (residents, weeks) array of service indices,
+    -1 marking weeks left for the solver to decide.
+
+    Allowed and fixed weeks come from the scheduleDomain. Rules describe
+    the remaining structure through Rule.addRuleToHeuristic, which caps
+    counts or declares block, single block and sequence structure.
+    """
+    def __init__(self, residents, services, domain):
+        self.residents = residents
+        self.services = services
+        n_weeks = schedulingModel.n_weeks
+        n_residents = len(residents)
+        n_services = len(services)
+
+        self.requirements = residents.requirements
+        self.hardness = services.hardness
+        self.cov_lb = np.nan_to_num(services.lb, nan=0)
+        self.cov_ub = np.nan_to_num(services.ub, nan=n_residents)
+
+        self.assignment = np.full((n_residents, n_weeks), -1, dtype=int)
+        self.fixed = np.zeros((n_residents, n_weeks), dtype=bool)
+        self.coverage = np.zeros((n_services, n_weeks), dtype=int)
+        self.counts = np.zeros((n_residents, n_services), dtype=int)
+
+        self.allowed = domain.allowed.copy()
+        self.cap = np.full((n_residents, n_services), n_weeks, dtype=int)
+        self.block_size = np.ones((n_residents, n_services), dtype=int)
+        self.single_block = np.zeros((n_residents, n_services), dtype=bool)
+        # (r, first service) -> service that must follow it the next week
+        self.successor = {}
+        self.predecessor = {}
+
+        for r, t in zip(*np.nonzero(domain.fixed >= 0)):
+            self.assign(r, domain.fixed[r,t], t, fixed=True)
+
+    def assign(self, r, s, t, fixed=False):
+        if self.assignment[r,t] >= 0:
+            self.unassign(r, t)
+        self.assignment[r,t] = s
+        self.coverage[s,t] += 1
+        self.counts[r,s] += 1
+        self.fixed[r,t] |= fixed
+
+    def unassign(self, r, t):
+        s = self.assignment[r,t]
+        self.assignment[r,t] = -1
+        self.coverage[s,t] -= 1
+        self.counts[r,s] -= 1
+
+    def isStructured(self, r, s):
+        """Services that can only be placed as part of a larger unit"""
+        return self.block_size[r,s] > 1 or self.single_block[r,s] \
+            or (r,s) in self.successor or (r,s) in self.predecessor
+
+    def unit(self, r, s):
+        """(service, offset) pairs placed together for one unit of s"""
+        if (r,s) in self.successor:
+            return [(s, 0), (self.successor[r,s], 1)]
+        if self.single_block[r,s]:
+            return [ (s, i) for i in range(max(self.requirements[r,s], 1)) ]
+        return [ (s, i) for i in range(self.block_size[r,s]) ]
+
+    def fits(self, r, unit, t, respect_ub=True):
+        n_weeks = self.assignment.shape[1]
+        for s, offset in unit:
+            tt = t + offset
+            if tt >= n_weeks or self.assignment[r,tt] >= 0 or not self.allowed[r,s,tt]:
+                return False
+            if respect_ub and self.coverage[s,tt] >= self.cov_ub[s]:
+                return False
+            if self.counts[r,s] + sum(1 for ss, _ in unit if ss == s) > self.cap[r,s]:
+                return False
+        return True
+
+    def weeklyHours(self, r):
+        hours = np.zeros(self.assignment.shape[1])
+        placed = self.assignment[r] >= 0
+        hours[placed] = self.hardness[self.assignment[r, placed]]
+        return hours
+
+    def placeUnit(self, r, s):
+        """Place one unit of service s for resident r at the best start week:
+        weeks short of their coverage lower bound first, then the lightest
+        surrounding hardness_interval window"""
+        n_weeks = self.assignment.shape[1]
+        unit = self.unit(r, s)
+        hours = self.weeklyHours(r)
+        window = np.convolve(hours, np.ones(schedulingModel.hardness_interval), mode='same')
+
+        best, best_score = None, None
+        for t in range(n_weeks):
+            if not self.fits(r, unit, t):
+                continue
+            deficit = sum(self.cov_lb[ss] > self.coverage[ss, t+o] for ss, o in unit)
+            load = sum(window[t+o] + self.hardness[ss] for ss, o in unit)
+            score = (-deficit, load)
+            if best_score is None or score < best_score:
+                best, best_score = t, score
+
+        if best is None:
+            return False
+        for ss, o in unit:
+            self.assign(r, ss, best+o)
+        return True
+
+    def placeRequirements(self):
+        n_residents, n_services = self.requirements.shape
+        # most constrained services first: fewest allowed weeks per week needed
+        pending = []
+        for r in range(n_residents):
+            for s in range(n_services):
+                if (r,s) in self.predecessor:
+                    #placed together with its predecessor
+                    continue
+                needed = self.requirements[r,s] - self.counts[r,s]
+                if (r,s) in self.successor:
+                    second = self.successor[r,s]
+                    needed = max(needed, self.requirements[r,second] - self.counts[r,second])
+                if needed <= 0:
+                    continue
+                n_units = 1 if self.single_block[r,s] \
+                    else -(-needed // len(self.unit(r, s)))
+                slack = self.allowed[r,s].sum() / float(needed)
+                pending.append((slack, -len(self.unit(r, s)), r, s, n_units))
+        pending.sort()
+
+        for _, _, r, s, n_units in pending:
+            for _ in range(n_units):
+                if not self.placeUnit(r, s):
+                    break
+
+    def fillCoverage(self):
+        n_residents, n_services = self.requirements.shape
+        n_weeks = self.assignment.shape[1]
+        for s in np.argsort(-self.cov_lb):
+            if self.cov_lb[s] <= 0:
+                continue
+            for t in range(n_weeks):
+                for r in np.argsort(self.weeklyLoad()):
+                    if self.coverage[s,t] >= self.cov_lb[s]:
+                        break
+                    if self.isStructured(r, s):
+                        continue
+                    if self.fits(r, [(s, 0)], t):
+                        self.assign(r, s, t)
+
+    def weeklyLoad(self):
+        hours = np.zeros(self.assignment.shape)
+        placed = self.assignment >= 0
+        hours[placed] = self.hardness[self.assignment[placed]]
+        return hours.sum(axis=1)
+
+    def fillRemaining(self):
+        """Fill the free weeks with the lightest service that is still open"""
+        n_residents, n_services = self.requirements.shape
+        by_hardness = np.argsort(self.hardness)
+        for r, t in zip(*np.nonzero(self.assignment < 0)):
+            for s in by_hardness:
+                if self.isStructured(r, s):
+                    continue
+                if self.fits(r, [(s, 0)], t):
+                    self.assign(r, s, t)
+                    break
+
+    def coverageViolation(self, s, t):
+        return max(self.coverage[s,t] - self.cov_ub[s], 0) \
+            + max(self.cov_lb[s] - self.coverage[s,t], 0)
+
+    def repair(self, max_passes=3):
+        """Swap movable weeks within a resident's schedule while that reduces
+        the total coverage violation"""
+        n_residents, n_weeks = self.assignment.shape
+        for _ in range(max_passes):
+            improved = False
+            for r in range(n_residents):
+                for t1 in range(n_weeks):
+                    s1 = self.assignment[r,t1]
+                    if s1 < 0 or self.fixed[r,t1] or self.isStructured(r, s1):
+                        continue
+                    if self.coverageViolation(s1, t1) == 0:
+                        continue
+                    for t2 in range(n_weeks):
+                        s2 = self.assignment[r,t2]
+                        if t2 == t1 or s2 < 0 or s2 == s1 or self.fixed[r,t2] \
+                           or self.isStructured(r, s2) \
+                           or not self.allowed[r,s1,t2] or not self.allowed[r,s2,t1]:
+                            continue
+                        before = sum(self.coverageViolation(s, t)
+                                     for s in (s1, s2) for t in (t1, t2))
+                        self.assign(r, s2, t1)
+                        self.assign(r, s1, t2)
+                        after = sum(self.coverageViolation(s, t)
+                                    for s in (s1, s2) for t in (t1, t2))
+                        if after < before:
+                            improved = True
+                            break
+                        self.assign(r, s1, t1)
+                        self.assign(r, s2, t2)
+            if not improved:
+                break
+
+    def run(self, rules):
+        for rule in rules:
+            rule.addRuleToHeuristic(self, self.residents, self.services)
+        self.placeRequirements()
+        self.fillCoverage()
+        self.fillRemaining()
+        self.repair()
+        return self.assignment
+
+def orderSymmetryClasses(assignment, classes):
+    """Permute the schedules of interchangeable residents into the
+    lexicographic order required by schedulingModel.add_symmetry_breaking"""
+    assignment = assignment.copy()
+    for members in classes:
+        rows = assignment[members]
+        order = sorted(range(len(members)), key=lambda i: tuple(rows[i]))
+        assignment[members] = rows[order]
+    return assignment
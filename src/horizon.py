@@ -0,0 +1,88 @@
+import time
+import numpy as np
+
+from .model import schedulingModel
+from .rules import addRulesToModel
+
+class HorizonException(Exception):
+    """Raise when a rolling horizon window has no solution"""
+
+class rollingHorizon:
+    """Relax-and-fix rolling horizon solve.
+
+    Windows of window_weeks are solved in sequence, each advancing by
+    step_weeks. Within a window the schedule variables are binary, weeks
+    before it are fixed to the committed schedule and weeks after it are
+    relaxed to continuous values. Only the first step_weeks of a window are
+    committed, so consecutive windows overlap.
+
+    Committed weeks are fixed through the scheduleDomain and enter every
+    constraint as constants. Requirement residuals, partially placed
+    in_blocks blocks and the hours of windows crossing the boundary are
+    therefore carried by the full-year constraints, while the relaxed
+    future keeps the remaining requirements and coverage reachable.
+    """
+    def __init__(self, gurobi_params, model_params, optimization_params):
+        self.gurobi_params = gurobi_params
+        # committed weeks are folded in through the domain
+        self.model_params = dict(model_params or {}, sparse_domain=True)
+        self.optimization_params = optimization_params or {}
+        self.window_weeks = self.optimization_params.get('window_weeks', 16)
+        self.step_weeks = self.optimization_params.get('step_weeks', 8)
+        self.windows = []
+
+    def windowStarts(self):
+        n_weeks = schedulingModel.n_weeks
+        starts = [0]
+        while starts[-1] + self.window_weeks < n_weeks:
+            starts.append(starts[-1] + self.step_weeks)
+        return starts
+
+    def solveWindow(self, residents, services, rules, domain, symmetry_classes,
+                    first_relaxed, start):
+        m = schedulingModel(self.gurobi_params, self.model_params,
+                            self.optimization_params)
+        m.build_model(residents, services, domain)
+        if self.model_params.get('symmetry_breaking', True):
+            m.add_symmetry_breaking(residents, services, symmetry_classes)
+        addRulesToModel(rules, m, residents, services)
+        m.relaxWeeks(first_relaxed)
+        if start is not None:
+            m.setStart(start)
+        m.optimize(residents, services)
+        return m
+
+    def run(self, residents, services, rules, domain, symmetry_classes, start=None):
+        """Solve every window and return the schedulingModel of the last
+        one, which holds the complete schedule"""
+        n_weeks = schedulingModel.n_weeks
+        domain = domain.copy()
+        m = None
+        for t0 in self.windowStarts():
+            first_relaxed = min(t0 + self.window_weeks, n_weeks)
+            tic = time.perf_counter()
+            m = self.solveWindow(residents, services, rules, domain, symmetry_classes,
+                                 first_relaxed, start)
+            if m.values is None and m.model.SolCount == 0:
+                raise HorizonException("No solution for the window starting in week "+
+                                       str(t0 + 2)+", the committed weeks may leave "
+                                       "it infeasible")
+            self.windows.append({'first week': t0 + 2,
+                                 'last week': first_relaxed + 1,
+                                 'solve [s]': time.perf_counter() - tic,
+                                 'interval bound': m.interval_bound,
+                                 'year bound': m.max_avg_hours_per_year})
+            print("Window weeks {:d}-{:d}: max hours per interval {:.1f}, per year {:.1f}".format(
+                t0 + 2, first_relaxed + 1,
+                m.interval_bound, m.max_avg_hours_per_year))
+
+            assignment = m.assignment()
+            #commit the first step_weeks, or everything in the last window
+            commit_end = n_weeks if first_relaxed == n_weeks else t0 + self.step_weeks
+            for r, t in zip(*np.nonzero(assignment[:, :commit_end] >= 0)):
+                domain.fix(r, assignment[r, t], t)
+
+            #the next window starts from this window's integral weeks
+            start = assignment.copy()
+            start[:, first_relaxed:] = -1
+        return m
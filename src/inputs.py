@@ -1,4 +1,7 @@
+import copy
 import csv
+import importlib.util
+import numpy as np
 import yaml
 
 import os.path
@@ -6,8 +9,6 @@ import os.path
 class ConfigException(Exception):
     """Raise for exceptions encountered during input file parsing"""
 
-n_services = 21
-
 class Resident:
     allowable_years={'AP1','AP2'}
 
@@ -15,6 +16,10 @@ class Resident:
         assert len(headers) == len(data)
         self.name = str(name)
         self.year = year
+        if "Vacation weeks" not in headers:
+            raise ConfigException("Resident "+self.name+" has no Vacation weeks column")
+        # service columns run up to the vacation weeks column
+        n_services = headers.index("Vacation weeks")
         self.service_lbs = {}
         for service_name, req in zip(headers[:n_services], data[:n_services]):
             req = req.split('-')[0]
@@ -26,7 +31,6 @@ class Resident:
             else:
                 self.service_lbs[service_name] = int(req) if req else None
 
-        assert headers[n_services] == "Vacation weeks"
         print(self.name, data[n_services])
         self.vacation_weeks = [ int(w.strip()[5:]) - 2
                                 for w in data[n_services].split(",") ]
@@ -42,15 +46,82 @@ class ClinicalService:
         self.hardness = float(hardness)
         self.ok_after_vacation = bool(ok_after_vacation=='y')
 
+class serviceTable(list):
+    """The services in CSV order, with their fields as columns: coverage
+    bounds (nan when unbounded), hardness and a name to index map"""
+    def __init__(self, services):
+        super().__init__(services)
+        self.index = { s.name: i for i, s in enumerate(self) }
+        self.lb = np.array([ s.lb if s.lb else np.nan for s in self ], dtype=float)
+        self.ub = np.array([ s.ub if s.ub else np.nan for s in self ], dtype=float)
+        self.hardness = np.array([ s.hardness for s in self ], dtype=float)
+        self.ok_after_vacation = np.array([ s.ok_after_vacation for s in self ], dtype=bool)
+
+    def withoutCoverage(self):
+        """The same services with the weekly coverage bounds dropped"""
+        services = [ copy.copy(s) for s in self ]
+        for s in services:
+            s.lb = s.ub = None
+        return serviceTable(services)
+
+class residentTable(list):
+    """The residents in input order, with their fields as columns: the
+    (R,S) requirement matrix and its mask of entries carrying a
+    requirement, vacation weeks (padded with -1), years, cohort index
+    arrays and a name to index map"""
+    def __init__(self, residents, services):
+        super().__init__(residents)
+        self.index = { r.name: i for i, r in enumerate(self) }
+        self.years = np.array([ r.year for r in self ])
+        self.cohorts = { 'everyone': np.arange(len(self)) }
+        for year in Resident.allowable_years:
+            self.cohorts[year] = np.nonzero(self.years == year)[0]
+
+        self.requirements = np.array([ [ r.service_lbs.get(s.name) or 0 for s in services ]
+                                       for r in self ], dtype=int).reshape(len(self), len(services))
+        self.has_requirement = self.requirements > 0
+
+        n_vacation = max([ len(r.vacation_weeks) for r in self ], default=0)
+        self.vacation_weeks = np.full((len(self), n_vacation), -1, dtype=int)
+        for r_idx, r in enumerate(self):
+            self.vacation_weeks[r_idx, :len(r.vacation_weeks)] = r.vacation_weeks
+
+    def subset(self, r_indices, services):
+        """Table of the residents r_indices alone, in that order"""
+        return residentTable([ self[r] for r in r_indices ], services)
+
+    def availability(self, n_weeks):
+        """(R,W) mask of the weeks each resident is not on vacation"""
+        available = np.ones((len(self), n_weeks), dtype=bool)
+        r_idx, v_idx = np.nonzero((self.vacation_weeks >= 0) & (self.vacation_weeks < n_weeks))
+        available[r_idx, self.vacation_weeks[r_idx, v_idx]] = False
+        return available
+
+    def setRequirement(self, r, s, service_name, weeks):
+        """Require weeks of service s (named service_name) from resident r"""
+        self[r].service_lbs[service_name] = weeks
+        self.requirements[r, s] = weeks or 0
+        self.has_requirement[r, s] = self.requirements[r, s] > 0
+
 class Config:
-    def __init__(self, config_file):
-        with open(config_file, 'r') as f:
-            config_inputs = yaml.safe_load(f)
+    def __init__(self, config_file, config_inputs=None):
+        """Parse config_file, or the already loaded config_inputs when given"""
+        if config_inputs is None:
+            with open(config_file, 'r') as f:
+                config_inputs = yaml.safe_load(f)
 
         self.parse_gurobi_config(
             config_inputs['gurobi'] if 'gurobi' in config_inputs
             else dict())
 
+        self.parse_model_config(
+            config_inputs['model'] if 'model' in config_inputs
+            else dict())
+
+        self.parse_optimization_config(
+            config_inputs['optimization'] if 'optimization' in config_inputs
+            else dict())
+
         self.rules= \
             config_inputs['rules'] if 'rules' in config_inputs \
             else []
@@ -59,47 +130,86 @@ class Config:
         service_csv = sched['service_requirements']
 
         assert os.path.exists(service_csv)
+        self.input_files = [service_csv, sched['ap1_residents'], sched['ap2_residents']]
         assert os.path.exists(sched['ap1_residents'])
         assert os.path.exists(sched['ap2_residents'])
 
         with open(service_csv) as f:
             next(f)
             reader = csv.reader(f)
-            self.services = []
+            services = []
             for s in reader:
-                self.services.append(
+                services.append(
                     ClinicalService(s[0], s[1], s[2], s[3], s[4]))
+        self.services = serviceTable(services)
 
-        service_set = { s.name for s in self.services }
+        residents = []
+        for year, resident_csv in [('AP1', sched['ap1_residents']),
+                                   ('AP2', sched['ap2_residents'])]:
+            with open(resident_csv) as f:
+                reader = csv.reader(f)
+                header = next(reader)
+                if "Vacation weeks" not in header:
+                    raise ConfigException("No Vacation weeks column in "+resident_csv)
 
-        self.residents = []
-        with open(sched['ap1_residents']) as f:
-            reader = csv.reader(f)
-            header = next(reader)
+                for s in header[1:header.index("Vacation weeks")]:
+                    if s not in self.services.index:
+                        raise ConfigException("Unknown service "+
+                                              s+" not found in "+service_csv)
 
-            for s in header[1:(n_services)]:
-                if s not in service_set:
-                    raise ConfigException("Unknown service "+
-                                          s+" not found in "+service_csv)
+                for r in reader:
+                    residents.append(
+                        Resident(r[0], year, header[1:], r[1:]))
+        self.residents = residentTable(residents, self.services)
 
-            for r in reader:
-                self.residents.append(
-                    Resident(r[0], 'AP1', header[1:], r[1:]))
+        output_node = config_inputs['output']
+        self.output_filename = output_node['file']
+        self.output_formats = [ str(fmt) for fmt in output_node['formats'] ] \
+            if 'formats' in output_node else ['csv']
+        for fmt in self.output_formats:
+            if fmt not in {'csv', 'json', 'parquet'}:
+                raise ConfigException("Unknown output format "+fmt)
+        if 'parquet' in self.output_formats and importlib.util.find_spec('pyarrow') is None:
+            raise ConfigException("Parquet output needs pyarrow (pip install pyarrow)")
+        self.hours_filename = output_node['hours'] if 'hours' in output_node else None
 
-        with open(sched['ap2_residents']) as f:
-            reader = csv.reader(f)
-            header = next(reader)
+        cache_node = config_inputs['cache'] if 'cache' in config_inputs else None
+        self.cache = None
+        if cache_node is not None and 'directory' in cache_node:
+            self.cache = {'directory': str(cache_node['directory']),
+                          'max_size_mb': float(cache_node['max_size_mb'])
+                          if 'max_size_mb' in cache_node else 1024.}
+
+        pool_node = config_inputs['pool'] if 'pool' in config_inputs else None
+        self.pool = None
+        if pool_node is not None:
+            self.pool = {'size': int(pool_node['size']) if 'size' in pool_node else 5,
+                         'tolerance': float(pool_node['tolerance'])
+                         if 'tolerance' in pool_node else 0.,
+                         'min_distance': int(pool_node['min_distance'])
+                         if 'min_distance' in pool_node else 1,
+                         'candidates': int(pool_node['candidates'])
+                         if 'candidates' in pool_node else None}
+            if self.pool['size'] < 1 or self.pool['tolerance'] < 0 \
+               or self.pool['min_distance'] < 1:
+                raise ConfigException("pool size and min_distance must be positive "
+                                      "and tolerance not negative")
 
-            for s in header[1:(n_services)]:
-                if s not in service_set:
-                    raise ConfigException("Unknown service "+
-                                          s+" not found in "+service_csv)
+        profile_node = config_inputs['profile'] if 'profile' in config_inputs else None
+        self.profile = None
+        if profile_node is not None:
+            self.profile = {'report': str(profile_node['report'])
+                            if 'report' in profile_node else None,
+                            'progress': str(profile_node['progress'])
+                            if 'progress' in profile_node else None,
+                            'progress_interval': float(profile_node['progress_interval'])
+                            if 'progress_interval' in profile_node else 1.}
 
-            for r in reader:
-                self.residents.append(
-                    Resident(r[0], 'AP2', header[1:], r[1:]))
+        self.warm_start = sched['warm_start'] if 'warm_start' in sched else None
+        if self.warm_start is not None and not os.path.exists(self.warm_start):
+            raise ConfigException("Warm start schedule "+self.warm_start+" not found")
 
-        self.output_filename = config_inputs['output']['file']
+        self.symmetry_classes = self.find_symmetry_classes()
 
     def parse_gurobi_config(self, gurobi_node):
         self.gurobi = {}
@@ -120,9 +230,119 @@ class Config:
         else:
             self.gurobi['Presolve'] = 2
 
+    def parse_model_config(self, model_node):
+        self.model = {}
+        self.model['build'] = str(model_node['build']) if 'build' in model_node \
+            else 'matrix'
+        if self.model['build'] not in {'matrix', 'generator'}:
+            raise ConfigException("Unknown model build method "+self.model['build'])
+        self.model['lean'] = bool(model_node['lean']) if 'lean' in model_node \
+            else False
+        self.model['hours'] = str(model_node['hours']) if 'hours' in model_node \
+            else 'prefix_sum'
+        if self.model['hours'] not in {'prefix_sum', 'window'}:
+            raise ConfigException("Unknown hours formulation "+self.model['hours'])
+        self.model['blocks'] = str(model_node['blocks']) if 'blocks' in model_node \
+            else 'aggregated'
+        if self.model['blocks'] not in {'aggregated', 'weak'}:
+            raise ConfigException("Unknown block formulation "+self.model['blocks'])
+        self.model['sparse_domain'] = bool(model_node['sparse_domain']) \
+            if 'sparse_domain' in model_node else True
+        self.model['symmetry_breaking'] = bool(model_node['symmetry_breaking']) \
+            if 'symmetry_breaking' in model_node else True
+
+    phase_param_types = {'TimeLimit': float,
+                         'MIPGap': float,
+                         'MIPGapAbs': float,
+                         'BestObjStop': float,
+                         'MIPFocus': int}
+
+    def parse_optimization_config(self, opt_node):
+        self.optimization = {}
+        self.optimization['method'] = str(opt_node['method']) if 'method' in opt_node \
+            else 'hierarchical'
+        if self.optimization['method'] not in {'hierarchical', 'sequential'}:
+            raise ConfigException("Unknown optimization method "+self.optimization['method'])
+        self.optimization['backend'] = str(opt_node['backend']) if 'backend' in opt_node \
+            else 'gurobi'
+        if self.optimization['backend'] not in {'gurobi', 'highs', 'cpsat'}:
+            raise ConfigException("Unknown solver backend "+self.optimization['backend'])
+        self.optimization['horizon'] = str(opt_node['horizon']) if 'horizon' in opt_node \
+            else 'full'
+        if self.optimization['horizon'] not in {'full', 'rolling', 'multilevel',
+                                                'column_generation', 'lns'}:
+            raise ConfigException("Unknown horizon "+self.optimization['horizon'])
+        self.optimization['window_weeks'] = int(opt_node['window_weeks']) \
+            if 'window_weeks' in opt_node else 16
+        self.optimization['step_weeks'] = int(opt_node['step_weeks']) \
+            if 'step_weeks' in opt_node else 8
+        if not 0 < self.optimization['step_weeks'] <= self.optimization['window_weeks']:
+            raise ConfigException("step_weeks must be positive and at most window_weeks")
+        self.optimization['coarse_weeks'] = int(opt_node['coarse_weeks']) \
+            if 'coarse_weeks' in opt_node else 2
+        if self.optimization['coarse_weeks'] < 1:
+            raise ConfigException("coarse_weeks must be positive")
+        self.optimization['refine_radius'] = int(opt_node['refine_radius']) \
+            if 'refine_radius' in opt_node else 1
+        if self.optimization['refine_radius'] < 0:
+            raise ConfigException("refine_radius must not be negative")
+        self.optimization['polish'] = bool(opt_node['polish']) \
+            if 'polish' in opt_node else False
+        self.optimization['max_iterations'] = int(opt_node['max_iterations']) \
+            if 'max_iterations' in opt_node else 50
+        self.optimization['pricing_columns'] = int(opt_node['pricing_columns']) \
+            if 'pricing_columns' in opt_node else 3
+        if self.optimization['max_iterations'] < 1 or self.optimization['pricing_columns'] < 1:
+            raise ConfigException("max_iterations and pricing_columns must be positive")
+        for key, dtype, default in [('lns_time', float, 60.), ('lns_sub_time', float, 10.),
+                                    ('lns_workers', int, 2), ('lns_weeks', int, 8),
+                                    ('lns_seed', int, 0)]:
+            self.optimization[key] = dtype(opt_node[key]) if key in opt_node else default
+            if key != 'lns_seed' and self.optimization[key] <= 0:
+                raise ConfigException(key+" must be positive")
+        self.optimization['lns_log'] = str(opt_node['lns_log']) if 'lns_log' in opt_node \
+            else None
+        self.optimization['max_hours_per_interval'] = \
+            float(opt_node['max_hours_per_interval']) if 'max_hours_per_interval' in opt_node \
+            else None
+        self.optimization['heuristic_start'] = bool(opt_node['heuristic_start']) \
+            if 'heuristic_start' in opt_node else True
+        self.optimization['interval_tolerance'] = \
+            float(opt_node['interval_tolerance']) if 'interval_tolerance' in opt_node \
+            else 0.
+
+        for phase in ['phase1', 'phase2']:
+            phase_node = opt_node[phase] if phase in opt_node else dict()
+            self.optimization[phase] = {}
+            for key, value in phase_node.items():
+                if key not in Config.phase_param_types:
+                    raise ConfigException("Unsupported "+phase+" parameter "+key)
+                self.optimization[phase][key] = Config.phase_param_types[key](value)
+
     def addVar(self, node, key, dtype=int):
         self.gurobi[key] = dtype(node[key])
         
+    def find_symmetry_classes(self):
+        """Group residents that are interchangeable in the model: same year,
+        requirements and vacation weeks, and not singled out by name in any
+        rule. Only classes with at least two residents are returned."""
+        named = set()
+        for rule_input in self.rules:
+            for arg_dict in rule_input.values():
+                if 'who' in arg_dict and arg_dict['who'] not in {'everyone', 'AP1', 'AP2'}:
+                    named.add(str(arg_dict['who']))
+
+        classes = {}
+        for r_idx, r in enumerate(self.residents):
+            if r.name in named:
+                continue
+            key = (r.year,
+                   self.residents.requirements[r_idx].tobytes(),
+                   tuple(sorted(r.vacation_weeks)))
+            classes.setdefault(key, []).append(r_idx)
+
+        return [ c for c in classes.values() if len(c) > 1 ]
+
     def print_summary(self):
         print("{:d} services".format(len(self.services)))
         print("{:d} residents".format(len(self.residents)))
@@ -136,4 +356,43 @@ class Config:
         print("{:d} AP1 residents".format(count_AP1))
         print("{:d} AP2 residents".format(count_AP2))
         print("{:d} Rules found".format(len(self.rules)))
-        print("Writing results to {:}".format(self.output_filename))
\ No newline at end of file
+        print("{:d} classes of interchangeable residents".format(len(self.symmetry_classes)))
+        if self.warm_start:
+            print("Warm starting from {:}".format(self.warm_start))
+        if self.cache:
+            print("Caching built models in {:}".format(self.cache['directory']))
+        if self.profile:
+            print("Profiling phases and rules")
+        if self.pool:
+            print("Pooling up to {:d} schedules".format(self.pool['size']))
+        print("Writing results to {:} ({:})".format(self.output_filename,
+                                                    ", ".join(self.output_formats)))
+        if self.hours_filename:
+            print("Writing hours summary to {:}".format(self.hours_filename))
+
+def read_schedule_csv(filename, residents, services, n_weeks):
+    """Read a schedule in the format of schedulingModel.write_csv into a
+    (residents, weeks) array of service indices. Residents or weeks missing
+    from the file are left at -1."""
+    service_idx = { s.name: i for i, s in enumerate(services) }
+    resident_idx = { r.name: i for i, r in enumerate(residents) }
+    assignment = np.full((len(residents), n_weeks), -1, dtype=int)
+
+    with open(filename) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        weeks = [ int(w.strip()[5:]) - 2 for w in header[1:] ]
+
+        for row in reader:
+            if row[0] not in resident_idx:
+                continue
+            r_idx = resident_idx[row[0]]
+            for t, service_name in zip(weeks, row[1:]):
+                if not 0 <= t < n_weeks or not service_name:
+                    continue
+                if service_name not in service_idx:
+                    raise ConfigException("Unknown service "+service_name+
+                                          " in schedule "+filename)
+                assignment[r_idx, t] = service_idx[service_name]
+
+    return assignment
@@ -0,0 +1,200 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+
+from .export import hoursSummary
+from .model import schedulingModel
+from .rules import addRulesToModel
+
+neighbourhood_kinds = ['pair', 'cohort', 'weeks', 'service']
+
+def scheduleHours(schedule, services):
+    """Maximum interval hours and maximum yearly hours of a schedule"""
+    hours = hoursSummary(schedule, services)
+    return float(hours['max_hours_per_interval'].max()), float(hours['avg_hours_per_year'].max())
+
+class solvedNeighbourhood:
+    """Result of a neighbourhood solved in this process, in place of the
+    pool's AsyncResult"""
+    def __init__(self, found):
+        self.found = found
+
+    def ready(self):
+        return True
+
+    def get(self):
+        return self.found
+
+def solveNeighbourhood(args):
+    """Worker: re-optimise the free resident-weeks of a schedule with every
+    other week fixed to it. Returns the schedule found or None."""
+    (gurobi_params, model_params, optimization_params, n_weeks, hardness_interval,
+     residents, services, rules, domain, schedule, free) = args
+    schedulingModel.n_weeks = n_weeks
+    schedulingModel.hardness_interval = hardness_interval
+
+    sub_domain = domain.copy()
+    for r, t in zip(*np.nonzero(~free)):
+        sub_domain.fix(r, schedule[r, t], t)
+    m = schedulingModel(gurobi_params, model_params, optimization_params)
+    m.build_model(residents, services, sub_domain)
+    m.model.setParam('OutputFlag', 0)
+    addRulesToModel(rules, m, residents, services)
+    m.setStart(schedule)
+    m.optimize(residents, services)
+    if m.values is None and m.model.SolCount == 0:
+        return None
+    return m.assignment()
+
+class largeNeighbourhoodSearch:
+    """Improve an incumbent by re-optimising neighbourhoods of it.
+
+    The full model is solved first under the phase time limits. Then, for
+    lns_time seconds, lns_workers processes each take the current
+    incumbent, free one neighbourhood and re-solve it with every other
+    resident-week fixed, under lns_sub_time seconds per phase. The
+    workers share the gurobi Threads. The neighbourhoods are a resident
+    with the highest interval or yearly hours paired with another
+    resident, one cohort, a window of lns_weeks weeks for every resident,
+    and every week assigned to one service. A
+    returned schedule replaces the incumbent when it is lexicographically
+    better on (interval hours, yearly hours), and later neighbourhoods
+    start from it. In a daemonic process, which cannot start workers, the
+    neighbourhoods are solved one at a time in the process itself.
+    Every improvement is logged against wall-clock time in `history` and,
+    with lns_log, as JSON lines.
+    """
+    def __init__(self, gurobi_params, model_params, optimization_params):
+        self.gurobi_params = gurobi_params
+        # the fixes are folded in through the domain
+        self.model_params = dict(model_params or {}, sparse_domain=True)
+        self.optimization_params = optimization_params or {}
+        self.time_budget = self.optimization_params.get('lns_time', 60.)
+        self.sub_time = self.optimization_params.get('lns_sub_time', 10.)
+        self.workers = self.optimization_params.get('lns_workers', 2)
+        self.window_weeks = self.optimization_params.get('lns_weeks', 8)
+        self.log_filename = self.optimization_params.get('lns_log', None)
+        self.rng = np.random.default_rng(self.optimization_params.get('lns_seed', 0))
+        self.history = []
+
+    def neighbourhood(self, kind, schedule, residents, services):
+        """(R,W) mask of the resident-weeks a neighbourhood frees"""
+        n_residents, n_weeks = schedule.shape
+        free = np.zeros(schedule.shape, dtype=bool)
+        if kind == 'pair':
+            hours = hoursSummary(schedule, services)
+            hours = hours['max_hours_per_interval'] if self.rng.random() < 0.5 \
+                else hours['avg_hours_per_year']
+            worst = self.rng.choice(np.nonzero(hours >= hours.max() - 1e-6)[0])
+            other = self.rng.choice(np.delete(np.arange(n_residents), worst)) \
+                if n_residents > 1 else worst
+            free[[worst, other]] = True
+        elif kind == 'cohort':
+            cohorts = [ c for year, c in residents.cohorts.items()
+                        if year != 'everyone' and len(c) ]
+            free[cohorts[self.rng.integers(len(cohorts))]] = True
+        elif kind == 'weeks':
+            width = min(self.window_weeks, n_weeks)
+            first = self.rng.integers(n_weeks - width + 1)
+            free[:, first:first+width] = True
+        else:
+            taken = np.unique(schedule[schedule >= 0])
+            free = schedule == self.rng.choice(taken)
+        return free
+
+    def better(self, hours):
+        interval, year = hours
+        return interval < self.best[0] - 1e-6 or \
+            (interval <= self.best[0] + 1e-6 and year < self.best[1] - 1e-6)
+
+    def record(self, kind, hours):
+        entry = {'time': time.perf_counter() - self.tic,
+                 'neighbourhood': kind,
+                 'interval': hours[0],
+                 'year': hours[1]}
+        self.history.append(entry)
+        print("LNS {:.1f}s {:}: max hours per interval {:.3f}, per year {:.3f}".format(
+            entry['time'], kind, hours[0], hours[1]))
+        if self.log is not None:
+            self.log.write(json.dumps(entry)+"\n")
+            self.log.flush()
+
+    def run(self, residents, services, rules, domain, symmetry_classes, start=None):
+        """Solve the full model, improve it by LNS and return the
+        schedulingModel of the best schedule"""
+        self.tic = time.perf_counter()
+        self.log = open(self.log_filename, 'w') if self.log_filename else None
+        m = self.solveFull(residents, services, rules, domain, symmetry_classes, start)
+        if m.values is None and m.model.SolCount == 0:
+            print("The full model found no incumbent to improve")
+            return m
+        schedule = m.assignment()
+        self.best = scheduleHours(schedule, services)
+        self.record('full', self.best)
+
+        # sub-MIPs are small, and their fixes would clash with the ordering
+        sub_model_params = dict(self.model_params, symmetry_breaking=False)
+        pending = []
+        n_tasks = 0
+        # daemonic processes (e.g. multiprocessing.Pool workers) cannot
+        # have children, so there the neighbourhoods are solved one by one
+        serial = multiprocessing.current_process().daemon
+        workers = 1 if serial else self.workers
+        # the workers share the gurobi Threads, 0 standing for every core
+        threads = self.gurobi_params['Threads'] or os.cpu_count() or 1
+        sub_gurobi_params = dict(self.gurobi_params, Threads=max(threads // workers, 1))
+        with contextlib.nullcontext() if serial else multiprocessing.Pool(workers) as pool:
+            while True:
+                remaining = self.time_budget - (time.perf_counter() - self.tic)
+                while len(pending) < workers and remaining > 1.:
+                    kind = neighbourhood_kinds[n_tasks % len(neighbourhood_kinds)]
+                    n_tasks += 1
+                    free = self.neighbourhood(kind, schedule, residents, services)
+                    phase_limit = min(self.sub_time, remaining / 2)
+                    optimization_params = dict(
+                        self.optimization_params,
+                        phase1=dict(self.optimization_params.get('phase1', {}), TimeLimit=phase_limit),
+                        phase2=dict(self.optimization_params.get('phase2', {}), TimeLimit=phase_limit))
+                    task = (sub_gurobi_params, sub_model_params, optimization_params,
+                            schedulingModel.n_weeks, schedulingModel.hardness_interval,
+                            residents, services, rules, domain, schedule, free)
+                    pending.append((kind, solvedNeighbourhood(solveNeighbourhood(task)) if serial
+                                    else pool.apply_async(solveNeighbourhood, (task,))))
+                if not pending:
+                    break
+                done = [ p for p in pending if p[1].ready() ]
+                if not done:
+                    time.sleep(0.05)
+                    continue
+                for kind, result in done:
+                    pending.remove((kind, result))
+                    found = result.get()
+                    if found is None:
+                        continue
+                    hours = scheduleHours(found, services)
+                    if self.better(hours):
+                        schedule, self.best = found, hours
+                        self.record(kind, hours)
+        if self.log is not None:
+            self.log.close()
+        print("LNS solved {:d} neighbourhoods in {:.1f}s".format(
+            n_tasks, time.perf_counter() - self.tic))
+
+        fixed = domain.copy()
+        for r, t in np.ndindex(schedule.shape):
+            fixed.fix(r, schedule[r, t], t)
+        return self.solveFull(residents, services, rules, fixed, [], None)
+
+    def solveFull(self, residents, services, rules, domain, symmetry_classes, start):
+        m = schedulingModel(self.gurobi_params, self.model_params, self.optimization_params)
+        m.build_model(residents, services, domain)
+        if self.model_params.get('symmetry_breaking', True):
+            m.add_symmetry_breaking(residents, services, symmetry_classes)
+        addRulesToModel(rules, m, residents, services)
+        if start is not None:
+            m.setStart(start)
+        m.optimize(residents, services)
+        return m
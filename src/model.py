@@ -1,64 +1,369 @@
-import csv
+import itertools
+import numpy as np
+import scipy.sparse as sp
 import gurobipy as gb
 from gurobipy import GRB
+from .backends import makeBackend, BackendException
+
+def sumMatrix(columns, n_cols, coeffs=None):
+    """Sparse matrix with one row per row of `columns`, summing the listed
+    columns (weighted by `coeffs` when given). Negative columns are skipped."""
+    n_rows, row_len = columns.shape
+    coeffs = np.broadcast_to(1.0 if coeffs is None else coeffs, columns.shape)
+    rows = np.broadcast_to(np.arange(n_rows)[:, None], columns.shape)
+    keep = columns >= 0
+    return sp.csr_matrix((coeffs[keep].astype(float), (rows[keep], columns[keep])),
+                         shape=(n_rows, n_cols))
+
+def solutionAssignment(values):
+    """(residents, weeks) service indices of an (R,S,W) solution, -1 where
+    no service is taken integrally"""
+    assignment = values.argmax(axis=1)
+    assignment[values.max(axis=1) < 0.5] = -1
+    return assignment
 
 class schedulingModel:
     hardness_interval = 6
     n_weeks = 52
 
-    def __init__(self, gurobi_params):
+    def __init__(self, gurobi_params, model_params=None, optimization_params=None):
         print(gurobi_params)
+        self.gurobi_params = gurobi_params
         self.BestObjStop = gurobi_params['BestObjStop']
         self.MIPFocus    = gurobi_params['MIPFocus']
         self.Threads     = gurobi_params['Threads']
         self.Presolve    = gurobi_params['Presolve']
 
+        if model_params is None:
+            model_params = {}
+        # 'matrix' builds constraints through the MVar/sparse-matrix API,
+        # 'generator' through the original per-row tupledict expressions
+        self.build_method = model_params.get('build', 'matrix')
+        # lean models skip per-row constraint names
+        self.lean = model_params.get('lean', False)
+        # 'window' sums every hardness_interval window explicitly,
+        # 'prefix_sum' differences cumulative weekly hours
+        self.hours_formulation = model_params.get('hours', 'prefix_sum')
+        # 'aggregated' links in_blocks starts and single_block run starts
+        # to every week, 'weak' keeps the original block sums
+        self.block_formulation = model_params.get('blocks', 'aggregated')
+        # only create variables the rules leave free, folding fixed ones in
+        # as constants
+        self.sparse_domain = model_params.get('sparse_domain', True)
 
-    def build_model(self, residents, services):
-        hardness_interval = schedulingModel.hardness_interval
-        n_weeks = schedulingModel.n_weeks
-        n_residents = len(residents)
-        n_services = len(services)
+        if optimization_params is None:
+            optimization_params = {}
+        # 'hierarchical' uses Gurobi multi-objective priorities, 'sequential'
+        # re-solves phase 2 warm started from the phase 1 incumbent
+        self.objective_method = optimization_params.get('method', 'hierarchical')
+        # solver the built model is handed to: 'gurobi', 'highs' or 'cpsat'
+        self.backend = optimization_params.get('backend', 'gurobi')
+        # a fixed cap on the interval hours skips phase 1 altogether
+        self.interval_cap = optimization_params.get('max_hours_per_interval', None)
+        self.interval_tolerance = optimization_params.get('interval_tolerance', 0.)
+        self.phase_params = [optimization_params.get('phase1', {}),
+                             optimization_params.get('phase2', {})]
+        # Gurobi callback (e.g. a profiling.progressLog) passed to every solve
+        self.callback = None
+
+    def constrName(self, name):
+        return "" if self.lean else name
 
+    def build_model(self, residents, services, domain=None, blocks=None):
+        """Build the base model over the free schedule entries. blocks, a
+        (block_weeks, tied) pair, builds it over blocks (see tieBlocks)."""
         try:
             self.model = gb.Model('Residency Scheduler')
+            self.shape = (len(residents), len(services), schedulingModel.n_weeks)
 
-            self.schedule = self.model.addVars(
-                n_residents, n_services, n_weeks,
-                vtype = GRB.BINARY,
-                name = 'X')
-
-            #Add basic model constraints
-
-            #Residents can be on one service at a time
-            self.model.addConstrs((self.schedule.sum(r,'*',t) == 1
-                                   for r in range(n_residents)
-                                   for t in range(n_weeks)),
-                                  name="One service per resident")
-
-            #Each resident must meet their requirements
-            for s_idx, s in enumerate(services):
-                self.model.addConstrs((self.schedule.sum(r,s_idx,'*') >= residents[r].service_lbs[s.name]
-                                       for r in range(n_residents) if residents[r].service_lbs[s.name]),
-                                      name="Residents requirements for "+s.name)
-
-            #Each service must meet its coverage bounds
-            for s_idx, s in enumerate(services):
-                self.model.addConstrs((self.schedule.sum('*',s_idx,t) >= s.lb
-                                       for t in range(n_weeks) if s.lb),
-                                      name="Service coverage lower bounds")
-                self.model.addConstrs((self.schedule.sum('*',s_idx,t) <= s.ub
-                                       for t in range(n_weeks) if s.ub),
-                                      name="Service coverage upper bounds")
-
-            self.model.setParam('BestObjStop', self.BestObjStop)
-            self.model.setParam('MIPFocus', self.MIPFocus)
-            self.model.setParam('Threads', self.Threads)
-            self.model.setParam('Presolve', self.Presolve)
+            self.domain = domain if self.sparse_domain else None
+            if self.domain is None:
+                self.free = np.ones(self.shape, dtype=bool)
+                self.constants = np.zeros(self.shape, dtype=int)
+            else:
+                self.free = self.domain.free()
+                self.constants = self.domain.fixedOne().astype(int)
+            self.n_free = int(self.free.sum())
+            # column values of a solve by another backend
+            self.values = None
+            self.columns = np.full(self.shape, -1, dtype=int)
+            self.columns[self.free] = np.arange(self.n_free)
+            if blocks is not None:
+                self.tieBlocks(*blocks)
+
+            if self.build_method == 'matrix':
+                self.build_matrix(residents, services)
+            else:
+                self.build_generator(residents, services)
+
+            self.setParams()
 
         except gb.GurobiError as e:
             print('Error code '+str(e.errno) + ": "+str(e))
 
+    def setParams(self):
+        self.model.setParam('BestObjStop', self.BestObjStop)
+        self.model.setParam('MIPFocus', self.MIPFocus)
+        self.model.setParam('Threads', self.Threads)
+        self.model.setParam('Presolve', self.Presolve)
+
+    def absorbs(self, rule):
+        """True if the variable domain already enforces the rule"""
+        return self.domain is not None and rule in self.domain.absorbed
+
+    def sum(self, r, s, t):
+        """schedule.sum with '*' wildcards, counting the entries fixed to one
+        as constants"""
+        index = tuple(slice(None) if i == '*' else i for i in (r, s, t))
+        return self.schedule.sum(r, s, t) + int(self.constants[index].sum())
+
+    def var(self, r, s, t):
+        """Schedule variable, or the constant it is fixed to"""
+        return self.schedule.get((r, s, t), int(self.constants[r, s, t]))
+
+    def freeKeys(self):
+        return [ (int(r), int(s), int(t)) for r, s, t in zip(*np.nonzero(self.free)) ]
+
+    def columnKeys(self):
+        """Key of the first free entry of each column"""
+        keys = self.freeKeys()
+        _, first = np.unique(self.columns[self.free], return_index=True)
+        return [ keys[i] for i in first ]
+
+    def columnValues(self, x):
+        """(R,S,W) array of the column values x, including the fixed entries"""
+        values = self.constants.astype(float)
+        values[self.free] = x[self.columns[self.free]]
+        return values
+
+    def linearRows(self, arrange, coeffs=None):
+        """Sparse matrix over the free variables and constant offsets of rows
+        summing schedule entries. arrange lays an (R,S,W) array out as
+        (n_rows, row_len), one row per constraint."""
+        columns = arrange(self.columns)
+        coeffs = np.broadcast_to(1.0 if coeffs is None else coeffs, columns.shape)
+        offset = (coeffs * arrange(self.constants)).sum(axis=1)
+        return sumMatrix(columns, self.n_free, coeffs), offset
+
+    def entryRows(self, rows, n_rows, r, s, t, coeffs=None):
+        """Sparse matrix over the free variables and constant offsets of
+        n_rows rows, where row rows[k] holds coeffs[k] * X[r[k],s[k],t[k]]"""
+        rows = np.asarray(rows, dtype=int)
+        coeffs = np.broadcast_to(1.0 if coeffs is None else coeffs, rows.shape).astype(float)
+        columns = self.columns[r, s, t]
+        free = columns >= 0
+        A = sp.csr_matrix((coeffs[free], (rows[free], columns[free])),
+                          shape=(n_rows, self.n_free))
+        offset = np.bincount(rows, weights=coeffs * self.constants[r, s, t],
+                             minlength=n_rows)
+        return A, offset
+
+    def addMatrixRows(self, A, offset, sense, rhs, name):
+        """Add A @ X + offset (sense) rhs, returning the MConstr and the
+        indices of the rows kept"""
+        rhs = np.broadcast_to(rhs, offset.shape) - offset
+        #rows left without variables are dropped unless the constants violate them
+        if sense == GRB.EQUAL:
+            violated = rhs != 0
+        elif sense == GRB.GREATER_EQUAL:
+            violated = rhs > 0
+        else:
+            violated = rhs < 0
+        keep = np.nonzero((A.getnnz(axis=1) > 0) | violated)[0]
+        if len(keep) == 0:
+            return None, keep
+        return self.model.addMConstr(A[keep], self.x, sense, rhs[keep],
+                                     name=self.constrName(name)), keep
+
+    def addRows(self, arrange, sense, rhs, name):
+        A, offset = self.linearRows(arrange)
+        return self.addMatrixRows(A, offset, sense, rhs, name)
+
+    def addEntryRows(self, rows, n_rows, r, s, t, sense, rhs, name, coeffs=None):
+        A, offset = self.entryRows(rows, n_rows, r, s, t, coeffs)
+        return self.addMatrixRows(A, offset, sense, rhs, name)
+
+    def build_generator(self, residents, services):
+        n_weeks = schedulingModel.n_weeks
+        n_residents = len(residents)
+        n_services = len(services)
+
+        columns = self.model.addVars(
+            self.columnKeys(),
+            vtype = GRB.BINARY,
+            name = 'X')
+        self.x = gb.MVar.fromlist(list(columns.values()))
+        self.schedule = gb.tupledict(zip(self.freeKeys(),
+                                         self.x[self.columns[self.free]].tolist()))
+
+        #Add basic model constraints
+
+        #Residents can be on one service at a time
+        self.model.addConstrs((self.sum(r,'*',t) == 1
+                               for r in range(n_residents)
+                               for t in range(n_weeks)),
+                              name=self.constrName("One service per resident"))
+
+        #Each resident must meet their requirements
+        self.requirement_constrs = {}
+        for s_idx, s in enumerate(services):
+            constrs = self.model.addConstrs((self.sum(r,s_idx,'*') >= int(residents.requirements[r,s_idx])
+                                             for r in np.nonzero(residents.has_requirement[:,s_idx])[0].tolist()),
+                                            name=self.constrName("Residents requirements for "+s.name))
+            self.requirement_constrs.update(((r, s_idx), c) for r, c in constrs.items())
+
+        #Each service must meet its coverage bounds
+        for s_idx, s in enumerate(services):
+            self.model.addConstrs((self.sum('*',s_idx,t) >= s.lb
+                                   for t in range(n_weeks) if s.lb),
+                                  name=self.constrName("Service coverage lower bounds"))
+            self.model.addConstrs((self.sum('*',s_idx,t) <= s.ub
+                                   for t in range(n_weeks) if s.ub),
+                                  name=self.constrName("Service coverage upper bounds"))
+
+    def build_matrix(self, residents, services):
+        n_weeks = schedulingModel.n_weeks
+        n_residents = len(residents)
+        n_services = len(services)
+
+        self.x = self.model.addMVar(self.n_free,
+                                    vtype = GRB.BINARY,
+                                    name = [ "X[{:d},{:d},{:d}]".format(*k)
+                                             for k in self.columnKeys() ])
+
+        # rules index the schedule by (r,s,t), so expose the same variables
+        # through a tupledict
+        self.schedule = gb.tupledict(zip(self.freeKeys(),
+                                         self.x[self.columns[self.free]].tolist()))
+
+        #Residents can be on one service at a time
+        self.addRows(lambda a: a.transpose(0, 2, 1).reshape(n_residents*n_weeks, n_services),
+                     GRB.EQUAL, 1., "One service per resident")
+
+        #Each resident must meet their requirements
+        # (r, s) -> requirement row, for editing requirements in place
+        self.requirement_constrs = {}
+        r_sel, s_sel = np.nonzero(residents.has_requirement)
+        if len(r_sel):
+            constrs, kept = self.addRows(lambda a: a[r_sel, s_sel, :],
+                                         GRB.GREATER_EQUAL, residents.requirements[r_sel, s_sel],
+                                         "Residents requirements")
+            if constrs is not None:
+                self.requirement_constrs = dict(zip(zip(r_sel[kept].tolist(), s_sel[kept].tolist()),
+                                                    constrs.tolist()))
+
+        #Each service must meet its coverage bounds
+        for bounds, sense, name in [(services.lb, GRB.GREATER_EQUAL, "Service coverage lower bounds"),
+                                    (services.ub, GRB.LESS_EQUAL, "Service coverage upper bounds")]:
+            s_sel = np.nonzero(~np.isnan(bounds))[0]
+            if len(s_sel) == 0:
+                continue
+            self.addRows(lambda a: a[:, s_sel, :].transpose(1, 2, 0).reshape(-1, n_residents),
+                         sense, np.repeat(bounds[s_sel], n_weeks), name)
+
+    def add_symmetry_breaking(self, residents, services, classes):
+        """Order interchangeable residents lexicographically by the services
+        they take in their first free weeks.
+
+        Each week holds exactly one service, so sum_s s*X[r,s,t] is the index
+        of the service taken in week t and weighting week t by
+        n_services**(lex_weeks-1-t) encodes the first lex_weeks free weeks as a
+        base n_services number. Any permutation of a class maps schedules onto
+        equivalent ones, so requiring this number to be non-decreasing
+        within a class removes permutations without cutting off an optimum.
+        lex_weeks is kept small enough for the coefficients to stay well scaled.
+        """
+        n_weeks = schedulingModel.n_weeks
+        n_services = len(services)
+        lex_weeks = max(1, int(np.log(1e6) / np.log(max(n_services, 2))))
+        available = residents.availability(n_weeks)
+
+        for c_idx, members in enumerate(classes):
+            #residents in a class share their vacation weeks
+            weeks = np.nonzero(available[members[0]])[0][:lex_weeks].tolist()
+
+            def encoding(r):
+                return gb.quicksum(n_services**(len(weeks)-1-i) * s * self.var(r,s,t)
+                                   for i, t in enumerate(weeks)
+                                   for s in range(1, n_services))
+
+            for first, second in zip(members[:-1], members[1:]):
+                self.model.addConstr(encoding(first) <= encoding(second),
+                                     name=self.constrName("symmetry_class"+str(c_idx)
+                                                          +"_"+str(first)))
+
+    def relaxWeeks(self, first_week):
+        """Relax the schedule variables of first_week onwards to continuous
+        values in [0,1]"""
+        columns = self.columns[:, :, first_week:]
+        columns = columns[columns >= 0]
+        if len(columns):
+            self.x[columns].VType = GRB.CONTINUOUS
+
+    def tieBlocks(self, block_weeks, tied):
+        """Aggregate the schedule into blocks of block_weeks weeks: for the
+        (resident, service) pairs marked in the (R,S) mask tied, every week
+        of a block shares one column, so a resident takes the service in
+        every week of the block or in none. A block with a week the domain
+        rules the service out of is never taken. Blocks holding a week the
+        domain fixes are left untied. Called by build_model before the
+        variables are created."""
+        n_residents, n_services, n_weeks = self.shape
+        n_blocks = n_weeks // block_weeks
+        n_tied_weeks = n_blocks * block_weeks
+        open_weeks = np.ones((n_residents, n_weeks), dtype=bool) if self.domain is None \
+            else self.domain.fixed < 0
+        open_blocks = open_weeks[:, :n_tied_weeks].reshape(
+            n_residents, n_blocks, block_weeks).all(axis=2)
+        tie = np.repeat(tied[:, :, None] & open_blocks[:, None, :], block_weeks, axis=2)
+
+        self.free = self.free.copy()
+        weeks = self.free[:, :, :n_tied_weeks]
+        whole = np.repeat(weeks.reshape(n_residents, n_services, n_blocks, block_weeks)
+                          .all(axis=3), block_weeks, axis=2)
+        weeks &= whole | ~tie
+
+        # later weeks of a tied block take the column of its first week, and
+        # the columns left in use are renumbered
+        columns = np.full(self.shape, -1, dtype=int)
+        columns[self.free] = np.arange(self.free.sum())
+        first = np.arange(n_tied_weeks) - np.arange(n_tied_weeks) % block_weeks
+        columns[:, :, :n_tied_weeks] = np.where(tie & weeks, columns[:, :, first],
+                                                columns[:, :, :n_tied_weeks])
+        used, self.columns[self.free] = np.unique(columns[self.free], return_inverse=True)
+        self.columns[~self.free] = -1
+        self.n_free = len(used)
+
+    def setStart(self, assignment):
+        """MIP start from a (residents, weeks) array of service indices, -1
+        leaving that resident-week to the solver"""
+        start = np.full(self.shape, GRB.UNDEFINED)
+        r_idx, t_idx = np.nonzero(assignment >= 0)
+        start[r_idx, :, t_idx] = 0
+        start[r_idx, assignment[r_idx, t_idx], t_idx] = 1
+
+        # a tied block starts from the start's value when its weeks agree on
+        # it, and is left to the solver otherwise
+        columns, values = self.columns[self.free], start[self.free]
+        low = np.full(self.n_free, np.inf)
+        high = np.full(self.n_free, -np.inf)
+        np.minimum.at(low, columns, values)
+        np.maximum.at(high, columns, values)
+        self.model.setAttr('Start', self.x.tolist(),
+                           np.where(low == high, low, GRB.UNDEFINED).tolist())
+
+    def solution(self):
+        """(R,S,W) array of the incumbent including the fixed entries"""
+        if self.values is not None:
+            values = self.constants.astype(float)
+            values[self.free] = self.values[[ v.index for v in self.schedule.values() ]]
+            return values
+        return self.columnValues(self.x.X)
+
+    def assignment(self):
+        """(residents, weeks) service indices of the incumbent"""
+        return solutionAssignment(self.solution())
+
     def performIISAnalysis(self):
         try:
             self.model.computeIIS()
@@ -69,91 +374,347 @@ class schedulingModel:
         except gb.GurobiError as e:
             print('Error code '+str(e.errno) + ": "+str(e))
 
-    def optimize(self, residents, services):
+    def add_hours(self, residents, services):
+        """Define the per-resident average hours over every hardness_interval
+        window and over the whole year"""
+        if self.build_method == 'matrix':
+            if self.hours_formulation == 'prefix_sum':
+                self.hours_prefix_matrix(residents, services)
+            else:
+                self.hours_window_matrix(residents, services)
+        else:
+            if self.hours_formulation == 'prefix_sum':
+                self.hours_prefix_generator(residents, services)
+            else:
+                self.hours_window_generator(residents, services)
+
+    def hours_window_generator(self, residents, services):
         hardness_interval = schedulingModel.hardness_interval
         n_weeks = schedulingModel.n_weeks
         n_residents = len(residents)
         n_services = len(services)
-        
+        n_intervals = n_weeks - hardness_interval
+        hardness = services.hardness.tolist()
+
+        #Compute hardess over hardness_interval
+        self.hrs_per_interval = self.model.addVars(n_residents, n_intervals,
+                                                   vtype=GRB.CONTINUOUS,
+                                                   name=str(hardness_interval)+"-week avg hrs")
+
+        self.model.addConstrs((gb.quicksum(self.var(r,s,tt) * hardness[s]
+                                           for s in range(n_services)
+                                           for tt in range(t, t+hardness_interval))
+                               == self.hrs_per_interval[r,t] * hardness_interval
+                               for r in range(n_residents)
+                               for t in range(n_intervals)),
+                              name=self.constrName("Interval definition"))
+
+        self.avg_hrs_per_year = self.model.addVars(n_residents,
+                                                   vtype=GRB.CONTINUOUS,
+                                                   name="Avg hours per year")
+
+        self.model.addConstrs((gb.quicksum(self.var(r,s,t) * hardness[s]
+                                           for s in range(n_services)
+                                           for t in range(n_weeks)) == self.avg_hrs_per_year[r] * n_weeks
+                               for r in range(n_residents)),
+                              name=self.constrName("Avg hours definition"))
+
+    def hours_prefix_generator(self, residents, services):
+        hardness_interval = schedulingModel.hardness_interval
+        n_weeks = schedulingModel.n_weeks
+        n_residents = len(residents)
+        n_services = len(services)
+        n_intervals = n_weeks - hardness_interval
+        hardness = services.hardness.tolist()
+
+        # cum_hrs[r,t] holds the hours worked in weeks 0..t
+        cum_hrs = self.model.addVars(n_residents, n_weeks,
+                                     vtype=GRB.CONTINUOUS,
+                                     name="Cumulative hrs")
+
+        self.model.addConstrs((cum_hrs[r,t] == (cum_hrs[r,t-1] if t else 0)
+                               + gb.quicksum(self.var(r,s,t) * hardness[s]
+                                             for s in range(n_services))
+                               for r in range(n_residents)
+                               for t in range(n_weeks)),
+                              name=self.constrName("Cumulative hours definition"))
+
+        self.hrs_per_interval = self.model.addVars(n_residents, n_intervals,
+                                                   vtype=GRB.CONTINUOUS,
+                                                   name=str(hardness_interval)+"-week avg hrs")
+
+        self.model.addConstrs((cum_hrs[r,t+hardness_interval-1] - (cum_hrs[r,t-1] if t else 0)
+                               == self.hrs_per_interval[r,t] * hardness_interval
+                               for r in range(n_residents)
+                               for t in range(n_intervals)),
+                              name=self.constrName("Interval definition"))
+
+        self.avg_hrs_per_year = self.model.addVars(n_residents,
+                                                   vtype=GRB.CONTINUOUS,
+                                                   name="Avg hours per year")
+
+        self.model.addConstrs((cum_hrs[r,n_weeks-1] == self.avg_hrs_per_year[r] * n_weeks
+                               for r in range(n_residents)),
+                              name=self.constrName("Avg hours definition"))
+
+    def hours_window_matrix(self, residents, services):
+        hardness_interval = schedulingModel.hardness_interval
+        n_weeks = schedulingModel.n_weeks
+        n_residents = len(residents)
+        n_services = len(services)
+        n_intervals = n_weeks - hardness_interval
+
+        hardness = services.hardness
+
+        def windows(a):
+            # windows[r,s,t,:] holds the entries of weeks t..t+hardness_interval-1
+            windows = np.lib.stride_tricks.sliding_window_view(
+                a, hardness_interval, axis=2)[:, :, :n_intervals, :]
+            return windows.transpose(0, 2, 1, 3).reshape(n_residents*n_intervals, -1)
+
+        #Compute hardess over hardness_interval
+        hrs = self.model.addMVar((n_residents, n_intervals),
+                                 vtype=GRB.CONTINUOUS,
+                                 name=str(hardness_interval)+"-week avg hrs")
+        A, offset = self.linearRows(windows, np.repeat(hardness, hardness_interval))
+        self.model.addConstr(A @ self.x + offset
+                             == hardness_interval * hrs.reshape(-1),
+                             name=self.constrName("Interval definition"))
+
+        avg = self.model.addMVar(n_residents,
+                                 vtype=GRB.CONTINUOUS,
+                                 name="Avg hours per year")
+        A, offset = self.linearRows(lambda a: a.reshape(n_residents, n_services*n_weeks),
+                                    np.repeat(hardness, n_weeks))
+        self.model.addConstr(A @ self.x + offset
+                             == n_weeks * avg,
+                             name=self.constrName("Avg hours definition"))
+
+        self.setHoursVars(hrs, avg)
+
+    def hours_prefix_matrix(self, residents, services):
+        hardness_interval = schedulingModel.hardness_interval
+        n_weeks = schedulingModel.n_weeks
+        n_residents = len(residents)
+        n_services = len(services)
+        n_intervals = n_weeks - hardness_interval
+
+        hardness = services.hardness
+
+        # cum_hrs[r,t] holds the hours worked in weeks 0..t
+        cum_hrs = self.model.addMVar((n_residents, n_weeks),
+                                     vtype=GRB.CONTINUOUS,
+                                     name="Cumulative hrs")
+        cum_flat = cum_hrs.reshape(-1)
+        cum_idx = np.arange(n_residents*n_weeks).reshape(n_residents, n_weeks)
+
+        # cum_hrs[r,t] - cum_hrs[r,t-1] == weekly hours of week t
+        weekly, offset = self.linearRows(
+            lambda a: a.transpose(0, 2, 1).reshape(n_residents*n_weeks, n_services),
+            hardness)
+        prev = cum_idx[:, :-1].reshape(-1)
+        diff = sp.identity(cum_flat.size, format='csr') \
+            - sp.csr_matrix((np.ones(prev.size), (prev + 1, prev)),
+                            shape=(cum_flat.size, cum_flat.size))
+        self.model.addConstr(diff @ cum_flat == weekly @ self.x + offset,
+                             name=self.constrName("Cumulative hours definition"))
+
+        #Each window is the difference of two prefix sums
+        hrs = self.model.addMVar((n_residents, n_intervals),
+                                 vtype=GRB.CONTINUOUS,
+                                 name=str(hardness_interval)+"-week avg hrs")
+        last = cum_idx[:, hardness_interval-1:hardness_interval-1+n_intervals].reshape(-1)
+        before = cum_idx[:, :n_intervals-1].reshape(-1)
+        window_rows = np.arange(n_residents*n_intervals).reshape(n_residents, n_intervals)
+        window = sp.csr_matrix((np.ones(last.size), (window_rows.reshape(-1), last)),
+                               shape=(window_rows.size, cum_flat.size)) \
+            - sp.csr_matrix((np.ones(before.size), (window_rows[:, 1:].reshape(-1), before)),
+                            shape=(window_rows.size, cum_flat.size))
+        self.model.addConstr(window @ cum_flat
+                             == hardness_interval * hrs.reshape(-1),
+                             name=self.constrName("Interval definition"))
+
+        avg = self.model.addMVar(n_residents,
+                                 vtype=GRB.CONTINUOUS,
+                                 name="Avg hours per year")
+        self.model.addConstr(cum_hrs[:, n_weeks-1] == n_weeks * avg,
+                             name=self.constrName("Avg hours definition"))
+
+        self.setHoursVars(hrs, avg)
+
+    def setHoursVars(self, hrs, avg):
+        n_residents, n_intervals = hrs.shape
+        self.hrs_per_interval = gb.tupledict(
+            zip(itertools.product(range(n_residents), range(n_intervals)),
+                hrs.reshape(-1).tolist()))
+        self.avg_hrs_per_year = gb.tupledict(enumerate(avg.tolist()))
+
+    def add_maxima(self, residents, services):
+        """Epigraph variables bounding the interval and yearly average
+        hours of every resident from above"""
+        if hasattr(self, 'max_hrs_per_interval'):
+            return
+        if not hasattr(self, 'hrs_per_interval'):
+            self.add_hours(residents, services)
+
+        #Both maxima are epigraph variables bounding every term from above
+        self.max_hrs_per_interval = self.model.addVar(vtype=GRB.CONTINUOUS,
+                                                      name='max_hours_per_interval_overall')
+        self.model.addConstr(gb.MVar.fromlist(list(self.hrs_per_interval.values()))
+                             <= self.max_hrs_per_interval,
+                             name=self.constrName("max_hrs_per_int definition"))
+
+        self.max_hrs_per_year = self.model.addVar(vtype=GRB.CONTINUOUS,
+                                                  name='max_hours_per_year_overall')
+        self.model.addConstr(gb.MVar.fromlist(list(self.avg_hrs_per_year.values()))
+                             <= self.max_hrs_per_year,
+                             name=self.constrName("overall_max_avg_hrs_per_year definition"))
+
+    def optimize(self, residents, services):
         try:
-            # Perform 2 phase optimization process
+            # Lexicographic 2 phase optimization process
             # (1) optimize the maximum number of hours worked over hardness inverval by any resident
-            # (2) add this limit as a constraint to the model
-            # (3) optimize the maximum number of hours worked over the year by any resident
-            #Compute hardess over hardness_interval
-            hrs_per_interval = self.model.addVars(n_residents, n_weeks-hardness_interval,
-                                                  vtype=GRB.CONTINUOUS,
-                                                  name=str(hardness_interval)+"-week avg hrs")
-
-            self.model.addConstrs((gb.quicksum(self.schedule[r,s,tt] * services[s].hardness
-                                               for s in range(n_services)
-                                               for tt in range(t, t+hardness_interval))
-                                   == hrs_per_interval[r,t] * hardness_interval
-                                   for r in range(n_residents)
-                                   for t in range(n_weeks -hardness_interval)),
-                                  name="Interval definition")
-
-            max_hrs_per_interval = self.model.addVars(n_residents, vtype=GRB.CONTINUOUS,
-                                                      name="max "+str(hardness_interval)+"-week avg hrs")
-
-            self.model.addConstrs((max_hrs_per_interval[r] == gb.max_([hrs_per_interval[r,t] for t in range(n_weeks-hardness_interval)])
-                                   for r in range(n_residents)),
-                                  name="defn max hardness")
-            
-            '''
-            max_hrs_per_int_overall = self.model.addVar(vtype=GRB.CONTINUOUS,
-                                                        name='max_hours_per_interval_overall')
-            self.model.addConstr(max_hrs_per_int_overall == gb.max_(max_hrs_per_interval), name="max_hrs_per_int definition")
-            self.model.setObjective(max_hrs_per_int_overall)
-            self.model.optimize()
-            '''
-            self.max_avg_hours_per_interval = 65 #self.model.objVal
-
-            #add the previous objective as the new bound
-            self.model.addConstrs((hrs_per_interval[r,t] <= self.max_avg_hours_per_interval
-                                   for r in range(n_residents)
-                                   for t in range(n_weeks-hardness_interval)),
-                                  name="Bound hours per interval")
-
-
-            avg_hrs_per_year = self.model.addVars(n_residents,
-                                                  vtype=GRB.CONTINUOUS,
-                                                  name="Avg hours per year")
-
-            self.model.addConstrs((gb.quicksum(self.schedule[r,s,t] * services[s].hardness
-                                               for s in range(n_services)
-                                               for t in range(n_weeks)) == avg_hrs_per_year[r] * n_weeks
-                                   for r in range(n_residents)),
-                                  name="Avg hours definition")
-
-            overall_max_avg_hrs_per_year = self.model.addVar(vtype=GRB.CONTINUOUS,
-                                                     name='max_hours_per_year_overall')
-            self.model.addConstr(overall_max_avg_hrs_per_year == gb.max_(avg_hrs_per_year), name="overall_max_avg_hrs_per_year definition")
-            
-            self.model.setObjective(overall_max_avg_hrs_per_year)
-            self.model.optimize()
-            self.max_avg_hours_per_year = self.model.objVal
+            # (2) keep this limit (up to interval_tolerance) while
+            # (3) optimizing the maximum number of hours worked over the year by any resident
+            self.add_maxima(residents, services)
+            # phase 2 value of the interval epigraph variable, and the cap
+            # phase 2 kept it under
+            self.interval_bound = None
+            self.interval_limit = None
+
+            if self.backend != 'gurobi':
+                self.optimizeBackend(services)
+            elif self.interval_cap is not None:
+                #phase 1 is replaced by a fixed cap
+                self.max_hrs_per_interval.UB = self.interval_cap
+                self.model.setObjective(self.max_hrs_per_year)
+                self.setPhaseParams(self.model, self.phase_params[1])
+                if not self.solvePhase(1):
+                    return
+                self.interval_bound = self.max_hrs_per_interval.X
+                self.interval_limit = self.interval_cap
+                self.max_avg_hours_per_year = self.model.objVal
+            elif self.objective_method == 'hierarchical':
+                self.optimizeHierarchical()
+            else:
+                self.optimizeSequential()
+
+            if self.interval_bound is not None:
+                # phase 2 only bounds the epigraph variable from above, the
+                # interval maximum itself comes from the schedule
+                self.max_avg_hours_per_interval = self.scheduleIntervalHours(services)
 
         except gb.GurobiError as e:
             print('Error code '+str(e.errno) + ": "+str(e))
 
-    def write_csv(self, filename, residents, services):
-        attr_schedule = self.model.getAttr('X', self.schedule)
-        with open(filename, 'w') as csvfile:
-            writer = csv.writer(csvfile)
+    def solvePhase(self, phase):
+        """Optimize the current phase, False when no solution was found"""
+        if self.callback is not None:
+            self.callback.phase = phase
+        self.model.optimize(self.callback)
+        return self.model.SolCount > 0
+
+    def setPhaseParams(self, target, params):
+        for key, value in params.items():
+            target.setParam(key, value)
+
+    def optimizeHierarchical(self):
+        self.model.ModelSense = GRB.MINIMIZE
+        self.model.setObjectiveN(gb.LinExpr(self.max_hrs_per_interval), index=0, priority=2,
+                                 abstol=self.interval_tolerance, reltol=0,
+                                 name='max_hours_per_interval')
+        self.model.setObjectiveN(gb.LinExpr(self.max_hrs_per_year), index=1, priority=1,
+                                 name='max_hours_per_year')
+        for phase in range(2):
+            self.setPhaseParams(self.model.getMultiobjEnv(phase), self.phase_params[phase])
+        solved = self.solvePhase(0)
+        self.model.discardMultiobjEnvs()
+        if not solved:
+            return
+
+        self.interval_bound = self.max_hrs_per_interval.X
+        # Gurobi kept the interval objective within interval_tolerance of its
+        # optimum, which it does not report, and the bound lies below that
+        self.interval_limit = self.interval_bound
+        self.max_avg_hours_per_year = self.max_hrs_per_year.X
+
+    def optimizeSequential(self):
+        self.model.setObjective(self.max_hrs_per_interval)
+        self.setPhaseParams(self.model, self.phase_params[0])
+        if not self.solvePhase(0):
+            return
+        self.interval_limit = self.model.objVal + self.interval_tolerance
 
-            writer.writerow(['Name'] +
-                            ['Week '+str(w+2) for w in range(schedulingModel.n_weeks)])
+        #add the previous objective as the new bound
+        self.max_hrs_per_interval.UB = self.interval_limit
 
-            for r_idx,r in enumerate(residents):
-                line = [r.name]
-                for t in range(schedulingModel.n_weeks):
-                    service_idxs = []
-                    for s_idx in range(len(services)):
-                        if attr_schedule[(r_idx, s_idx,t)] > 0.5:
-                            service_idxs.append(s_idx)
-                    assert len(service_idxs)==1
+        #warm start phase 2 from the phase 1 incumbent
+        schedule_vars = list(self.schedule.values())
+        self.model.setAttr('Start', schedule_vars,
+                           self.model.getAttr('X', schedule_vars))
 
-                    line.append(services[service_idxs[0]].name)
+        self.model.setObjective(self.max_hrs_per_year)
+        #phase 1 budgets do not carry over to phase 2, which goes back to
+        #the gurobi section or else Gurobi's default
+        for key in self.phase_params[0]:
+            if key not in self.phase_params[1]:
+                self.model.setParam(key, self.gurobi_params[key] if key in self.gurobi_params
+                                    else self.model.getParamInfo(key)[5])
+        self.setPhaseParams(self.model, self.phase_params[1])
+        self.solvePhase(1)
+        self.interval_bound = self.max_hrs_per_interval.X
+        self.max_avg_hours_per_year = self.model.objVal
 
-                writer.writerow(line)
\ No newline at end of file
+    def scheduleIntervalHours(self, services):
+        """Maximum interval average hours of any resident in the incumbent"""
+        # export builds on this module
+        from .export import hoursSummary
+        return float(hoursSummary(self.assignment(), services)['max_hours_per_interval'].max())
+
+    def continuousScale(self, services):
+        """Grid on which every hours variable is exact: hardness decimals
+        times the hardness_interval and n_weeks divisors"""
+        hardness = services.hardness
+        decimals = 0
+        while decimals < 6 and not np.allclose(hardness * 10**decimals,
+                                               np.round(hardness * 10**decimals)):
+            decimals += 1
+        return 10**decimals * np.lcm(schedulingModel.hardness_interval,
+                                     schedulingModel.n_weeks)
+
+    def optimizeBackend(self, services):
+        """Lexicographic optimisation on a non-Gurobi backend: phase 2 is
+        solved with the interval maximum bounded by the phase 1 optimum (plus
+        interval_tolerance) and started from the phase 1 solution"""
+        backend = makeBackend(self.backend, self.model, self.Threads,
+                              self.continuousScale(services))
+        interval_col = self.max_hrs_per_interval.index
+        year_col = self.max_hrs_per_year.index
+
+        start = None
+        if self.interval_cap is not None:
+            #phase 1 is replaced by a fixed cap
+            bounds = {interval_col: self.interval_cap}
+        else:
+            phase1 = backend.solve(interval_col, {}, self.phase_params[0])
+            if not phase1.hasSolution():
+                raise BackendException(self.backend+" found no phase 1 solution ("+
+                                       phase1.status+")")
+            bounds = {interval_col: phase1.objective + self.interval_tolerance}
+            start = phase1.x
+        self.interval_limit = bounds[interval_col]
+
+        phase2 = backend.solve(year_col, bounds, self.phase_params[1], start)
+        if not phase2.hasSolution():
+            raise BackendException(self.backend+" found no phase 2 solution ("+
+                                   phase2.status+")")
+        self.values = phase2.x
+        self.interval_bound = phase2.x[interval_col]
+        self.max_avg_hours_per_year = phase2.objective
+
+    def write_csv(self, filename, residents, services):
+        # export builds on this module
+        from .export import write_schedule_csv
+        assignment = self.assignment()
+        assert (assignment >= 0).all()
+        write_schedule_csv(filename, assignment, residents, services)
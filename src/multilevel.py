@@ -0,0 +1,101 @@
+import time
+import numpy as np
+
+from .model import schedulingModel
+from .rules import addRulesToModel
+
+class multilevelSolve:
+    """Coarse-to-fine solve at block granularity.
+
+    The coarse level solves the model with the weeks aggregated into
+    blocks of coarse_weeks: one variable per resident, service and block,
+    shared by the weeks of the block, so a resident takes a service in
+    every week of a block or in none (schedulingModel.tieBlocks). The
+    start is projected onto the blocks. Only services whose
+    requirement is a multiple of the block size are tied, and blocks
+    holding a vacation or otherwise fixed week stay weekly, so the coarse
+    model keeps the requirements reachable.
+
+    The fine level solves at weekly resolution, started from the coarse
+    schedule, with every resident-week fixed to it except a neighbourhood
+    of refine_radius weeks on either side of each change of service. With
+    polish the full weekly model is finally solved from the refined
+    schedule. Each level uses the phase time limits.
+    """
+    def __init__(self, gurobi_params, model_params, optimization_params):
+        self.gurobi_params = gurobi_params
+        # the refinement fixes are folded in through the domain
+        self.model_params = dict(model_params or {}, sparse_domain=True)
+        self.optimization_params = optimization_params or {}
+        self.coarse_weeks = self.optimization_params.get('coarse_weeks', 2)
+        self.refine_radius = self.optimization_params.get('refine_radius', 1)
+        self.polish = self.optimization_params.get('polish', False)
+        self.levels = []
+
+    def solveLevel(self, name, residents, services, rules, domain, symmetry_classes,
+                   start, tied=None):
+        tic = time.perf_counter()
+        m = schedulingModel(self.gurobi_params, self.model_params,
+                            self.optimization_params)
+        m.build_model(residents, services, domain,
+                      None if tied is None else (self.coarse_weeks, tied))
+        if self.model_params.get('symmetry_breaking', True):
+            m.add_symmetry_breaking(residents, services, symmetry_classes)
+        addRulesToModel(rules, m, residents, services)
+        if start is not None:
+            m.setStart(start)
+        m.optimize(residents, services)
+        if m.values is None and m.model.SolCount == 0:
+            print("The "+name+" level found no solution")
+            return None
+
+        self.levels.append({'level': name,
+                            'variables': m.n_free,
+                            'solve [s]': time.perf_counter() - tic,
+                            'interval': m.max_avg_hours_per_interval,
+                            'year': m.max_avg_hours_per_year})
+        print("{:} level: {:d} variables, max hours per interval {:.1f}, per year {:.1f}".format(
+            name, m.n_free, m.max_avg_hours_per_interval, m.max_avg_hours_per_year))
+        return m
+
+    def tiedPairs(self, residents, services):
+        """(R,S) mask of the requirements a whole number of blocks covers"""
+        return residents.requirements % self.coarse_weeks == 0
+
+    def neighbourhood(self, assignment):
+        """(R,W) mask of the weeks within refine_radius of a change of
+        service, or left unassigned, in a schedule"""
+        n_weeks = assignment.shape[1]
+        change = assignment[:, 1:] != assignment[:, :-1]
+        free = assignment < 0
+        # a change between weeks c and c+1 frees weeks c-radius+1 .. c+radius
+        for d in range(1 - self.refine_radius, self.refine_radius + 1):
+            lo, hi = max(0, -d), min(n_weeks - 1, n_weeks - d)
+            free[:, lo+d:hi+d] |= change[:, lo:hi]
+        return free
+
+    def run(self, residents, services, rules, domain, symmetry_classes, start=None):
+        """Solve the coarse and fine levels (and the polish) and return the
+        schedulingModel of the last level solved"""
+        coarse = None
+        if self.coarse_weeks > 1:
+            coarse = self.solveLevel('coarse', residents, services, rules, domain,
+                                     symmetry_classes, start,
+                                     self.tiedPairs(residents, services))
+        if coarse is None:
+            return self.solveLevel('weekly', residents, services, rules, domain,
+                                   symmetry_classes, start)
+
+        assignment = coarse.assignment()
+        fine_domain = domain.copy()
+        for r, t in zip(*np.nonzero(~self.neighbourhood(assignment))):
+            fine_domain.fix(r, assignment[r, t], t)
+        fine = self.solveLevel('fine', residents, services, rules, fine_domain,
+                               symmetry_classes, assignment)
+        if fine is None:
+            fine = coarse
+        if not self.polish:
+            return fine
+        polished = self.solveLevel('polish', residents, services, rules, domain,
+                                   symmetry_classes, fine.assignment())
+        return fine if polished is None else polished
@@ -0,0 +1,86 @@
+import numpy as np
+from gurobipy import GRB
+
+from .model import solutionAssignment
+
+def hammingDistances(pool):
+    """(K,K) number of resident-weeks on which each pair of (K,R,W)
+    schedules differ"""
+    pool = np.asarray(pool)
+    return (pool[:, None] != pool[None, :]).sum(axis=(2, 3))
+
+class diversePool:
+    """Up to `size` schedules within `tolerance` yearly hours of the optimum,
+    pairwise differing on at least `min_distance` resident-weeks.
+
+    Works on a solved Gurobi schedulingModel in place. The interval hours
+    stay under the cap phase 2 kept them under, at most their optimum plus
+    interval_tolerance, and the yearly hours at their optimum plus
+    tolerance. One solve with PoolSearchMode 2 collects `candidates`
+    schedules, which are kept greedily in objective
+    order while they are far enough from those already kept. If that
+    leaves the pool short, each kept schedule gets a Hamming distance row
+    and the model is re-solved for one more schedule at a time until the
+    pool is full or no schedule remains. Every solve uses the phase 2
+    parameters and the model's callback.
+    """
+    def __init__(self, size, tolerance=0., min_distance=1, candidates=None):
+        self.size = size
+        self.tolerance = tolerance
+        self.min_distance = min_distance
+        self.candidates = candidates or 10 * size
+
+    def incumbents(self, m):
+        """Schedules of the solution pool of the last solve, best first"""
+        schedules = []
+        for k in range(m.model.SolCount):
+            m.model.setParam('SolutionNumber', k)
+            schedules.append(solutionAssignment(m.columnValues(m.x.Xn)))
+        return schedules
+
+    def keep(self, schedule):
+        if all((schedule != other).sum() >= self.min_distance for other in self.pool):
+            self.pool.append(schedule)
+
+    def excludeNeighbourhood(self, m, schedule):
+        """Require at least min_distance resident-weeks to differ from schedule"""
+        n_residents, n_weeks = schedule.shape
+        r, t = np.indices(schedule.shape).reshape(2, -1)
+        m.addEntryRows(np.zeros(r.size, dtype=int), 1, r, schedule.reshape(-1), t,
+                       GRB.LESS_EQUAL, n_residents * n_weeks - self.min_distance,
+                       m.constrName("Pool distance"))
+
+    def collect(self, m):
+        """Fill and return the pool, the model's incumbent first"""
+        self.pool = [m.assignment()]
+        model = m.model
+        m.max_hrs_per_interval.UB = m.interval_limit
+        m.max_hrs_per_year.UB = m.max_avg_hours_per_year + self.tolerance
+        # drop the hierarchical objectives before setting the single one
+        model.NumObj = 0
+        model.update()
+        model.setObjective(m.max_hrs_per_year, GRB.MINIMIZE)
+        m.setStart(self.pool[0])
+        m.setPhaseParams(model, m.phase_params[1])
+        # stopping at the first good schedule would leave the pool short
+        model.setParam('BestObjStop', -GRB.INFINITY)
+
+        model.setParam('PoolSearchMode', 2)
+        model.setParam('PoolSolutions', self.candidates)
+        model.setParam('PoolGapAbs', self.tolerance + 1e-6)
+        m.solvePhase(1)
+        for schedule in self.incumbents(m):
+            if len(self.pool) == self.size:
+                break
+            self.keep(schedule)
+
+        model.setParam('PoolSearchMode', 0)
+        for schedule in self.pool:
+            self.excludeNeighbourhood(m, schedule)
+        while len(self.pool) < self.size:
+            if not m.solvePhase(1):
+                break
+            schedule = m.assignment()
+            self.pool.append(schedule)
+            self.excludeNeighbourhood(m, schedule)
+        return self.pool
@@ -0,0 +1,120 @@
+import contextlib
+import json
+import time
+from gurobipy import GRB
+
+def modelSize(scheduler):
+    """(variables, constraints, nonzeros) of a schedulingModel's Gurobi
+    model including pending changes, zero before it is built"""
+    model = getattr(scheduler, 'model', None)
+    if model is None:
+        return 0, 0, 0
+    model.update()
+    return model.NumVars, model.NumConstrs, model.NumNZs
+
+class profiler:
+    """Wall and CPU timers around the phases of a run and around each rule
+    added to the model. When a schedulingModel is given, a timed section
+    also records the variables, constraints and nonzeros it added. CPU time
+    is the process time, so it includes the solver's worker threads."""
+    def __init__(self):
+        self.phases = []
+        self.rules = []
+
+    @contextlib.contextmanager
+    def measure(self, records, entry, scheduler=None):
+        before = modelSize(scheduler) if scheduler is not None else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            if scheduler is not None:
+                after = modelSize(scheduler)
+                entry.update(zip(['variables', 'constraints', 'nonzeros'],
+                                 [ a - b for a, b in zip(after, before) ]))
+            entry['wall [s]'] = time.perf_counter() - wall
+            entry['cpu [s]'] = time.process_time() - cpu
+            records.append(entry)
+
+    def phase(self, name, scheduler=None):
+        return self.measure(self.phases, {'phase': name}, scheduler)
+
+    def rule(self, rule, scheduler):
+        return self.measure(self.rules, {'rule': rule.name, 'type': rule.config_name},
+                            scheduler)
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'phases': self.phases, 'rules': self.rules}, f, indent=2)
+
+    def print_summary(self, n_rules=10):
+        """Phase timings, then the rules adding the most nonzeros"""
+        keys = ['wall [s]', 'cpu [s]', 'variables', 'constraints', 'nonzeros']
+        print(' '.join('{:>14}'.format(k) for k in ['phase'] + keys))
+        for entry in self.phases:
+            print(' '.join([ '{:>14}'.format(entry['phase']) ] +
+                           [ '{:>14}'.format('{:.3f}'.format(entry[k]) if isinstance(entry.get(k), float)
+                                             else str(entry.get(k, '-'))) for k in keys ]))
+        if self.rules:
+            print("Largest rules by nonzeros")
+            for entry in sorted(self.rules, key=lambda e: -e['nonzeros'])[:n_rules]:
+                print("{:>24} {:>14} {:8.3f}s {:8d} vars {:8d} constrs {:10d} nnz".format(
+                    entry['rule'], entry['type'], entry['wall [s]'], entry['variables'],
+                    entry['constraints'], entry['nonzeros']))
+
+def timed(profile, name, scheduler=None):
+    """profile.phase(name, scheduler), or a no-op when profiling is off"""
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.phase(name, scheduler)
+
+class progressLog:
+    """Gurobi callback streaming MIP progress to a JSONL file.
+
+    Each line holds the objective phase, the solver runtime and the wall
+    time since the log was opened, the incumbent, best bound, relative gap
+    and node count. A line is written for every new incumbent and otherwise
+    at most once every `interval` seconds. schedulingModel sets `phase`
+    before each sequential solve; hierarchical solves update it from the
+    multi-objective callback.
+    """
+    def __init__(self, filename, interval=1.):
+        self.file = open(filename, 'w', buffering=1)
+        self.interval = interval
+        self.phase = 0
+        self.start = time.perf_counter()
+        self.last = -float('inf')
+
+    def record(self, event, runtime, incumbent, bound, nodes):
+        incumbent = None if abs(incumbent) >= GRB.INFINITY else incumbent
+        bound = None if abs(bound) >= GRB.INFINITY else bound
+        gap = None
+        if incumbent is not None and bound is not None:
+            gap = abs(incumbent - bound) / max(abs(incumbent), 1e-10)
+        self.file.write(json.dumps({'phase': self.phase, 'event': event,
+                                    'runtime': runtime,
+                                    'elapsed': time.perf_counter() - self.start,
+                                    'incumbent': incumbent, 'bound': bound,
+                                    'gap': gap, 'nodes': nodes})+"\n")
+        self.last = runtime
+
+    def __call__(self, model, where):
+        if where == GRB.Callback.MULTIOBJ:
+            self.phase = model.cbGet(GRB.Callback.MULTIOBJ_OBJCNT)
+            self.last = -float('inf')
+        elif where == GRB.Callback.MIPSOL:
+            self.record('solution', model.cbGet(GRB.Callback.RUNTIME),
+                        model.cbGet(GRB.Callback.MIPSOL_OBJ),
+                        model.cbGet(GRB.Callback.MIPSOL_OBJBND),
+                        model.cbGet(GRB.Callback.MIPSOL_NODCNT))
+        elif where == GRB.Callback.MIP:
+            runtime = model.cbGet(GRB.Callback.RUNTIME)
+            #runtime restarts with every optimize call
+            if runtime < self.last or runtime - self.last >= self.interval:
+                self.record('progress', runtime,
+                            model.cbGet(GRB.Callback.MIP_OBJBST),
+                            model.cbGet(GRB.Callback.MIP_OBJBND),
+                            model.cbGet(GRB.Callback.MIP_NODCNT))
+
+    def close(self):
+        self.file.close()
@@ -1,195 +1,534 @@
-import gurobipy as gb
+import copy
+import numpy as np
 from gurobipy import GRB
-from .model import schedulingModel
+from .model import schedulingModel, sumMatrix
 
 class RuleException(Exception):
     """Raise for exceptions encountered when applying a rule"""
 
+class ruleIndex:
+    """Name to index lookups shared by every rule during compilation, taken
+    from the resident and service tables"""
+    def __init__(self, residents, services):
+        self.service_idx = services.index
+        self.resident_idx = residents.index
+        self.cohorts = residents.cohorts
+
+class rowBuilder:
+    """Accumulates rows of coeff * X[r,s,t] entries so a whole rule group
+    is emitted as one sparse constraint block"""
+    def __init__(self):
+        self.n_rows = 0
+        self.parts = []
+        self.rhs = []
+
+    def add(self, n_rows, rows, r, s, t, rhs, coeffs=1.):
+        rows = np.asarray(rows, dtype=int)
+        self.parts.append((rows + self.n_rows,
+                           np.broadcast_to(r, rows.shape),
+                           np.broadcast_to(s, rows.shape),
+                           np.broadcast_to(t, rows.shape),
+                           np.broadcast_to(coeffs, rows.shape)))
+        self.rhs.append(np.broadcast_to(rhs, (n_rows,)))
+        self.n_rows += n_rows
+
+    def emit(self, scheduler, sense, name):
+        if self.n_rows == 0:
+            return None, np.zeros(0, dtype=int)
+        rows, r, s, t, coeffs = [ np.concatenate(p) for p in zip(*self.parts) ]
+        return scheduler.addEntryRows(rows, self.n_rows, r, s, t, sense,
+                                      np.concatenate(self.rhs), name, coeffs)
+
+def runLengths(taken):
+    """Lengths of the runs of consecutive True weeks of a (..., W) mask and,
+    for each run, the index of the row of leading axes it lies in"""
+    shape = taken.shape[:-1]
+    padded = np.zeros(shape + (taken.shape[-1] + 2,), dtype=np.int8)
+    padded[..., 1:-1] = taken
+    edges = np.diff(padded, axis=-1)
+    starts = np.nonzero(edges == 1)
+    stops = np.nonzero(edges == -1)
+    return stops[-1] - starts[-1], starts[:-1]
+
+rule_registry = {}
+
+def registerRule(config_name, *required):
+    """Class decorator making a rule available to RuleFactory under
+    config_name, requiring the given config keys"""
+    def register(cls):
+        cls.config_name = config_name
+        rule_registry[config_name] = (cls, required)
+        return cls
+    return register
+
 class Rule:
     count = 0
+    config_name = "rule"
+    # the config.yaml arguments the rule was made from, if any
+    config_args = None
     def __init__(self, name):
         self.name = "R"+str(Rule.count)+"_"+name
-        ++Rule.count
+        Rule.count += 1
+    def describe(self):
+        """The config.yaml entry the rule was made from, or its name"""
+        if self.config_args is None:
+            return self.name
+        return self.config_name+" ("+", ".join("{:}: {:}".format(k, v)
+                                                for k, v in self.config_args.items())+")"
+    def compile(self, index):
+        """Resolve service and resident names against the shared ruleIndex"""
+        pass
     def addRuleToModel(self, scheduler, residents, services):
+        type(self).addGroupToModel(scheduler, [self], residents, services)
+    @classmethod
+    def addGroupToModel(cls, scheduler, rules, residents, services):
+        pass
+    def addRuleToHeuristic(self, heuristic, residents, services):
         pass
-    def getServiceIndex(self, service_name, services):
-        service_idx = -1
-        for i, s in enumerate(services):
-            if s.name == service_name:
-                service_idx = i
-                break
-
-        if service_idx == -1:
-            raise RuleException("Service: "+self.service_name+
+    def addRuleToDomain(self, domain, residents, services):
+        pass
+    def checkFeasibility(self, domain, residents, services):
+        """Messages for the ways the rule evidently cannot be met, found
+        without solving"""
+        return []
+    def violations(self, schedules, residents, services):
+        """(K,R) number of violations of the rule by each resident in a
+        (K,R,W) stack of schedules of service indices"""
+        return np.zeros(schedules.shape[:2], dtype=int)
+    def serviceIndices(self):
+        """Services the rule constrains, once compiled"""
+        return [self.s_idx]
+    def forResident(self, r_idx):
+        """Copy of the compiled rule acting on resident r_idx alone, as the
+        only resident of a residentTable.subset, or None when the rule does
+        not concern that resident"""
+        rule = copy.copy(self)
+        if hasattr(self, 'r_indices'):
+            if r_idx not in self.r_indices:
+                return None
+            rule.r_indices = np.array([0])
+        return rule
+    def getServiceIndex(self, service_name, index):
+        if service_name not in index.service_idx:
+            raise RuleException("Service: "+str(service_name)+
                                 " not found in list of services")
-        
-        return service_idx
-    def getResidentIndices(self, who, residents):
-        if who == "everyone":
-            return range(len(residents))
-        elif who == "AP1" or who == "AP2":
-            return [ pair[0] for pair in enumerate(residents) if pair[1].year == who ]
-        else:
-            resident_idx = -1
-            for i, r, in enumerate(residents):
-                if r.name == who:
-                    resident_idx = i
-                    break
-
-            if resident_idx == -1:
-                raise RuleException("Resident: "+self.who+
-                                    " not found in list of residents")
-
-            return [resident_idx]
-
-class doBefore(Rule):
-    def __init__(self,week_id,service_name, who):
-        super().__init__("do_before")
-        self.week_id = week_id
+        return index.service_idx[service_name]
+    def getResidentIndices(self, who, index):
+        if who in index.cohorts:
+            return index.cohorts[who]
+        if who not in index.resident_idx:
+            raise RuleException("Resident: "+str(who)+
+                                " not found in list of residents")
+        return np.array([index.resident_idx[who]])
+
+def compileRules(rules, residents, services):
+    """Resolve every rule in one pass against shared name indexes"""
+    index = ruleIndex(residents, services)
+    for rule in rules:
+        rule.compile(index)
+    return index
+
+def groupRules(rules):
+    """Rules grouped by kind, in order of first appearance"""
+    groups = {}
+    for rule in rules:
+        groups.setdefault(type(rule), []).append(rule)
+    return list(groups.items())
+
+def addRulesToModel(rules, scheduler, residents, services, profile=None):
+    """Emit the rules group by group. With a profiling.profiler every rule
+    is emitted on its own so its time and size can be attributed to it."""
+    if profile is not None:
+        for rule in rules:
+            with profile.rule(rule, scheduler):
+                rule.addRuleToModel(scheduler, residents, services)
+        return
+    for cls, group in groupRules(rules):
+        cls.addGroupToModel(scheduler, group, residents, services)
+
+def addRulesWithHandles(rules, scheduler, residents, services):
+    """Emit each rule on its own, returning by rule name the rule and the
+    constraints and variables it created"""
+    m = scheduler.model
+    m.update()
+    ranges = []
+    for rule in rules:
+        first = (m.NumConstrs, m.NumVars)
+        rule.addRuleToModel(scheduler, residents, services)
+        m.update()
+        ranges.append((rule, first, (m.NumConstrs, m.NumVars)))
+
+    constrs = m.getConstrs()
+    variables = m.getVars()
+    return { rule.name: (rule, constrs[c0:c1], variables[v0:v1])
+             for rule, (c0, v0), (c1, v1) in ranges }
+
+class windowRule(Rule):
+    """Rules forbidding a service outside a window of weeks"""
+    def __init__(self, name, week_id, service_name, who):
+        super().__init__(name)
+        self.week_id      = week_id
         self.service_name = service_name
         self.who          = who
 
-    def addRuleToModel(self, scheduler, residents, services):
-        s_idx = super().getServiceIndex(self.service_name, services)
-        r_indices = super().getResidentIndices(self.who, residents)
+    def compile(self, index):
+        self.s_idx = super().getServiceIndex(self.service_name, index)
+        self.r_indices = super().getResidentIndices(self.who, index)
 
-        s = scheduler.schedule
-        m = scheduler.model
-        
-        m.addConstrs((gb.quicksum(s[r,s_idx,t]
-                                  for t in range(self.week_id, schedulingModel.n_weeks))
-                      == 0 for r in r_indices),
-                     self.name)
+    def forbiddenWeeks(self):
+        pass
 
-class doAfter(Rule):
+    @classmethod
+    def addGroupToModel(cls, scheduler, rules, residents, services):
+        block = rowBuilder()
+        for rule in rules:
+            if scheduler.absorbs(rule):
+                continue
+            weeks = rule.forbiddenWeeks()
+            n_r, n_t = len(rule.r_indices), len(weeks)
+            block.add(n_r, np.repeat(np.arange(n_r), n_t),
+                      np.repeat(rule.r_indices, n_t), rule.s_idx,
+                      np.tile(weeks, n_r), 0.)
+        block.emit(scheduler, GRB.EQUAL, cls.config_name)
+
+    def addRuleToDomain(self, domain, residents, services):
+        domain.forbid(self.r_indices[:, None], self.s_idx, self.forbiddenWeeks())
+        domain.absorbed.add(self)
+
+    def violations(self, schedules, residents, services):
+        counts = super().violations(schedules, residents, services)
+        weeks = self.forbiddenWeeks()
+        counts[:, self.r_indices] = (schedules[:, self.r_indices][:, :, weeks]
+                                     == self.s_idx).sum(axis=2)
+        return counts
+
+@registerRule("do_before", "week", "service")
+class doBefore(windowRule):
+    def __init__(self,week_id,service_name, who):
+        super().__init__("do_before", week_id, service_name, who)
+
+    @classmethod
+    def fromConfig(cls, arg_dict):
+        return cls(arg_dict["week"], arg_dict["service"], arg_dict["who"])
+
+    def forbiddenWeeks(self):
+        return np.arange(self.week_id, schedulingModel.n_weeks)
+
+@registerRule("do_after", "week", "service")
+class doAfter(windowRule):
     def __init__(self,week_id,service_name,who):
-        super().__init__("do_after")
-        self.week_id      = week_id
-        self.service_name = service_name
-        self.who          = who
+        super().__init__("do_after", week_id, service_name, who)
 
-    def addRuleToModel(self, scheduler, residents, services):
-        s_idx = super().getServiceIndex(self.service_name, services)
-        r_indices = super().getResidentIndices(self.who, residents)
+    @classmethod
+    def fromConfig(cls, arg_dict):
+        return cls(arg_dict["week"], arg_dict["service"], arg_dict["who"])
 
-        s = scheduler.schedule
-        m = scheduler.model
-        
-        m.addConstrs((gb.quicksum(s[r,s_idx,t]
-                                  for t in range(self.week_id))
-                      == 0 for r in r_indices),
-                     self.name)
+    def forbiddenWeeks(self):
+        return np.arange(0, min(self.week_id, schedulingModel.n_weeks))
 
+@registerRule("in_blocks", "block_size", "service")
 class inBlocks(Rule):
     def __init__(self, block_size, service_name, who):
         super().__init__("in"+str(block_size)+"WeekBlocks_"+service_name)
         self.block_size = block_size
         self.service_name = service_name
         self.who = who
-    def addRuleToModel(self, scheduler, residents, services):
-        s_idx = super().getServiceIndex(self.service_name, services)
-        r_indices = super().getResidentIndices(self.who, residents)
 
-        s = scheduler.schedule
+    @classmethod
+    def fromConfig(cls, arg_dict):
+        return cls(arg_dict["block_size"], arg_dict["service"], arg_dict["who"])
+
+    def compile(self, index):
+        self.s_idx = super().getServiceIndex(self.service_name, index)
+        self.r_indices = super().getResidentIndices(self.who, index)
+
+    def requiredWeeks(self, residents):
+        """Residents with a requirement on the service and their requirements"""
+        r_indices = self.r_indices[residents.has_requirement[self.r_indices, self.s_idx]]
+        return r_indices, residents.requirements[r_indices, self.s_idx]
+
+    def blockResidents(self, residents):
+        """Residents with a requirement on the service and their number of blocks"""
+        r_indices, service_lbs = self.requiredWeeks(residents)
+        misfit = r_indices[service_lbs % self.block_size != 0]
+        if len(misfit):
+            raise RuleException("Rule "+self.name+": requirement of "+
+                                residents[misfit[0]].name+" is not a multiple of "+
+                                str(self.block_size))
+        return r_indices, service_lbs // self.block_size
+
+    @classmethod
+    def addGroupToModel(cls, scheduler, rules, residents, services):
+        n_weeks = schedulingModel.n_weeks
         m = scheduler.model
+        for rule in rules:
+            bs = rule.block_size
+            r_indices, n_starts = rule.blockResidents(residents)
+            # a block may start in any week it fits in, up to n_weeks - bs
+            n_r, n_t = len(r_indices), n_weeks - bs + 1
+            if n_r == 0:
+                continue
 
-        for r_idx in r_indices:
-            r = residents[r_idx]
-            service_lb = r.service_lbs[self.service_name]
-            
-            if service_lb == 0:
+            start = m.addMVar((n_r, n_t),
+                              vtype = GRB.BINARY,
+                              name = rule.name+'_start')
+
+            m.addConstr(start.sum(axis=1) == n_starts,
+                        name=scheduler.constrName("n_starts_"+rule.name))
+
+            start_idx = np.arange(n_r*n_t).reshape(n_r, n_t)
+            if scheduler.block_formulation == 'weak':
+                # require contiguous blocks of block_size
+                rows = np.repeat(np.arange(n_r*n_t), bs)
+                r = np.repeat(r_indices, n_t*bs)
+                t = (np.arange(n_t)[:, None] + np.arange(bs)[None, :]).reshape(-1)
+                A, offset = scheduler.entryRows(rows, n_r*n_t, r, rule.s_idx, np.tile(t, n_r))
+                m.addConstr(A @ scheduler.x + offset - bs * start.reshape(-1) >= 0,
+                            name=scheduler.constrName(rule.name))
+
+                #starts can't double count an interval (i.e. one start per "block_size")
+                if n_t >= bs:
+                    windows = np.lib.stride_tricks.sliding_window_view(
+                        start_idx, bs, axis=1).reshape(-1, bs)
+                    m.addConstr(sumMatrix(windows, n_r*n_t) @ start.reshape(-1) <= 1,
+                                name=scheduler.constrName(rule.name+"_no_block_overlap"))
                 continue
-            
-            start = m.addVars(
-                schedulingModel.n_weeks-self.block_size,
-                vtype = GRB.BINARY,
-                name = r.name+'_'+self.service_name+'_start')
-
-            n_starts = service_lb // self.block_size
-            assert n_starts * self.block_size == service_lb
-
-            m.addConstr(start.sum('*') == n_starts, name="n_starts_"+self.name+"_"+r.name)
-
-            # require contiguous blocks of block_size 
-            m.addConstrs((gb.quicksum(s[r_idx,s_idx,tt] for tt in range(t,t+self.block_size))
-                          >= self.block_size * start[t] for t in range(schedulingModel.n_weeks-self.block_size)),
-                         name=self.name)
-            #starts can't double count an interval (i.e. one start per "block_size")
-            m.addConstrs((gb.quicksum(start[tt] for tt in range(t,t+self.block_size))
-                          <= 1 for t in range(schedulingModel.n_weeks-2*self.block_size)),
-                         name=self.name+"_no_block_overlap")
 
+            # every week is covered by at most one start of the bs weeks up
+            # to it, and only if the service is taken: an interval matrix,
+            # so the rows alone have integral vertices
+            lag = np.arange(n_weeks)[:, None] - np.arange(bs)[None, :]
+            cover = np.where((lag >= 0) & (lag < n_t),
+                             start_idx[:, :1, None] + lag[None, :, :], -1).reshape(-1, bs)
+            A, offset = scheduler.entryRows(np.arange(n_r*n_weeks), n_r*n_weeks,
+                                            np.repeat(r_indices, n_weeks), rule.s_idx,
+                                            np.tile(np.arange(n_weeks), n_r))
+            m.addConstr(A @ scheduler.x + offset
+                        - sumMatrix(cover, n_r*n_t) @ start.reshape(-1) >= 0,
+                        name=scheduler.constrName(rule.name))
+
+    def addRuleToHeuristic(self, heuristic, residents, services):
+        heuristic.block_size[self.r_indices, self.s_idx] = self.block_size
+
+    def violations(self, schedules, residents, services):
+        """Blocks missing from the weeks each resident takes the service:
+        a run of L weeks holds L // block_size blocks. A requirement that is
+        not a multiple of the block size counts one more."""
+        counts = super().violations(schedules, residents, services)
+        r_indices, service_lbs = self.requiredWeeks(residents)
+        lengths, (k, r) = runLengths(schedules[:, r_indices] == self.s_idx)
+        blocks = np.zeros((len(schedules), len(r_indices)), dtype=int)
+        np.add.at(blocks, (k, r), lengths // self.block_size)
+        counts[:, r_indices] = np.maximum(service_lbs // self.block_size - blocks, 0) \
+            + (service_lbs % self.block_size != 0)
+        return counts
+
+    def checkFeasibility(self, domain, residents, services):
+        required = residents.requirements[self.r_indices, self.s_idx]
+        return [ "{:}: {:} needs {:d} weeks of {:}, not a multiple of the block size {:d}".format(
+            self.describe(), residents[r].name, int(n), self.service_name, self.block_size)
+                 for r, n in zip(self.r_indices, required) if n % self.block_size ]
+
+@registerRule("upper_bound", "service")
 class upperBound(Rule):
     def __init__(self, service_name, count):
         super().__init__("upperBound")
         self.service_name = service_name
         self.count   = count
-    def addRuleToModel(self, scheduler, residents, services):
-        s_idx = super().getServiceIndex(self.service_name, services)
-
-        if self.count:
-            scheduler.model.addConstrs(
-                (scheduler.schedule.sum(r,s_idx,'*') <= self.count
-                 for r in range(len(residents))),
-                name=self.name)
-        else:
-            scheduler.model.addConstrs(
-                (scheduler.schedule.sum(r,s_idx,'*')
-                 <= residents[r].service_lbs[self.service_name]
-                 for r in range(len(residents))),
-                name=self.name)
 
+    @classmethod
+    def fromConfig(cls, arg_dict):
+        return cls(arg_dict["service"], arg_dict.get("count", None))
+
+    def compile(self, index):
+        self.s_idx = super().getServiceIndex(self.service_name, index)
+
+    def caps(self, residents):
+        """Cap of every resident on the service"""
+        if self.count is not None:
+            return np.full(len(residents), self.count)
+        return residents.requirements[:, self.s_idx]
+
+    @classmethod
+    def addGroupToModel(cls, scheduler, rules, residents, services):
+        n_weeks = schedulingModel.n_weeks
+        block = rowBuilder()
+        for rule in rules:
+            if scheduler.absorbs(rule):
+                continue
+            caps = rule.caps(residents)
+            #residents capped at zero are already excluded by the domain
+            r_indices = np.arange(len(residents)) if scheduler.domain is None \
+                else np.nonzero(caps > 0)[0]
+            n_r = len(r_indices)
+            block.add(n_r, np.repeat(np.arange(n_r), n_weeks),
+                      np.repeat(r_indices, n_weeks), rule.s_idx,
+                      np.tile(np.arange(n_weeks), n_r), caps[r_indices])
+        block.emit(scheduler, GRB.LESS_EQUAL, cls.config_name)
+
+    def addRuleToDomain(self, domain, residents, services):
+        zero_cap = np.nonzero(self.caps(residents) == 0)[0]
+        domain.forbid(zero_cap, self.s_idx)
+        if len(zero_cap) == len(residents):
+            domain.absorbed.add(self)
+
+    def addRuleToHeuristic(self, heuristic, residents, services):
+        heuristic.cap[:, self.s_idx] = np.minimum(heuristic.cap[:, self.s_idx],
+                                                  self.caps(residents))
+
+    def violations(self, schedules, residents, services):
+        """Weeks taken beyond the cap"""
+        taken = (schedules == self.s_idx).sum(axis=2)
+        return np.maximum(taken - self.caps(residents), 0)
+
+    def checkFeasibility(self, domain, residents, services):
+        caps = self.caps(residents)
+        required = residents.requirements[:, self.s_idx]
+        return [ "{:}: {:} needs {:d} weeks of {:} but is capped at {:d}".format(
+            self.describe(), residents[r].name, int(required[r]), self.service_name, int(caps[r]))
+                 for r in np.nonzero(required > caps)[0] ]
+
+@registerRule("single_block", "service")
 class singleBlock(Rule):
     def __init__(self, service_name, who):
         super().__init__(service_name+"singleBlock")
         self.service_name = service_name
         self.who = who
-    def addRuleToModel(self, scheduler, residents, services):
-        s_idx = super().getServiceIndex(self.service_name, services)
-        r_indices = super().getResidentIndices(self.who, residents)
-
-        m  = scheduler.model
-        s  = scheduler.schedule
 
-        for r_idx in r_indices:
-            r = residents[r_idx]
-            service_lb = r.service_lbs[self.service_name]
-            
-            if service_lb == 0:
-                continue
-            
-            start = m.addVar(
-                vtype = GRB.INTEGER,
-                lb=0, ub=schedulingModel.n_weeks-service_lb,
-                name = r.name+'_'+self.service_name+'_start')
+    @classmethod
+    def fromConfig(cls, arg_dict):
+        return cls(arg_dict["service"], arg_dict["who"])
 
-            stop = m.addVar(
-                vtype=GRB.INTEGER,
-                lb=service_lb, ub=schedulingModel.n_weeks,
-                name = r.name+'_'+self.service_name+'_stop')
+    def compile(self, index):
+        self.s_idx = super().getServiceIndex(self.service_name, index)
+        self.r_indices = super().getResidentIndices(self.who, index)
 
-            m.addConstr(stop - start == s.sum(r_idx, s_idx,'*'),
-                         name=self.name)
+    @classmethod
+    def addGroupToModel(cls, scheduler, rules, residents, services):
+        n_weeks = schedulingModel.n_weeks
+        m = scheduler.model
+        for rule in rules:
+            r_indices = rule.r_indices[residents.has_requirement[rule.r_indices, rule.s_idx]]
+            n_r = len(r_indices)
+            if n_r == 0:
+                continue
+            if scheduler.block_formulation == 'weak':
+                # bounds the span of the weeks taken, without forcing them
+                # to be contiguous
+                service_lbs = residents.requirements[r_indices, rule.s_idx]
+                start = m.addMVar(n_r,
+                                  vtype = GRB.INTEGER,
+                                  lb=0, ub=n_weeks-service_lbs,
+                                  name = rule.name+'_start')
+
+                stop = m.addMVar(n_r,
+                                 vtype=GRB.INTEGER,
+                                 lb=service_lbs, ub=n_weeks,
+                                 name = rule.name+'_stop')
+
+                A, offset = scheduler.entryRows(np.repeat(np.arange(n_r), n_weeks), n_r,
+                                                np.repeat(r_indices, n_weeks), rule.s_idx,
+                                                np.tile(np.arange(n_weeks), n_r))
+                m.addConstr(stop - start == A @ scheduler.x + offset,
+                            name=scheduler.constrName(rule.name))
+                continue
 
+            # run[r,t] >= X[r,s,t] - X[r,s,t-1] marks the week the service
+            # starts, and it may start once. The relaxation is the convex
+            # hull of single runs, so run needs no integrality
+            run = m.addMVar((n_r, n_weeks), lb=0, ub=1,
+                            vtype=GRB.CONTINUOUS,
+                            name=rule.name+'_run')
+            rows = np.arange(n_r*n_weeks).reshape(n_r, n_weeks)
+            rows = np.concatenate([rows.reshape(-1), rows[:, 1:].reshape(-1)])
+            r = np.concatenate([np.repeat(r_indices, n_weeks), np.repeat(r_indices, n_weeks - 1)])
+            t = np.concatenate([np.tile(np.arange(n_weeks), n_r),
+                                np.tile(np.arange(n_weeks - 1), n_r)])
+            coeffs = np.concatenate([np.ones(n_r*n_weeks), -np.ones(n_r*(n_weeks - 1))])
+            A, offset = scheduler.entryRows(rows, n_r*n_weeks, r, rule.s_idx, t, coeffs)
+            m.addConstr(A @ scheduler.x + offset - run.reshape(-1) <= 0,
+                        name=scheduler.constrName(rule.name))
+            m.addConstr(run.sum(axis=1) <= 1,
+                        name=scheduler.constrName(rule.name+"_one_run"))
+
+    def addRuleToHeuristic(self, heuristic, residents, services):
+        heuristic.single_block[self.r_indices, self.s_idx] = True
+
+    def violations(self, schedules, residents, services):
+        """Runs of the service beyond the first"""
+        counts = super().violations(schedules, residents, services)
+        r_indices = self.r_indices[residents.has_requirement[self.r_indices, self.s_idx]]
+        taken = schedules[:, r_indices] == self.s_idx
+        n_runs = taken[:, :, 0] + (taken[:, :, 1:] & ~taken[:, :, :-1]).sum(axis=2)
+        counts[:, r_indices] = np.maximum(n_runs - 1, 0)
+        return counts
+
+    def checkFeasibility(self, domain, residents, services):
+        available = domain.available()[:, self.s_idx, :]
+        issues = []
+        for r in self.r_indices:
+            required = residents.requirements[r, self.s_idx]
+            # longest run of consecutive weeks the service is open
+            runs = np.diff(np.flatnonzero(np.diff(np.concatenate([[0], available[r], [0]]))))[::2]
+            longest = runs.max() if len(runs) else 0
+            if required > longest:
+                issues.append("{:}: {:} needs {:d} consecutive weeks of {:} but at most {:d} are open".format(
+                    self.describe(), residents[r].name, int(required), self.service_name, int(longest)))
+        return issues
+
+@registerRule("sequence", "first", "second")
 class sequence(Rule):
     def __init__(self, first_service, second_service, who):
         super().__init__("sequence")
         self.first_service = first_service
         self.second_service = second_service
         self.who = who
-    def addRuleToModel(self, scheduler, residents, services):
-        s_first_idx = super().getServiceIndex(self.first_service, services)
-        s_second_idx = super().getServiceIndex(self.second_service, services)
-        r_indices = super().getResidentIndices(self.who, residents)
-
-        m  = scheduler.model
-        s  = scheduler.schedule
-
-        m.addConstrs((s[r_idx,s_first_idx,t] == s[r_idx,s_second_idx,t+1]
-                      for r_idx in r_indices
-                      for t in range(schedulingModel.n_weeks-1)),
-                      name=self.name)
-        
+
+    @classmethod
+    def fromConfig(cls, arg_dict):
+        return cls(arg_dict["first"], arg_dict["second"], arg_dict["who"])
+
+    def compile(self, index):
+        self.s_first_idx = super().getServiceIndex(self.first_service, index)
+        self.s_second_idx = super().getServiceIndex(self.second_service, index)
+        self.r_indices = super().getResidentIndices(self.who, index)
+
+    def serviceIndices(self):
+        return [self.s_first_idx, self.s_second_idx]
+
+    @classmethod
+    def addGroupToModel(cls, scheduler, rules, residents, services):
+        n_t = schedulingModel.n_weeks - 1
+        block = rowBuilder()
+        for rule in rules:
+            # X[r,first,t] - X[r,second,t+1] == 0
+            n_r = len(rule.r_indices)
+            rows = np.repeat(np.arange(n_r*n_t), 2)
+            r = np.repeat(rule.r_indices, 2*n_t)
+            s = np.tile([rule.s_first_idx, rule.s_second_idx], n_r*n_t)
+            t = np.tile(np.arange(n_t).repeat(2) + np.tile([0, 1], n_t), n_r)
+            pinned = (scheduler.columns[r, s, t] < 0).reshape(-1, 2).all(axis=1)
+            values = scheduler.constants[r, s, t].reshape(-1, 2)
+            if (pinned & (values[:, 0] != values[:, 1])).any():
+                raise RuleException("Rule "+rule.name+" contradicts the fixed weeks")
+            block.add(n_r*n_t, rows, r, s, t, 0., np.tile([1., -1.], n_r*n_t))
+        block.emit(scheduler, GRB.EQUAL, cls.config_name)
+
+    def addRuleToHeuristic(self, heuristic, residents, services):
+        for r_idx in self.r_indices:
+            heuristic.successor[r_idx, self.s_first_idx] = self.s_second_idx
+            heuristic.predecessor[r_idx, self.s_second_idx] = self.s_first_idx
+
+    def violations(self, schedules, residents, services):
+        """Weeks of the first service not followed by the second, and weeks
+        of the second not preceded by the first"""
+        counts = super().violations(schedules, residents, services)
+        taken = schedules[:, self.r_indices]
+        counts[:, self.r_indices] = ((taken[:, :, :-1] == self.s_first_idx)
+                                     != (taken[:, :, 1:] == self.s_second_idx)).sum(axis=2)
+        return counts
+
+@registerRule("specify", "service", "week")
 class specify(Rule):
     def __init__(self, service, weeks, who):
         super().__init__("specify")
@@ -198,68 +537,69 @@ class specify(Rule):
             weeks = [weeks]
         self.weeks = weeks
         self.who = who
-    def addRuleToModel(self, scheduler, residents, services):
-        s_idx = super().getServiceIndex(self.service, services)
-        r_indices = super().getResidentIndices(self.who, residents)
-
-        m  = scheduler.model
-        s  = scheduler.schedule
 
-        for r_idx in r_indices:
-            m.addConstrs((s[r_idx,s_idx,w-2] == 1
-                          for r_idx in r_indices
-                          for w in self.weeks),
-                         name=self.name)
+    @classmethod
+    def fromConfig(cls, arg_dict):
+        return cls(arg_dict["service"], arg_dict["week"], arg_dict["who"])
+
+    def describe(self):
+        if self.config_args is None:
+            return "{:} for {:} in weeks {:}".format(self.service, self.who,
+                                                      ", ".join(str(w) for w in self.weeks))
+        return super().describe()
+
+    def compile(self, index):
+        self.s_idx = super().getServiceIndex(self.service, index)
+        self.r_indices = super().getResidentIndices(self.who, index)
+        self.t_indices = np.array(self.weeks, dtype=int) - 2
+
+    @classmethod
+    def addGroupToModel(cls, scheduler, rules, residents, services):
+        block = rowBuilder()
+        for rule in rules:
+            if scheduler.absorbs(rule):
+                continue
+            n = len(rule.r_indices) * len(rule.t_indices)
+            block.add(n, np.arange(n),
+                      np.repeat(rule.r_indices, len(rule.t_indices)), rule.s_idx,
+                      np.tile(rule.t_indices, len(rule.r_indices)), 1.)
+        block.emit(scheduler, GRB.EQUAL, cls.config_name)
+
+    def addRuleToDomain(self, domain, residents, services):
+        for r_idx in self.r_indices:
+            for t in self.t_indices:
+                if not domain.fix(r_idx, self.s_idx, t):
+                    raise RuleException("Rule "+self.name+" fixes "+residents[r_idx].name+
+                                        " to "+self.service+" in week "+str(t+2)+
+                                        " which is already fixed to another service")
+        domain.absorbed.add(self)
+
+    def violations(self, schedules, residents, services):
+        """Specified weeks on another service"""
+        counts = super().violations(schedules, residents, services)
+        counts[:, self.r_indices] = (schedules[:, self.r_indices][:, :, self.t_indices]
+                                     != self.s_idx).sum(axis=2)
+        return counts
 
 def RuleFactory(rule_type):
-    assert len(rule_type.keys())==1
+    if len(rule_type.keys()) != 1:
+        raise RuleException("Each rule needs exactly one type, got "+
+                            ", ".join(rule_type.keys()))
     name = next(iter(rule_type.keys()))
-    arg_dict = rule_type[name]
+    if name not in rule_registry:
+        raise RuleException("Unknown rule type "+str(name))
+    cls, required = rule_registry[name]
 
+    arg_dict = dict(rule_type[name])
     if "who" not in arg_dict:
         arg_dict["who"] = "everyone"
-        
-    if name == "do_before":
-        assert "week" in arg_dict
-        assert "service" in arg_dict
-        return doBefore(arg_dict["week"],
-                        arg_dict["service"],
-                        arg_dict["who"])
-    elif name == "do_after":
-        assert "week" in arg_dict
-        assert "service" in arg_dict
-        return doAfter(arg_dict["week"],
-                       arg_dict["service"],
-                       arg_dict["who"])
-    elif name == "in_blocks":
-        assert "block_size" in arg_dict
-        assert "service" in arg_dict
-        return inBlocks(arg_dict["block_size"],
-                        arg_dict["service"],
-                        arg_dict["who"])
-    elif name == "upper_bound":
-        assert "service" in arg_dict
-        if "count" not in arg_dict:
-            arg_dict["count"] = None
-        return upperBound(arg_dict["service"],
-                          arg_dict["count"])
-    elif name == "single_block":
-        assert "service" in arg_dict
-        return singleBlock(arg_dict["service"],
-                           arg_dict["who"])
-    elif name == "sequence":
-        assert "first" in arg_dict
-        assert "second" in arg_dict
-        return sequence(arg_dict["first"],
-                        arg_dict["second"],
-                        arg_dict["who"])
-    elif name == "specify":
-        assert "service" in arg_dict
-        assert "week"    in arg_dict
-        assert "who"     in arg_dict
-        return specify(arg_dict["service"],
-                       arg_dict["week"],
-                       arg_dict["who"])
+    for key in required:
+        if key not in arg_dict:
+            raise RuleException("Rule "+name+" requires '"+key+"'")
+
+    rule = cls.fromConfig(arg_dict)
+    rule.config_args = dict(rule_type[name])
+    return rule
 
 def addVacation(rules_list, residents):
     for r in residents:
@@ -273,4 +613,4 @@ def addConferenceWeek(rules_list, residents, conference_week):
         if r.service_lbs["Conference"] > 0:
             rules_list.append(specify("Conference",
                                       conference_week,
-                                      r.name))
\ No newline at end of file
+                                      r.name))
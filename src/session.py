@@ -0,0 +1,133 @@
+from gurobipy import GRB
+
+from .domain import buildDomain
+from .heuristic import greedyHeuristic
+from .model import schedulingModel
+from .rules import RuleException, RuleFactory, addVacation, addConferenceWeek, \
+    compileRules, addRulesWithHandles
+
+class schedulingSession:
+    """Long-lived model for what-if edits between solves.
+
+    Every rule is emitted on its own and the constraints and variables it
+    creates are kept, keyed by rule name, so rules can be added, removed or
+    edited in place. Resident requirements are edited through their
+    requirement rows and the rules constraining the same service are
+    re-emitted. Each optimize starts from the previous incumbent.
+
+    Edits must stay visible in the model, so the session builds without the
+    sparse domain (every rule is explicit rows) and without symmetry
+    breaking (an edit can make interchangeable residents distinct).
+    """
+    def __init__(self, model_config, conference_week=38):
+        self.residents = model_config.residents
+        self.services = model_config.services
+        model_params = dict(model_config.model, sparse_domain=False, symmetry_breaking=False)
+        self.scheduler = schedulingModel(model_config.gurobi, model_params,
+                                         model_config.optimization)
+
+        rules = [ RuleFactory(rule_input)
+                  for rule_input in model_config.rules]
+        addVacation(rules, self.residents)
+        addConferenceWeek(rules, self.residents, conference_week)
+        self.index = compileRules(rules, self.residents, self.services)
+
+        self.scheduler.build_model(self.residents, self.services)
+        # rule name -> (rule, constraints, variables)
+        self.handles = {}
+        self.emit(rules)
+        self.scheduler.add_maxima(self.residents, self.services)
+
+        self.assignment = None
+        if model_config.optimization['heuristic_start']:
+            domain = buildDomain(rules, self.residents, self.services, schedulingModel.n_weeks)
+            self.assignment = greedyHeuristic(self.residents, self.services, domain).run(rules)
+
+    def emit(self, rules):
+        """Add each rule to the model and record the rows and columns it
+        created"""
+        self.handles.update(addRulesWithHandles(rules, self.scheduler,
+                                                self.residents, self.services))
+
+    def rules(self):
+        return list(self.handles.keys())
+
+    def addRule(self, rule_input):
+        """Add a rule given as a config entry, returning its name"""
+        rule = RuleFactory(rule_input)
+        rule.compile(self.index)
+        self.emit([rule])
+        return rule.name
+
+    def removeRule(self, name):
+        if name not in self.handles:
+            raise RuleException("No rule named "+name+" in the session")
+        _, constrs, variables = self.handles.pop(name)
+        self.scheduler.model.remove(constrs)
+        self.scheduler.model.remove(variables)
+
+    def editRule(self, name, rule_input):
+        """Replace a rule, returning the name of its replacement"""
+        self.removeRule(name)
+        return self.addRule(rule_input)
+
+    def setRequirement(self, resident_name, service_name, weeks):
+        """Require weeks of service_name from resident_name (0 or None drops
+        the requirement)"""
+        if resident_name not in self.index.resident_idx:
+            raise RuleException("Resident: "+str(resident_name)+" not found in list of residents")
+        if service_name not in self.index.service_idx:
+            raise RuleException("Service: "+str(service_name)+" not found in list of services")
+        r = self.index.resident_idx[resident_name]
+        s = self.index.service_idx[service_name]
+        m = self.scheduler.model
+        previous = self.residents[r].service_lbs.get(service_name)
+
+        #block, single block and upper bound rules read the requirements.
+        #They are emitted again next to their old rows, which are dropped
+        #only once every rule has accepted the new requirement
+        affected = [ rule for rule, _, _ in self.handles.values()
+                     if s in rule.serviceIndices() ]
+        m.update()
+        n_constrs, n_vars = m.NumConstrs, m.NumVars
+        self.residents.setRequirement(r, s, service_name, weeks)
+        try:
+            handles = addRulesWithHandles(affected, self.scheduler,
+                                          self.residents, self.services)
+        except Exception:
+            self.residents.setRequirement(r, s, service_name, previous)
+            m.update()
+            m.remove(m.getConstrs()[n_constrs:])
+            m.remove(m.getVars()[n_vars:])
+            m.update()
+            raise
+        for rule in affected:
+            _, constrs, variables = self.handles[rule.name]
+            m.remove(constrs)
+            m.remove(variables)
+        self.handles.update(handles)
+
+        constrs = self.scheduler.requirement_constrs
+        if (r, s) in constrs:
+            if weeks:
+                constrs[r, s].RHS = weeks
+            else:
+                m.remove(constrs.pop((r, s)))
+        elif weeks:
+            constrs[r, s] = m.addConstr(self.scheduler.sum(r, s, '*') >= weeks,
+                                        name=self.scheduler.constrName("Residents requirements"))
+
+    def optimize(self):
+        """Re-optimise from the current incumbent, returning the maximum
+        interval and yearly average hours"""
+        scheduler = self.scheduler
+        # the sequential method bounds the interval maximum by its last optimum
+        scheduler.max_hrs_per_interval.UB = GRB.INFINITY
+        if self.assignment is not None:
+            scheduler.setStart(self.assignment)
+        scheduler.optimize(self.residents, self.services)
+        self.assignment = scheduler.assignment()
+        return scheduler.max_avg_hours_per_interval, scheduler.max_avg_hours_per_year
+
+    def write_csv(self, filename):
+        self.scheduler.write_csv(filename, self.residents, self.services)
@@ -0,0 +1,132 @@
+from gurobipy import GRB
+
+from .colgen import columnGeneration
+from .domain import buildDomain
+from .feasibility import FeasibilityException, checkFeasibility, diagnoseInfeasibility
+from .heuristic import greedyHeuristic, orderSymmetryClasses
+from .horizon import rollingHorizon
+from .inputs import read_schedule_csv
+from .lns import largeNeighbourhoodSearch
+from .model import schedulingModel
+from .multilevel import multilevelSolve
+from .profiling import timed
+from .rules import RuleFactory, addVacation, addConferenceWeek, \
+    compileRules, addRulesToModel
+
+#hardcoding USCAP at week 38
+conference_week = 38
+
+# optimization.horizon -> solver class with run(residents, services, rules,
+# domain, symmetry_classes, start) returning the solved schedulingModel
+horizons = {'rolling': rollingHorizon,
+            'column_generation': columnGeneration,
+            'lns': largeNeighbourhoodSearch,
+            'multilevel': multilevelSolve}
+
+def configRules(model_config, profile=None):
+    """The config's rules plus vacation and conference weeks, compiled"""
+    with timed(profile, 'rules'):
+        rules = [ RuleFactory(rule_input)
+                  for rule_input in model_config.rules]
+        addVacation(rules, model_config.residents)
+        addConferenceWeek(rules, model_config.residents, conference_week)
+        compileRules(rules, model_config.residents, model_config.services)
+    return rules
+
+def configDomain(model_config, rules, profile=None):
+    """scheduleDomain of the rules, raising FeasibilityException when the
+    pre-solve checks fail"""
+    with timed(profile, 'domain'):
+        domain = buildDomain(rules, model_config.residents, model_config.services,
+                             schedulingModel.n_weeks)
+    with timed(profile, 'check'):
+        issues = checkFeasibility(rules, model_config.residents, model_config.services,
+                                  domain)
+    if issues:
+        raise FeasibilityException(issues)
+    return domain
+
+def startSchedule(model_config, rules, domain, profile=None, previous=None):
+    """MIP start from scheduling.warm_start, else the previous schedule
+    solved from the same model (e.g. a cached one), else the greedy
+    heuristic, or None"""
+    start = None
+    if model_config.warm_start:
+        start = read_schedule_csv(model_config.warm_start, model_config.residents,
+                                  model_config.services, schedulingModel.n_weeks)
+    elif previous is not None:
+        return previous
+    elif model_config.optimization['heuristic_start']:
+        with timed(profile, 'heuristic'):
+            start = greedyHeuristic(model_config.residents, model_config.services,
+                                    domain).run(rules)
+    if start is not None and model_config.model['symmetry_breaking']:
+        start = orderSymmetryClasses(start, model_config.symmetry_classes)
+    return start
+
+def solveHorizon(model_config, rules, domain, start, m, profile=None, cache=None,
+                 cache_key=None):
+    """Solve with the configured horizon. The full horizon solves m, loaded
+    from the cache when it holds cache_key and otherwise built and stored
+    in the cache when one is given; the others return their own
+    schedulingModel."""
+    residents, services = model_config.residents, model_config.services
+    horizon = model_config.optimization['horizon']
+    if horizon in horizons:
+        with timed(profile, 'optimize'):
+            return horizons[horizon](model_config.gurobi, model_config.model,
+                                     model_config.optimization).run(
+                                         residents, services, rules, domain,
+                                         model_config.symmetry_classes, start)
+
+    if cache is not None and cache.has(cache_key):
+        print("Loading cached model "+cache_key)
+        with timed(profile, 'load', m):
+            cache.load(cache_key, m)
+    else:
+        with timed(profile, 'build_model', m):
+            m.build_model(residents, services, domain)
+        if model_config.model['symmetry_breaking']:
+            with timed(profile, 'symmetry', m):
+                m.add_symmetry_breaking(residents, services, model_config.symmetry_classes)
+        with timed(profile, 'add_rules', m):
+            addRulesToModel(rules, m, residents, services, profile)
+        with timed(profile, 'hours', m):
+            m.add_maxima(residents, services)
+        if cache is not None:
+            cache.store(cache_key, m)
+    if start is not None:
+        m.setStart(start)
+    with timed(profile, 'optimize'):
+        m.optimize(residents, services)
+    return m
+
+def solveConfig(model_config, callback=None):
+    """Rules, domain and pre-solve checks, start and solve of one config,
+    returning the rules and the solved schedulingModel. callback (e.g. a
+    profiling.progressLog) follows full-horizon solves."""
+    m = schedulingModel(model_config.gurobi, model_config.model,
+                        model_config.optimization)
+    m.callback = callback
+    rules = configRules(model_config)
+    domain = configDomain(model_config, rules)
+    start = startSchedule(model_config, rules, domain)
+    return rules, solveHorizon(model_config, rules, domain, start, m)
+
+def hasSchedule(m):
+    """Whether the solve left a schedule to report"""
+    return m.values is not None or m.model.SolCount > 0
+
+def provedInfeasible(model_config, m):
+    """Whether Gurobi proved the full-horizon model infeasible"""
+    return model_config.optimization['horizon'] == 'full' and m.values is None \
+        and m.model.Status == GRB.INFEASIBLE
+
+def infeasibleConflicts(model_config, rules, m):
+    """diagnoseInfeasibility of a model provedInfeasible, or None for any
+    other outcome"""
+    if not provedInfeasible(model_config, m):
+        return None
+    return diagnoseInfeasibility(model_config.gurobi, model_config.model, rules,
+                                 model_config.residents, model_config.services,
+                                 interval_cap=model_config.optimization['max_hours_per_interval'])
@@ -0,0 +1,181 @@
+import copy
+import csv
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+from gurobipy import GRB
+
+from .export import exportSchedule, write_hours_csv
+from .feasibility import FeasibilityException
+from .inputs import Config, ConfigException
+from .model import schedulingModel
+from .solve import solveConfig, infeasibleConflicts
+
+# pool workers are reused across scenarios, so the class default is restored
+# for scenarios that do not set it
+default_hardness_interval = schedulingModel.hardness_interval
+
+class sweepSpec:
+    """Scenario grid over a base config.
+
+    The sweep file names the base config and a grid. Grid keys are dotted
+    paths into the config (e.g. optimization.interval_tolerance) or
+    hardness_interval, each with a list of values. rule_variants maps a
+    variant name to rules to drop (by rule type) and rules to add. Every
+    combination of grid values and rule variants is one scenario:
+
+        base: config.yaml
+        grid:
+          hardness_interval: [4, 6]
+          optimization.interval_tolerance: [0, 2]
+        rule_variants:
+          baseline: {}
+          no_single_block:
+            drop: [single_block]
+    """
+    def __init__(self, sweep_file):
+        with open(sweep_file, 'r') as f:
+            spec = yaml.safe_load(f)
+        if 'base' not in spec:
+            raise ConfigException("Sweep "+sweep_file+" needs a base config")
+        base_file = os.path.join(os.path.dirname(os.path.abspath(sweep_file)), spec['base'])
+        with open(base_file, 'r') as f:
+            self.base = yaml.safe_load(f)
+        self.grid = spec.get('grid', {}) or {}
+        for key, values in self.grid.items():
+            if not isinstance(values, list):
+                raise ConfigException("Sweep grid entry "+key+" must be a list")
+        self.rule_variants = spec.get('rule_variants', {'baseline': {}}) or {'baseline': {}}
+        self.output = spec.get('output', 'sweep.csv')
+
+    def scenarios(self):
+        """(name, settings, config_inputs) of every scenario"""
+        keys = list(self.grid.keys())
+        scenarios = []
+        for values in itertools.product(*[ self.grid[k] for k in keys ]):
+            for variant, changes in self.rule_variants.items():
+                settings = dict(zip(keys, values))
+                settings['rules'] = variant
+                name = "s{:03d}".format(len(scenarios))
+                scenarios.append((name, settings,
+                                  self.configInputs(name, settings, changes or {})))
+        return scenarios
+
+    def configInputs(self, name, settings, changes):
+        inputs = copy.deepcopy(self.base)
+        for key, value in settings.items():
+            if key in ('rules', 'hardness_interval'):
+                continue
+            node = inputs
+            path = key.split('.')
+            for part in path[:-1]:
+                node = node.setdefault(part, {})
+            node[path[-1]] = value
+
+        drop = set(changes.get('drop', []))
+        inputs['rules'] = [ rule for rule in inputs.get('rules', []) or []
+                            if not drop.intersection(rule.keys()) ] \
+            + list(changes.get('add', []))
+
+        for key, default_ext in [('file', '.csv'), ('hours', '.csv')]:
+            if key in inputs['output']:
+                stem, ext = os.path.splitext(inputs['output'][key])
+                inputs['output'][key] = stem+"_"+name+(ext or default_ext)
+        return inputs
+
+def coreSplit(n_scenarios, workers=None, cores=None):
+    """Number of worker processes and solver threads per worker sharing the
+    machine's cores. Independent scenarios scale better than threads within
+    one MIP, so workers are preferred."""
+    cores = cores or os.cpu_count() or 1
+    workers = min(workers or cores, n_scenarios, cores)
+    return max(workers, 1), max(cores // max(workers, 1), 1)
+
+class logTo:
+    """Redirect the process stdout, including the solver's own output, to a
+    file while a scenario runs"""
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __enter__(self):
+        sys.stdout.flush()
+        self.saved = os.dup(1)
+        self.log = open(self.filename, 'w')
+        os.dup2(self.log.fileno(), 1)
+        return self
+
+    def __exit__(self, *exc):
+        sys.stdout.flush()
+        os.dup2(self.saved, 1)
+        os.close(self.saved)
+        self.log.close()
+
+def runScenario(args):
+    name, settings, config_inputs, threads = args
+    result = dict(settings, scenario=name, threads=threads)
+    config_inputs = copy.deepcopy(config_inputs)
+    config_inputs.setdefault('gurobi', {})['Threads'] = threads
+    output_file = config_inputs['output']['file']
+    schedulingModel.hardness_interval = settings.get('hardness_interval',
+                                                     default_hardness_interval)
+
+    tic = time.perf_counter()
+    with logTo(os.path.splitext(output_file)[0]+".log"):
+        try:
+            model_config = Config(None, config_inputs)
+            rules, m = solveConfig(model_config)
+            if m.values is None and m.model.SolCount == 0:
+                result['status'] = 'infeasible' if m.model.Status == GRB.INFEASIBLE \
+                    else 'no_solution'
+                conflicts = infeasibleConflicts(model_config, rules, m)
+                if conflicts:
+                    result['conflicts'] = "; ".join(label for label, _ in conflicts)
+            else:
+                result['status'] = 'feasible'
+                result['interval'] = m.max_avg_hours_per_interval
+                result['year'] = m.max_avg_hours_per_year
+                assignment = m.assignment()
+                exportSchedule(output_file, model_config.output_formats, assignment,
+                               model_config.residents, model_config.services)
+                if model_config.hours_filename:
+                    write_hours_csv(model_config.hours_filename, assignment,
+                                    model_config.residents, model_config.services)
+        except FeasibilityException as e:
+            print("Infeasible configuration:")
+            for issue in e.issues:
+                print("  "+issue)
+            result['status'] = 'infeasible configuration'
+            result['conflicts'] = str(e)
+        except Exception as e:
+            print("Scenario "+name+" failed: "+str(e))
+            result['status'] = 'error: '+str(e)
+    result['time [s]'] = time.perf_counter() - tic
+    return result
+
+def runSweep(spec, workers=None, cores=None):
+    """Solve every scenario of the sweepSpec in a process pool and return
+    one result row per scenario"""
+    scenarios = spec.scenarios()
+    n_workers, threads = coreSplit(len(scenarios), workers, cores)
+    print("{:d} scenarios on {:d} workers with {:d} solver threads each".format(
+        len(scenarios), n_workers, threads))
+
+    tasks = [ (name, settings, inputs, threads) for name, settings, inputs in scenarios ]
+    # unlike multiprocessing.Pool workers these are not daemonic, so an lns
+    # scenario can start its own neighbourhood workers
+    with ProcessPoolExecutor(n_workers) as executor:
+        return list(executor.map(runScenario, tasks))
+
+def writeSweep(filename, results):
+    keys = []
+    for res in results:
+        keys += [ k for k in res if k not in keys ]
+    with open(filename, 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=keys)
+        writer.writeheader()
+        writer.writerows(results)
+    return keys
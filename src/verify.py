@@ -0,0 +1,83 @@
+import numpy as np
+
+from .export import hoursSummary
+
+def serviceCounts(schedules, n_services, axis):
+    """Number of entries of each service along axis of a (K,R,W) stack of
+    schedules, with the service as the last axis. Entries outside
+    0..n_services-1 are not counted."""
+    schedules = np.moveaxis(schedules, axis, -1)
+    valid = (schedules >= 0) & (schedules < n_services)
+    rows = np.arange(schedules[..., 0].size).reshape(schedules.shape[:-1])
+    flat = rows[..., None] * n_services + schedules
+    counts = np.bincount(flat[valid], minlength=rows.size * n_services)
+    return counts.reshape(schedules.shape[:-1] + (n_services,))
+
+class scheduleVerifier:
+    """Checks schedules against the config without a solver.
+
+    Schedules are (R,W) arrays of service indices, as read_schedule_csv
+    returns them, or (K,R,W) stacks of them, and every check is
+    vectorised over the stack. The model rows are counted as violations:
+    weeks without exactly one service, requirement weeks missing, resident
+    counts outside the coverage bounds, and what each compiled rule reports
+    through Rule.violations. The hours are those optimize reports, from
+    export.hoursSummary.
+    """
+    def __init__(self, rules, residents, services):
+        self.rules = rules
+        self.residents = residents
+        self.services = services
+
+    def residentViolations(self, schedules):
+        """(label, (K,R) violation counts) of the one service per week and
+        requirement rows and of every rule"""
+        n_services = len(self.services)
+        unassigned = ((schedules < 0) | (schedules >= n_services)).sum(axis=2)
+        taken = serviceCounts(schedules, n_services, axis=2)
+        missing = np.maximum(self.residents.requirements - taken, 0)
+        missing = np.where(self.residents.has_requirement, missing, 0).sum(axis=2)
+        checks = [("one service per week", unassigned), ("requirements", missing)]
+        return checks + [ (rule.describe(), rule.violations(schedules, self.residents,
+                                                             self.services))
+                          for rule in self.rules ]
+
+    def coverageViolations(self, schedules):
+        """(K,S,W) residents missing below the coverage lower bounds and in
+        excess of the upper bounds"""
+        coverage = serviceCounts(schedules, len(self.services), axis=1).transpose(0, 2, 1)
+        lb = self.services.lb[None, :, None]
+        ub = self.services.ub[None, :, None]
+        below = np.where(np.isnan(lb), 0, np.maximum(lb - coverage, 0)).astype(int)
+        above = np.where(np.isnan(ub), 0, np.maximum(coverage - ub, 0)).astype(int)
+        return below, above
+
+    def score(self, schedules):
+        """Total violations, maximum interval hours and maximum yearly
+        average hours of every schedule of a (K,R,W) stack, as (K,) arrays"""
+        schedules = np.asarray(schedules)
+        violations = sum(counts.sum(axis=1) for _, counts in self.residentViolations(schedules))
+        below, above = self.coverageViolations(schedules)
+        hours = hoursSummary(schedules, self.services)
+        return {'violations': violations + below.sum(axis=(1, 2)) + above.sum(axis=(1, 2)),
+                'max_hours_per_interval': hours['max_hours_per_interval'].max(axis=1),
+                'max_avg_hours_per_year': hours['avg_hours_per_year'].max(axis=1)}
+
+    def check(self, schedule):
+        """Messages for every violation in one (R,W) schedule"""
+        schedules = np.asarray(schedule)[None]
+        issues = []
+        for label, counts in self.residentViolations(schedules):
+            offenders = np.nonzero(counts[0])[0]
+            if len(offenders):
+                issues.append("{:}: {:}".format(label, ", ".join(
+                    "{:} ({:d})".format(self.residents[r].name, int(counts[0, r]))
+                    for r in offenders)))
+        below, above = self.coverageViolations(schedules)
+        for bounds, excess, word in [(self.services.lb, below[0], "below"),
+                                     (self.services.ub, above[0], "above")]:
+            for s in np.nonzero(excess.any(axis=1))[0]:
+                issues.append("{:} coverage {:} {:d} residents in weeks {:}".format(
+                    self.services[s].name, word, int(bounds[s]),
+                    ", ".join(str(t + 2) for t in np.nonzero(excess[s])[0])))
+        return issues
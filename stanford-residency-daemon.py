@@ -0,0 +1,27 @@
+import argparse
+
+from src.daemon import schedulingDaemon, serve
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Serve scheduling jobs from warm solver workers')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='address to listen on (default: localhost only)')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='port to listen on')
+    parser.add_argument('--socket', type=str, default=None,
+                        help='listen on this Unix socket instead of a port')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='worker processes, each running one job at a time')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='solver threads shared by the running jobs (default: all cores)')
+    parser.add_argument('--workdir', type=str, default='daemon_jobs',
+                        help='directory for job logs, progress and schedules')
+    parser.add_argument('--preload', type=str, nargs='*', default=[],
+                        help='config files to parse at startup')
+    args = parser.parse_args()
+
+    daemon = schedulingDaemon(args.workers, args.threads, args.workdir)
+    for config_file in args.preload:
+        daemon.config(config_file)
+        print("Loaded "+config_file)
+    serve(daemon, args.host, args.port, args.socket)
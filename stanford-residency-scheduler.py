@@ -1,46 +1,140 @@
 import argparse
 import os.path
+import sys
 
-from src.inputs import Config
+from src.inputs import Config, read_schedule_csv
+from src.cache import modelCache, cacheKey
+from src.export import exportSchedule, exportPool, write_hours_csv
+from src.feasibility import FeasibilityException, diagnoseInfeasibility, printDiagnosis
 from src.model import schedulingModel
-from src.rules import RuleFactory, addVacation, addConferenceWeek
+from src.pool import diversePool
+from src.profiling import profiler, progressLog, timed
+from src.solve import conference_week, configRules, configDomain, startSchedule, \
+    solveHorizon, hasSchedule, provedInfeasible, infeasibleConflicts
+from src.verify import scheduleVerifier
 
 if __name__=="__main__":
     parser = argparse.ArgumentParser(description='Compute Optimal residency schedule')
     parser.add_argument('CONFIG_FILE', type=str,
                         help='input yaml config file')
+    parser.add_argument('--check', action='store_true',
+                        help='only check feasibility and name conflicting rules')
+    parser.add_argument('--verify', type=str, metavar='SCHEDULE',
+                        help='check a schedule csv against the config and score it, without solving')
     args = parser.parse_args()
 
     assert os.path.exists(args.CONFIG_FILE)
 
-    model_config = Config(args.CONFIG_FILE)
+    profile = profiler()
+    with profile.phase('parse'):
+        model_config = Config(args.CONFIG_FILE)
     print("Input Configuration summary")
     model_config.print_summary()
+    if model_config.profile is None:
+        profile = None
 
-    m = schedulingModel(model_config.gurobi)
+    m = schedulingModel(model_config.gurobi, model_config.model,
+                        model_config.optimization)
+    progress = None
+    if model_config.profile and model_config.profile['progress']:
+        progress = progressLog(model_config.profile['progress'],
+                               model_config.profile['progress_interval'])
+        m.callback = progress
 
-    rules = [ RuleFactory(rule_input)
-              for rule_input in model_config.rules]
+    cache, cache_key = None, None
+    if model_config.cache and model_config.optimization['horizon'] == 'full':
+        cache = modelCache(model_config.cache['directory'],
+                           model_config.cache['max_size_mb'])
+        cache_key = cacheKey(model_config, conference_week)
 
-    addVacation(rules, model_config.residents)
-    #hardcoding USCAP at week 38
-    addConferenceWeek(rules, model_config.residents, 38)
+    rules = configRules(model_config, profile)
 
-    m.build_model(model_config.residents,
-                  model_config.services)
+    if args.verify:
+        schedule = read_schedule_csv(args.verify,
+                                     model_config.residents,
+                                     model_config.services,
+                                     m.n_weeks)
+        verifier = scheduleVerifier(rules,
+                                    model_config.residents,
+                                    model_config.services)
+        issues = verifier.check(schedule)
+        scores = verifier.score(schedule[None])
+        print("Max hours per 6 week interval: {:.1f}".format(scores['max_hours_per_interval'][0]))
+        print("Max avg hours per year: {:.1f}".format(scores['max_avg_hours_per_year'][0]))
+        if issues:
+            print("Schedule violations:")
+            for issue in issues:
+                print("  "+issue)
+            sys.exit(1)
+        print("Schedule satisfies the configuration")
+        sys.exit(0)
 
-    for r in rules:
-        r.addRuleToModel(m,
-                         model_config.residents,
-                         model_config.services)
+    try:
+        domain = configDomain(model_config, rules, profile)
+    except FeasibilityException as e:
+        print("Infeasible configuration:")
+        for issue in e.issues:
+            print("  "+issue)
+        sys.exit(1)
+    if args.check:
+        printDiagnosis(diagnoseInfeasibility(model_config.gurobi, model_config.model, rules,
+                                             model_config.residents,
+                                             model_config.services,
+                                             interval_cap=model_config.optimization[
+                                                 'max_hours_per_interval']))
+        sys.exit(0)
 
-    m.optimize(model_config.residents,
-               model_config.services)
+    previous = cache.solution(cache_key) if cache is not None else None
+    start = startSchedule(model_config, rules, domain, profile, previous)
+    m = solveHorizon(model_config, rules, domain, start, m, profile, cache, cache_key)
+
+    if provedInfeasible(model_config, m):
+        print("Model is infeasible, relaxing the rules")
+        printDiagnosis(infeasibleConflicts(model_config, rules, m))
+        sys.exit(1)
+    if not hasSchedule(m):
+        print("No schedule found (status {:d})".format(m.model.Status))
+        sys.exit(1)
+
+    if cache is not None:
+        cache.storeSolution(cache_key, m.assignment())
 
     print("Optimization Complete")
     print("Max hours per 6 week interval: {:.1f}".format(m.max_avg_hours_per_interval))
     print("Max avg hours per year: {:.1f}".format(m.max_avg_hours_per_year))
 
-    m.write_csv(model_config.output_filename,
-                model_config.residents,
-                model_config.services)
\ No newline at end of file
+    with timed(profile, 'export'):
+        assignment = m.assignment()
+        exportSchedule(model_config.output_filename,
+                       model_config.output_formats,
+                       assignment,
+                       model_config.residents,
+                       model_config.services)
+        if model_config.hours_filename:
+            write_hours_csv(model_config.hours_filename,
+                            assignment,
+                            model_config.residents,
+                            model_config.services)
+
+    if model_config.pool:
+        if model_config.optimization['horizon'] != 'full' \
+           or model_config.optimization['backend'] != 'gurobi':
+            print("The solution pool needs the full Gurobi solve, skipping it")
+        else:
+            # the pool re-solves m, so it runs after the primary export
+            with timed(profile, 'pool'):
+                pool = diversePool(**model_config.pool).collect(m)
+                written = exportPool(model_config.output_filename,
+                                     model_config.output_formats,
+                                     pool,
+                                     model_config.residents,
+                                     model_config.services,
+                                     model_config.hours_filename)
+            print("Pooled {:d} schedules: {:}".format(len(pool), ", ".join(written)))
+
+    if progress is not None:
+        progress.close()
+    if profile is not None:
+        profile.print_summary()
+        if model_config.profile['report']:
+            profile.write(model_config.profile['report'])
\ No newline at end of file
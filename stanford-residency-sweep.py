@@ -0,0 +1,26 @@
+import argparse
+import os.path
+
+from src.sweep import sweepSpec, runSweep, writeSweep
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Solve a grid of scenarios over a base config')
+    parser.add_argument('SWEEP_FILE', type=str,
+                        help='yaml file with the base config and scenario grid')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per core, at most one per scenario)')
+    parser.add_argument('--cores', type=int, default=None,
+                        help='cores to split between workers (default: all)')
+    args = parser.parse_args()
+
+    assert os.path.exists(args.SWEEP_FILE)
+
+    spec = sweepSpec(args.SWEEP_FILE)
+    results = runSweep(spec, args.workers, args.cores)
+    keys = writeSweep(spec.output, results)
+
+    print(' '.join('{:>14}'.format(k) for k in keys))
+    for res in results:
+        print(' '.join('{:>14.3f}'.format(res[k]) if isinstance(res.get(k), float)
+                       else '{:>14}'.format(str(res.get(k, ''))) for k in keys))
+    print("Comparison written to {:}".format(spec.output))